@@ -0,0 +1,318 @@
+#!/bin/env python
+#
+#          Benchmark the generated serializer and parser of one type
+#
+#     Build the codecs of an IDL with rpcgenerate, encode random values
+#     of one of its types into a message and decode them back, and print
+#     a JSON line with the microseconds each value took either way and
+#     the bytes it encoded to. The default is struct s of lotsofstuff.idl
+#     and its int m3[4][10][100]. The decoded values must encode to the
+#     same message again.
+#
+#     --baseline-generator names an rpcgenerate.py to compare with, such
+#     as one from an earlier revision taken with git show. Both encode
+#     the same values; the line also says whether their messages are
+#     byte for byte the same and how much faster this one is.
+#
+#     --compress also times deflating the message and inflating it back
+#     with zlib at Z_BEST_SPEED, as --compress messages are, and gives
+#     the bytes each value deflated to. break_even_mbps is the link speed
+#     below which the bytes saved take longer to send than compressing
+#     them took.
+#
+import argparse
+import io
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import rpcgenerate
+from rpcgenbench import load_generator
+from rpcgenerate import format_array_arg, format_array_funname
+from rpcgenerate import fill_value, standalone_exception
+
+RPCGENERATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "rpcgenerate.py")
+
+# <codecbench> <values> <seconds> <message file>: encode and decode the
+# values repeatedly for at least that many seconds each, and save the
+# message encoded
+codec_bench_main = \
+    """
+static double secondsSince(steady_clock::time_point start)
+{
+    return duration<double>(steady_clock::now() - start).count();
+}
+
+int main(int argc, char *argv[])
+{
+    size_t count = strtoul(argv[1], NULL, 10);
+    double minSeconds = strtod(argv[2], NULL);
+    mt19937 rng(1);
+    typedef %(value_ty)s;
+    unique_ptr<Value[]> values(new Value[count]);
+    unique_ptr<Value[]> decoded(new Value[count]);
+    for (size_t i = 0; i < count; i++)
+    {
+%(fill)s    }
+    auto encode = [count](const unique_ptr<Value[]> &from, string &msg)
+    {
+        msg.clear();
+        for (size_t i = 0; i < count; i++)
+        {
+%(separator)s            serialize_%(funname)s(msg, from[i]);
+        }
+    };
+
+    string msg;
+    size_t rounds = 0;
+    steady_clock::time_point start = steady_clock::now();
+    do
+    {
+        encode(values, msg);
+        rounds++;
+    } while (secondsSince(start) < minSeconds);
+    double encodeUs = secondsSince(start) * 1e6 / (rounds * count);
+
+    rounds = 0;
+    start = steady_clock::now();
+    do
+    {
+        const char *strm = msg.c_str();
+        const char *end = strm + msg.length();
+        (void)end; // parsers of earlier generators read to the terminator
+        for (size_t i = 0; i < count; i++)
+            %(parse)s
+        rounds++;
+    } while (secondsSince(start) < minSeconds);
+    double decodeUs = secondsSince(start) * 1e6 / (rounds * count);
+
+    string again;
+    encode(decoded, again);
+    if (again != msg)
+    {
+        fprintf(stderr, "values do not round trip\\n");
+        return 1;
+    }
+    FILE *out = fopen(argv[3], "wb");
+    if (out == NULL || fwrite(msg.data(), 1, msg.length(), out) !=
+        msg.length() || fclose(out) != 0)
+        return 1;
+    printf("{\\"encode_us\\": %%.3f, \\"decode_us\\": %%.3f, "
+           "\\"bytes_per_value\\": %%zu}\\n",
+           encodeUs, decodeUs, msg.length() / count);
+%(compress)s    return 0;
+}
+"""
+
+# With --compress, time deflating msg as compressMessage does and
+# inflating it back, printing a second JSON line
+compress_bench = \
+    """
+    string packed(compressBound(msg.length()), '\\0');
+    uLongf packedLength = 0;
+    rounds = 0;
+    start = steady_clock::now();
+    do
+    {
+        packedLength = packed.length();
+        if (compress2((Bytef *)&packed[0], &packedLength,
+                      (const Bytef *)msg.data(), msg.length(),
+                      Z_BEST_SPEED) != Z_OK)
+            return 1;
+        rounds++;
+    } while (secondsSince(start) < minSeconds);
+    double compressUs = secondsSince(start) * 1e6 / (rounds * count);
+
+    string unpacked(msg.length(), '\\0');
+    rounds = 0;
+    start = steady_clock::now();
+    do
+    {
+        uLongf unpackedLength = unpacked.length();
+        if (uncompress((Bytef *)&unpacked[0], &unpackedLength,
+                       (const Bytef *)packed.data(), packedLength) != Z_OK ||
+            unpackedLength != msg.length())
+            return 1;
+        rounds++;
+    } while (secondsSince(start) < minSeconds);
+    double decompressUs = secondsSince(start) * 1e6 / (rounds * count);
+    if (unpacked != msg)
+    {
+        fprintf(stderr, "message does not inflate back\\n");
+        return 1;
+    }
+    printf("{\\"compress_us\\": %.3f, \\"decompress_us\\": %.3f, "
+           "\\"compressed_bytes_per_value\\": %.1f}\\n",
+           compressUs, decompressUs, (double)packedLength / count);
+"""
+
+
+# The builtins fill_value draws from rng, the same values whichever
+# generator's codecs are timed
+bench_values = \
+    """
+static inline int randomInt(mt19937 &rng)
+{
+    return (int)rng();
+}
+
+static inline float randomFloat(mt19937 &rng)
+{
+    return (float)((int)(rng() % 2000001) - 1000000) / 64;
+}
+
+static inline string randomString(mt19937 &rng)
+{
+    return string(rng() % 16, (char)('a' + rng() % 26));
+}
+"""
+
+
+# Source of a program timing the codecs generator writes for ty, and with
+# compress zlib on the message they encode
+def codec_bench_source(generator, idl, ty, flags, compress=False):
+    options = generator.parse_args(flags + [idl])
+    # Null terminated text streams strings ahead through the proxy's
+    # socket; length framing encodes the same bytes into msg alone
+    if getattr(options, "framing", "length") == "null":
+        options.framing = "length"
+    decls = generator.parse_idl(idl)
+    x = generator.ProxyGenerator(idl, options)
+    x.decls = decls
+
+    f = io.StringIO()
+    libraries = ["stdio.h", "stdlib.h", "cstdio", "cstring", "string",
+                 "cstdint", "memory", "random", "chrono"]
+    if compress:
+        libraries.append("zlib.h")
+    f.writelines("#include <" + lib + ">\n" for lib in libraries)
+    f.write("using namespace std;\n")
+    f.write("using namespace std::chrono;\n")
+    f.write(standalone_exception)
+    f.write("#include \"" + os.path.basename(idl) + "\"\n")
+    generator.forward_declarations(x, f, decls)
+    if options.wire == "binary":
+        f.write(rpcgenerate.uint32_helpers)
+    x.write_builtin_parsers(f)
+    x.write_builtin_serializers(f)
+    x.write_type_codecs(f)
+    f.write(bench_values)
+
+    funname = format_array_funname(ty)
+    if ty[:2] == "__":
+        value_ty = format_array_arg("Value", ty)
+    else:
+        value_ty = ty + " Value"
+    separator = ""
+    if options.wire == "text":
+        separator = "            if (i > 0)\n                msg += ' ';\n"
+    f.write(codec_bench_main % {
+        "value_ty": value_ty, "funname": funname, "separator": separator,
+        "fill": fill_value(ty, decls, "values[i]", "        "),
+        "parse": generator.parse_into(ty, "decoded[i]"),
+        "compress": compress_bench if compress else ""})
+    return f.getvalue()
+
+
+# Build and run the benchmark of generator, returning its result and the
+# message it encoded
+def run_codec_bench(generator, name, args, workdir):
+    directory = os.path.join(workdir, name)
+    os.makedirs(directory)
+    idl = os.path.join(directory, os.path.basename(args.idl))
+    shutil.copyfile(args.idl, idl)
+    source = os.path.join(directory, "codecbench.cpp")
+    with open(source, "w") as f:
+        f.write(codec_bench_source(generator, idl, args.type,
+                                   shlex.split(args.rpcgen_flags),
+                                   args.compress))
+    program = os.path.join(directory, "codecbench")
+    command = [args.cxx] + shlex.split(args.cxxflags) + \
+        ["-o", program, source] + (["-lz"] if args.compress else [])
+    build = subprocess.run(command, stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT, universal_newlines=True)
+    if build.returncode != 0:
+        raise Exception("cannot build " + program + ":\n" + build.stdout)
+    message = os.path.join(directory, "message")
+    output = subprocess.check_output(
+        [program, str(args.values), str(args.seconds), message],
+        universal_newlines=True)
+    result = {}
+    for line in output.splitlines():
+        result.update(json.loads(line))
+    with open(message, "rb") as f:
+        return result, f.read()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Time the generated serializer and parser of an IDL "
+        "type, printing a JSON line")
+    parser.add_argument("--idl", default=os.path.join("idl",
+                                                      "lotsofstuff.idl"),
+                        help="IDL declaring the type (default: "
+                        "idl/lotsofstuff.idl)")
+    parser.add_argument("--type", default="s",
+                        help="type to time, e.g. s or __int[4][10][100] "
+                        "(default: s)")
+    parser.add_argument("--rpcgen-flags", default="",
+                        help="options for rpcgenerate, e.g. --wire=binary")
+    parser.add_argument("--generator", default=RPCGENERATE,
+                        help="rpcgenerate.py whose codecs are timed "
+                        "(default: this one)")
+    parser.add_argument("--baseline-generator",
+                        help="rpcgenerate.py to compare with")
+    parser.add_argument("--compress", action="store_true",
+                        help="also time deflating and inflating the "
+                        "message with zlib")
+    parser.add_argument("--values", type=int, default=100,
+                        help="values encoded into one message "
+                        "(default: 100)")
+    parser.add_argument("--seconds", type=float, default=1.0,
+                        help="least time spent encoding and decoding "
+                        "(default: 1)")
+    parser.add_argument("--cxx", default="g++")
+    parser.add_argument("--cxxflags", default="-O2 -Wall -Werror -std=c++11",
+                        help="compiler flags (default: -O2 -Wall -Werror "
+                        "-std=c++11)")
+    args = parser.parse_args(argv)
+    if args.values < 1:
+        parser.error("--values must be at least 1")
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    with tempfile.TemporaryDirectory(prefix="codecbench") as workdir:
+        result, message = run_codec_bench(load_generator(args.generator),
+                                          "generator", args, workdir)
+        result["type"] = args.type
+        if args.compress:
+            # bits saved per value over the microseconds spent on them
+            saved = result["bytes_per_value"] - \
+                result["compressed_bytes_per_value"]
+            result["break_even_mbps"] = round(max(saved, 0) * 8 / (
+                result["compress_us"] + result["decompress_us"]), 1)
+        if args.baseline_generator:
+            baseline, baseline_message = run_codec_bench(
+                load_generator(args.baseline_generator), "baseline", args,
+                workdir)
+            result["baseline_encode_us"] = baseline["encode_us"]
+            result["baseline_decode_us"] = baseline["decode_us"]
+            result["encode_speedup"] = round(
+                baseline["encode_us"] / result["encode_us"], 2)
+            result["decode_speedup"] = round(
+                baseline["decode_us"] / result["decode_us"], 2)
+            result["same_encoding"] = message == baseline_message
+    print(json.dumps(result))
+    if args.baseline_generator and not result["same_encoding"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/bin/env python
+#
+#          Benchmark generated proxies and stubs end to end
+#
+#     For every IDL, generate its proxy and stub with rpcgenerate and
+#     build a server from the stub, an implementation of each function
+#     that returns its first argument of the return type (or a default
+#     value), and the framework's rpcserver.cpp, and a client from the
+#     proxy. The client calls every function --calls times on loopback
+#     with random arguments, after a tenth as many untimed calls. Prints
+#     one JSON line per function with its calls per second, its median
+#     and 99th percentile latency in microseconds, and the bytes of
+#     arguments and results per call, as --metrics counts them. Void
+#     functions get no reply, so their calls end once the request is
+#     sent.
+#
+#     --baseline names the output of an earlier run, such as one with
+#     the generator of an earlier revision or other --rpcgen-flags. Each
+#     line then also gives the baseline's calls per second and the
+#     speedup over it, and with --max-slowdown the run fails if a
+#     function got slower than that.
+#
+#     Building needs the COMP 150 RPC framework as the Makefile does:
+#     $COMP117, and the framework's rpcproxyhelper.cpp, rpcstubhelper.cpp
+#     and rpcserver.cpp, in the repository root or --framework-sources.
+#
+import argparse
+import io
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import rpcgenerate
+from codecbench import bench_values
+from rpcgenerate import fill_value, format_array_arg
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RPCGENERATE = os.path.join(ROOT, "rpcgenerate.py")
+
+# <client> <server> <calls>: time calls of each function, then print the
+# proxy's metrics
+bench_client_main = \
+    """
+// Time calls of one function, after a tenth as many untimed ones
+template <typename Call>
+static void bench(const char *name, size_t calls, Call call)
+{
+    for (size_t i = 0; i < calls / 10 + 1; i++)
+        call();
+    vector<uint64_t> latencies(calls);
+    steady_clock::time_point start = steady_clock::now();
+    for (size_t i = 0; i < calls; i++)
+    {
+        steady_clock::time_point before = steady_clock::now();
+        call();
+        latencies[i] = duration_cast<nanoseconds>(steady_clock::now() -
+                                                  before).count();
+    }
+    double seconds = duration<double>(steady_clock::now() - start).count();
+    sort(latencies.begin(), latencies.end());
+    printf("{\\"function\\": \\"%%s\\", \\"calls\\": %%zu, "
+           "\\"calls_per_sec\\": %%.1f, \\"p50_us\\": %%.3f, "
+           "\\"p99_us\\": %%.3f}\\n",
+           name, calls, calls / seconds, latencies[calls / 2] / 1e3,
+           latencies[(calls * 99 + 99) / 100 - 1] / 1e3);
+}
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    size_t calls = strtoul(argv[2], NULL, 10);
+    mt19937 rng(1);
+%(functions)s
+    printf("%%s\\n", rpcMetricsJson().c_str());
+    return 0;
+}
+"""
+
+
+# Definitions of the functions of decls, each returning its first
+# argument of the return type or else a value initialized one
+def implementation_source(idl, decls, x):
+    f = io.StringIO()
+    f.write("#include <string>\nusing namespace std;\n")
+    f.write("#include \"" + os.path.basename(idl) + "\"\n")
+    for name, sig in sorted(decls["functions"].items()):
+        return_ty = sig["return_type"]
+        f.write("\n" + return_ty + " " + name + "(" +
+                x.function_params(sig) + ")\n{\n")
+        for arg in sig["arguments"]:
+            f.write("\t(void)" + arg["name"] + ";\n")
+        if return_ty != "void":
+            echoed = [arg["name"] for arg in sig["arguments"]
+                      if arg["type"] == return_ty]
+            f.write("\treturn " + (echoed[0] if echoed else
+                                   return_ty + "()") + ";\n")
+        f.write("}\n")
+    return f.getvalue()
+
+
+# Client timing every function of decls, with arguments filled once
+def client_source(idl, decls):
+    f = io.StringIO()
+    libraries = ["cstdio", "cstdlib", "cstdint", "string", "vector",
+                 "algorithm", "random", "chrono"]
+    f.writelines("#include <" + lib + ">\n" for lib in libraries)
+    f.write("using namespace std;\n")
+    f.write("using namespace std::chrono;\n")
+    f.write("#include \"rpcproxyhelper.h\"\n")
+    f.write("using namespace C150NETWORK;\n")
+    f.write("#include \"" + os.path.basename(idl) + "\"\n\n")
+    f.write("string rpcMetricsJson();\n")
+    f.write(bench_values)
+
+    functions = ""
+    for name, sig in sorted(decls["functions"].items()):
+        functions += "    {\n"
+        for arg in sig["arguments"]:
+            if arg["type"][:2] == "__":
+                functions += "        static " + \
+                    format_array_arg(arg["name"], arg["type"]) + ";\n"
+            else:
+                functions += "        " + arg["type"] + " " + \
+                    arg["name"] + ";\n"
+        for arg in sig["arguments"]:
+            functions += fill_value(arg["type"], decls, arg["name"],
+                                    "        ")
+        args = ", ".join(arg["name"] for arg in sig["arguments"])
+        functions += "        bench(\"" + name + "\", calls, [&]() { " + \
+            name + "(" + args + "); });\n"
+        functions += "    }\n"
+    f.write(bench_client_main % {"functions": functions})
+    return f.getvalue()
+
+
+def compile_program(args, output, sources, libs):
+    c150lib = os.path.join(args.comp117, "files", "c150Utils")
+    c150idsrpc = os.path.join(args.comp117, "files", "RPC.framework")
+    command = [args.cxx] + shlex.split(args.cxxflags) + \
+        ["-I" + args.framework_sources, "-I" + c150idsrpc, "-I" + c150lib,
+         "-o", output] + \
+        sources + [os.path.join(c150lib, "c150ids.a"),
+                   os.path.join(c150idsrpc, "c150idsrpc.a"), "-pthread"] + \
+        libs
+    build = subprocess.run(command, stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT, universal_newlines=True)
+    if build.returncode != 0:
+        raise Exception("cannot build " + output + ":\n" + build.stdout)
+    return output
+
+
+# Build the server and client of one IDL in workdir, run them and return
+# a result per function
+def bench_idl(idl, args, workdir):
+    directory = os.path.join(workdir, os.path.splitext(
+        os.path.basename(idl))[0])
+    os.makedirs(directory)
+    copy = os.path.join(directory, os.path.basename(idl))
+    shutil.copyfile(idl, copy)
+    flags = shlex.split(args.rpcgen_flags) + ["--metrics"]
+    subprocess.run([sys.executable, args.generator] + flags + [copy],
+                   check=True)
+    stem = os.path.splitext(copy)[0]
+    decls = rpcgenerate.parse_idl(copy)
+    x = rpcgenerate.ProxyGenerator(copy, rpcgenerate.parse_args(
+        flags + [copy]))
+
+    implementation = stem + ".impl.cpp"
+    with open(implementation, "w") as f:
+        f.write(implementation_source(copy, decls, x))
+    client = stem + ".client.cpp"
+    with open(client, "w") as f:
+        f.write(client_source(copy, decls))
+    libs = ["-lz"] if "--compress" in flags else []
+    if x.transport == "shm":
+        libs.append("-lrt")
+    server = compile_program(args, stem + "server", [
+        stem + ".stub.cpp", implementation,
+        os.path.join(args.framework_sources, "rpcserver.cpp"),
+        os.path.join(args.framework_sources, "rpcstubhelper.cpp")], libs)
+    client = compile_program(args, stem + "client", [
+        client, stem + ".proxy.cpp",
+        os.path.join(args.framework_sources, "rpcproxyhelper.cpp")], libs)
+
+    process = subprocess.Popen([server], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(args.server_startup)
+        output = subprocess.check_output(
+            [client, args.server, str(args.calls)], universal_newlines=True)
+    finally:
+        process.kill()
+        process.wait()
+
+    *lines, metrics = output.splitlines()
+    metrics = json.loads(metrics)
+    results = []
+    for line in lines:
+        result = json.loads(line)
+        counts = metrics[result["function"]]
+        result["idl"] = os.path.basename(idl)
+        result["bytes_out_per_call"] = counts["bytes_out"] / counts["calls"]
+        result["bytes_in_per_call"] = counts["bytes_in"] / counts["calls"]
+        results.append(result)
+    return results
+
+
+# Results of an earlier run by IDL and function
+def load_baseline(path):
+    baseline = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                baseline[result["idl"], result["function"]] = result
+    return baseline
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Time calls of every function of IDLs through their "
+        "generated proxies and stubs, printing a JSON line per function")
+    parser.add_argument("idl", nargs="*", default=[os.path.join(ROOT, "idl")],
+                        help="IDL files to time, or directories whose .idl "
+                        "files all are (default: idl)")
+    parser.add_argument("--calls", type=int, default=1000,
+                        help="timed calls of each function (default: 1000)")
+    parser.add_argument("--rpcgen-flags", default="",
+                        help="options for rpcgenerate, e.g. "
+                        "\"--wire=binary --framing=length\"")
+    parser.add_argument("--generator", default=RPCGENERATE,
+                        help="rpcgenerate.py generating the code timed "
+                        "(default: this one)")
+    parser.add_argument("--baseline",
+                        help="output of an earlier run to compare with")
+    parser.add_argument("--max-slowdown", type=float, metavar="PERCENT",
+                        help="fail if a function makes fewer calls per "
+                        "second than in --baseline by more than this")
+    parser.add_argument("--server", default="localhost",
+                        help="name the client connects to (default: "
+                        "localhost)")
+    parser.add_argument("--server-startup", type=float, default=0.5,
+                        help="seconds the server is given to start "
+                        "listening (default: 0.5)")
+    parser.add_argument("--comp117", default=os.environ.get("COMP117", ""),
+                        help="COMP 150 course directory holding the RPC "
+                        "framework (default: $COMP117)")
+    parser.add_argument("--framework-sources", default=ROOT, metavar="DIR",
+                        help="directory holding the framework's "
+                        "rpcproxyhelper.cpp, rpcstubhelper.cpp and "
+                        "rpcserver.cpp (default: the repository root)")
+    parser.add_argument("--cxx", default="g++")
+    parser.add_argument("--cxxflags", default="-O2 -Wall -Werror -std=c++11",
+                        help="compiler flags (default: -O2 -Wall -Werror "
+                        "-std=c++11)")
+    args = parser.parse_args(argv)
+    if args.calls < 1:
+        parser.error("--calls must be at least 1")
+    if args.max_slowdown is not None and args.baseline is None:
+        parser.error("--max-slowdown requires --baseline")
+    args.generator = os.path.abspath(args.generator)
+    args.framework_sources = os.path.abspath(args.framework_sources)
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    slower = []
+    with tempfile.TemporaryDirectory(prefix="rpcbench") as workdir:
+        for idl in rpcgenerate.idl_files(args.idl):
+            if not rpcgenerate.parse_idl(idl)["functions"]:
+                continue
+            for result in bench_idl(idl, args, workdir):
+                before = baseline.get((result["idl"], result["function"]))
+                if before is not None:
+                    result["baseline_calls_per_sec"] = \
+                        before["calls_per_sec"]
+                    result["speedup"] = round(
+                        result["calls_per_sec"] / before["calls_per_sec"], 2)
+                    if args.max_slowdown is not None and \
+                            result["speedup"] < \
+                            1 - args.max_slowdown / 100:
+                        slower.append(result)
+                print(json.dumps(result))
+                sys.stdout.flush()
+    for result in slower:
+        print("%s %s: %.1f%% slower than the baseline" % (
+            result["idl"], result["function"],
+            100 * (1 - result["speedup"])), file=sys.stderr)
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
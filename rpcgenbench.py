@@ -0,0 +1,178 @@
+#!/bin/env python
+#
+#          Benchmark rpcgenerate itself
+#
+#     For every IDL, time parsing it in process against running
+#     idl_to_json on it, and time whole rpcgenerate runs from process
+#     start with either parser, the idl_to_json cache cleared before
+#     each. Prints one JSON line per IDL with the best time of --runs
+#     runs of each, in milliseconds.
+#
+#     With --synthetic N, time instead generating the proxy and stub of
+#     an IDL of N functions and N structs, some wide and some holding
+#     [4][10][100] arrays. --generator names another rpcgenerate.py to
+#     time, such as one from an earlier revision, for before and after
+#     numbers.
+#
+import argparse
+import importlib.util
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import rpcgenerate
+
+RPCGENERATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "rpcgenerate.py")
+
+
+# Best wall time of runs calls of f, in milliseconds
+def best_ms(f, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return round(best * 1e3, 3)
+
+
+# Time one IDL, copied into workdir next to a copy of idl_to_json as
+# rpcgenerate expects to find it
+def bench_startup(idl, workdir, runs):
+    copy = os.path.join(workdir, os.path.basename(idl))
+    shutil.copyfile(idl, copy)
+    name = os.path.basename(idl)
+    cache = os.path.join(workdir, rpcgenerate.IDL_CACHE_DIR)
+
+    def run_rpcgenerate(parser):
+        shutil.rmtree(cache, ignore_errors=True)
+        subprocess.run([sys.executable, RPCGENERATE, "--parser=" + parser,
+                        name], cwd=workdir, check=True)
+
+    return {
+        "idl": name,
+        "python_parse_ms": best_ms(lambda: rpcgenerate.parse_idl(copy),
+                                   runs),
+        "idl_to_json_ms": best_ms(lambda: subprocess.run(
+            [os.path.join(workdir, "idl_to_json"), name], cwd=workdir,
+            stdout=subprocess.DEVNULL, check=True), runs),
+        "rpcgenerate_python_ms": best_ms(lambda: run_rpcgenerate("python"),
+                                         runs),
+        "rpcgenerate_idl_to_json_ms": best_ms(
+            lambda: run_rpcgenerate("idl_to_json"), runs),
+    }
+
+
+# IDL of count structs and count functions. Structs nest up to ten deep,
+# every 50th holds a [4][10][100] array and one has 1000 members.
+def synthetic_idl(count):
+    lines = []
+    for i in range(count):
+        members = ["int a;", "float b;", "string c;"]
+        if i % 10 != 0:
+            members.append("t%d prev;" % (i - 1))
+        if i % 50 == 0:
+            members.append("int grid[4][10][100];")
+        if i == count // 2:
+            members += ["int w%d;" % j for j in range(1000)]
+        lines.append("struct t%d {\n  %s\n};" % (i, "\n  ".join(members)))
+    returns = ["int", "float", "string", "void"]
+    for i in range(count):
+        if i % 5 == 4:
+            ret = "t%d" % i
+        else:
+            ret = returns[i % 4]
+        lines.append("%s f%d(t%d x, int n[%d], float m[3][%d], string s);" %
+                     (ret, i, i, i % 7 + 1, i % 5 + 1))
+    return "\n".join(lines) + "\n"
+
+
+def load_generator(path):
+    spec = importlib.util.spec_from_file_location("rpcgenerate_under_test",
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Time generating the proxy and stub of a synthetic IDL with generator,
+# an rpcgenerate module
+def bench_synthetic(count, generator, flags, workdir, runs):
+    idl = os.path.join(workdir, "synthetic%d.idl" % count)
+    with open(idl, "w") as f:
+        f.write(synthetic_idl(count))
+    options = generator.parse_args(flags + [idl])
+
+    def run():
+        # unchanged files are not rewritten, so start from none
+        for suffix in [".proxy.cpp", ".stub.cpp"]:
+            output = os.path.splitext(idl)[0] + suffix
+            if os.path.exists(output):
+                os.unlink(output)
+        error = generator.generate(idl, options)
+        if error is not None:
+            raise Exception(error)
+
+    result = {"idl": os.path.basename(idl), "generate_ms": best_ms(run, runs)}
+    for suffix in [".proxy.cpp", ".stub.cpp"]:
+        output = os.path.splitext(idl)[0] + suffix
+        result[suffix[1:-4] + "_bytes"] = os.path.getsize(output)
+    return result
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Time rpcgenerate's IDL parsers and startup, printing "
+        "a JSON line per IDL")
+    parser.add_argument("idl", nargs="*", default=["idl"],
+                        help="IDL files to time, or directories whose .idl "
+                        "files all are (default: idl)")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="runs of each measurement, the best of which "
+                        "is reported (default: 10)")
+    parser.add_argument("--idl-to-json", default="idl_to_json",
+                        help="idl_to_json program to compare with "
+                        "(default: idl_to_json)")
+    parser.add_argument("--synthetic", type=int, metavar="N",
+                        help="time generating an IDL of N functions and "
+                        "N structs instead")
+    parser.add_argument("--generator", default=RPCGENERATE,
+                        help="rpcgenerate.py to time with --synthetic "
+                        "(default: this one)")
+    parser.add_argument("--rpcgen-flags", default="",
+                        help="options for rpcgenerate with --synthetic, "
+                        "e.g. \"--wire=binary --framing=length\"")
+    args = parser.parse_args(argv)
+    if args.runs < 1:
+        parser.error("--runs must be at least 1")
+    if args.synthetic is not None and args.synthetic < 1:
+        parser.error("--synthetic must be at least 1")
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    with tempfile.TemporaryDirectory(prefix="rpcgenbench") as workdir:
+        if args.synthetic is not None:
+            generator = load_generator(args.generator)
+            print(json.dumps(bench_synthetic(
+                args.synthetic, generator, shlex.split(args.rpcgen_flags),
+                workdir, args.runs)))
+            return
+        idl_to_json = os.path.join(workdir, "idl_to_json")
+        shutil.copyfile(args.idl_to_json, idl_to_json)
+        os.chmod(idl_to_json, 0o755)
+        for idl in rpcgenerate.idl_files(args.idl):
+            print(json.dumps(bench_startup(idl, workdir, args.runs)))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
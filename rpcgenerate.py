@@ -1,681 +1,4506 @@
 #!/bin/env python
 import subprocess
 import os
+import io
 import json
 import sys
+import argparse
+import hashlib
+import keyword
+import re
+import textwrap
+from concurrent.futures import ProcessPoolExecutor
 
 IDL_TO_JSON_EXECUTABLE = './idl_to_json'
+# Parsed IDLs, keyed by the hashes of the IDL and of idl_to_json
+IDL_CACHE_DIR = '.rpcgenerate-cache'
+# Wire formats the generated proxies and stubs can speak; text is the default
+WIRE_FORMATS = ["text", "binary"]
+# IDL front ends: in process (default) or the idl_to_json executable
+IDL_PARSERS = ["python", "idl_to_json"]
+# Message framings: null terminated (default) or length prefixed headers
+FRAMINGS = ["null", "length"]
+# Message transports: the socket (default), or shared memory rings for
+# clients on the server's host
+TRANSPORTS = ["socket", "shm"]
+# Headers the shared memory transport needs on either side
+SHM_LIBRARIES = ["atomic", "cerrno", "climits", "new", "algorithm", "cstdint",
+                 "fcntl.h", "signal.h", "unistd.h", "sys/mman.h", "sys/stat.h",
+                 "sys/syscall.h", "linux/futex.h"]
+# Builtins are parsed by value, structs are decoded in place
+BUILTIN_TYPES = ["int", "float", "string"]
+# Parameters through which every generated parser reads its input: a
+# cursor, and the end of the payload that no value may run past
+PARSER_STREAM = "const char *&strm, const char *end"
 # Array variable names for generic templated array parsers
 ARRAY_SIZE_VARS = ['X', 'Y', 'Z', 'A', 'B', 'C', 'D', 'E',
                    'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q']
 # Parsers for Builtin Types
 int_parser = \
     """
-int parse_int(stringstream &strm)
+int parse_int(const char *&strm, const char *end)
 {
-    int x;
-    strm >> x;
-    return x;
+    while (strm < end && *strm == ' ')
+        strm++;
+    bool negative = strm < end && *strm == '-';
+    if (negative)
+        strm++;
+    const char *digits = strm;
+    unsigned int x = 0;
+    while (strm < end && *strm >= '0' && *strm <= '9')
+        x = x * 10 + (*strm++ - '0');
+    if (strm == digits)
+        throw C150Exception("rpc: message holds no int where one belongs");
+    return negative ? (int)(0u - x) : (int)x;
 }
 """
 
+# Text payloads are NUL terminated at their end, where strtof stops
 float_parser = \
     """
-float parse_float(stringstream &strm)
+float parse_float(const char *&strm, const char *end)
 {
-    float x;
-    strm >> x;
+    char *stop;
+    float x = strtof(strm, &stop);
+    if (stop == strm || stop > end)
+        throw C150Exception("rpc: message holds no float where one belongs");
+    strm = stop;
     return x;
 }
 """
 
 string_parser = \
     """
-string parse_string(stringstream &strm)
+string parse_string(const char *&strm, const char *end)
 {
-    int length;
-    strm >> length;
-    string s;
-    strm.ignore(1);
-    s.resize(length);
-    strm.read(&s[0], length);
+    int length = parse_int(strm, end);
+    // the space after the length, then the characters
+    if (length < 0 || end - strm - 1 < length)
+        throw C150Exception("rpc: string runs past the end of the message");
+    strm++;
+    string s(strm, length);
+    strm += length;
     return s;
 }
 """
 
-# Serializers from Builtin Types
+# Serializers from Builtin Types, each appends to the caller's buffer
 int_serializer = \
     """
-string serialize_int(int x)
+void serialize_int(string &msg, int x)
 {
-    return to_string(x);
+    // digits are produced backwards from the end of buf
+    char buf[16];
+    char *end = buf + sizeof(buf);
+    char *p = end;
+    unsigned int v = x < 0 ? 0u - (unsigned int)x : (unsigned int)x;
+    do
+    {
+        *--p = (char)('0' + v % 10);
+        v /= 10;
+    } while (v != 0);
+    if (x < 0)
+        *--p = '-';
+    msg.append(p, end - p);
 }
 """
 
+# Nine significant digits, which always read back as the same float
 float_serializer = \
     """
-string serialize_float(float x)
+void serialize_float(string &msg, float x)
+{
+    char buf[32];
+    msg.append(buf, snprintf(buf, sizeof(buf), "%.9g", x));
+}
+"""
+
+# Exact hexadecimal floats for --hex-floats, read back by strtof too
+hex_float_serializer = \
+    """
+void serialize_float(string &msg, float x)
 {
-    return to_string(x);
+    char buf[32];
+    msg.append(buf, snprintf(buf, sizeof(buf), "%a", x));
 }
 """
 
 string_serializer = \
     """
-string serialize_string(string s)
+void serialize_string(string &msg, const string &s)
 {
-    string msg;
-    msg += to_string(s.length());
-    msg += \" \";
+    char buf[24];
+    msg.append(buf, snprintf(buf, sizeof(buf), "%zu ", s.length()));
     msg += s;
-    return msg;
 }
 """
 
-bad_function = \
+# Text strings of null terminated messages, which send long strings
+# straight from s instead of copying them into the message
+streamed_string_serializer = \
     """
-void __badFunction(char *functionName)
+void serialize_string(string &msg, const string &s)
 {
-    exit(EXIT_FAILURE);
+    char buf[24];
+    msg.append(buf, snprintf(buf, sizeof(buf), "%zu ", s.length()));
+    if (s.length() < SEND_CHUNK_SIZE)
+        msg += s;
+    else
+        sendAhead(msg, s);
+}
+"""
+
+# Fixed-width little-endian helpers shared by binary values and headers
+uint32_helpers = \
+    """
+void put_uint32(string &msg, uint32_t v)
+{
+    char bytes[4];
+    bytes[0] = (char)(v & 0xff);
+    bytes[1] = (char)((v >> 8) & 0xff);
+    bytes[2] = (char)((v >> 16) & 0xff);
+    bytes[3] = (char)((v >> 24) & 0xff);
+    msg.append(bytes, 4);
+}
+
+// Overwrite the 4 bytes at pos, used to fill in reserved length fields
+void set_uint32(string &msg, size_t pos, uint32_t v)
+{
+    msg[pos] = (char)(v & 0xff);
+    msg[pos + 1] = (char)((v >> 8) & 0xff);
+    msg[pos + 2] = (char)((v >> 16) & 0xff);
+    msg[pos + 3] = (char)((v >> 24) & 0xff);
+}
+
+uint32_t get_uint32(const char *&strm)
+{
+    const unsigned char *p = (const unsigned char *)strm;
+    uint32_t v = (uint32_t)p[0] | ((uint32_t)p[1] << 8) |
+                 ((uint32_t)p[2] << 16) | ((uint32_t)p[3] << 24);
+    strm += 4;
+    return v;
+}
 
+// The same from a payload ending at end, which it may not run past
+uint32_t get_uint32(const char *&strm, const char *end)
+{
+    if (end - strm < 4)
+        throw C150Exception("rpc: message ends inside a value");
+    return get_uint32(strm);
 }
 """
 
-get_data_from_stream = \
+binary_helpers = \
     """
-void getDataFromStream(char *buffer, unsigned int bufSize)
+static_assert(sizeof(int) == 4 && sizeof(float) == 4,
+              "binary wire format assumes 32 bit int and float");
+
+// Binary messages are sent as a 4 byte length followed by the payload
+string readFrame()
+{
+    char header[4];
+    readExactly(header, sizeof(header));
+    const char *hp = header;
+    uint32_t length = get_uint32(hp);
+    if (length > RPC_MAX_MESSAGE_SIZE)
+        throw C150Exception("rpc: message longer than RPC_MAX_MESSAGE_SIZE");
+    string payload(length, '\\0');
+    if (!payload.empty())
+        readExactly(&payload[0], payload.length());
+    return payload;
+}
+
+// Reserve the length field; endFrame fills it in once the payload has
+// been serialized after it, refusing payloads it cannot hold
+size_t beginFrame(string &msg)
+{
+    size_t start = msg.length();
+    msg.append(4, '\\0');
+    return start;
+}
+
+void endFrame(string &msg, size_t start)
+{
+    size_t length = msg.length() - start - 4;
+    if (length > UINT32_MAX)
+        throw C150Exception("rpc: message longer than its length field holds");
+    set_uint32(msg, start, length);
+}
+"""
+
+# Length framed messages start with a 12 byte header holding the payload
+# length, the function id and a request id that the reply echoes, and are
+# read into a reusable buffer
+length_framing = \
+    """
+const size_t FRAME_HEADER_SIZE = 12;
+
+// Grows to fit each payload received, and shrinks back once one fitting
+// RPC_RETAINED_BUFFER_SIZE follows a larger one. Payloads are NUL
+// terminated so text parsers stop at their end.
+static vector<char> messageBuffer(1);
+
+// Append a header whose length endMessage fills in once the payload has
+// been serialized after it, refusing payloads it cannot hold
+size_t beginMessage(string &msg, uint32_t functionId, uint32_t requestId)
+{
+    size_t start = msg.length();
+    put_uint32(msg, 0);
+    put_uint32(msg, functionId);
+    put_uint32(msg, requestId);
+    return start;
+}
+
+void endMessage(string &msg, size_t start)
+{
+    size_t length = msg.length() - start - FRAME_HEADER_SIZE;
+    if (length > UINT32_MAX)
+        throw C150Exception("rpc: message longer than its length field holds");
+    set_uint32(msg, start, length);
+}
+
+// Read the next message into messageBuffer, returning its payload length
+uint32_t readMessage(uint32_t &functionId, uint32_t &requestId)
+{
+    char header[FRAME_HEADER_SIZE];
+    readExactly(header, FRAME_HEADER_SIZE);
+    const char *hp = header;
+    uint32_t length = get_uint32(hp);
+    functionId = get_uint32(hp);
+    requestId = get_uint32(hp);
+    if (length > RPC_MAX_MESSAGE_SIZE)
+        throw C150Exception("rpc: message longer than RPC_MAX_MESSAGE_SIZE");
+    if (length >= messageBuffer.size())
+        messageBuffer.resize(length + 1);
+    else if (messageBuffer.size() > RPC_RETAINED_BUFFER_SIZE &&
+             length < RPC_RETAINED_BUFFER_SIZE)
+        vector<char>(RPC_RETAINED_BUFFER_SIZE).swap(messageBuffer);
+    readExactly(&messageBuffer[0], length);
+    messageBuffer[length] = '\\0';
+    return unpackPayload(functionId, messageBuffer, length);
+}
+"""
+
+# Hook run on every length framed payload received, which --compress
+# replaces with unpack_payload
+no_compression = \
+    """
+template <class Buffer>
+uint32_t unpackPayload(uint32_t &, Buffer &, uint32_t length)
+{
+    return length;
+}
+"""
+
+# Flag bits of the function id for --compress. Every message sent
+# carries RPC_ACCEPTS_COMPRESSED, and a side only compresses once the
+# message it answers or the last reply it got carried it.
+compression_flags = \
+    """
+const uint32_t RPC_COMPRESSED = 0x40000000;
+const uint32_t RPC_ACCEPTS_COMPRESSED = 0x20000000;
+"""
+
+# The proxy learns from replies read by one thread and sends from others
+proxy_compression_state = \
+    """
+static atomic<bool> peerAcceptsCompression(false);
+"""
+
+# The stub answers each request according to its own flags
+stub_compression_state = \
+    """
+static thread_local bool peerAcceptsCompression = false;
+"""
+
+unpack_payload = \
+    """
+// Inflate a payload compressed by compressMessage, NUL terminated like
+// any other, and clear the compression flags from functionId. Returns
+// the payload length, which leaves out the NUL.
+template <class Buffer>
+uint32_t unpackPayload(uint32_t &functionId, Buffer &payload, uint32_t length)
+{
+    peerAcceptsCompression = (functionId & RPC_ACCEPTS_COMPRESSED) != 0;
+    bool compressed = (functionId & RPC_COMPRESSED) != 0;
+    functionId &= ~(RPC_COMPRESSED | RPC_ACCEPTS_COMPRESSED);
+    if (!compressed)
+        return length;
+    if (length < 4)
+        throw C150Exception("rpc: truncated compressed payload");
+    const char *p = &payload[0];
+    uint32_t originalLength = get_uint32(p);
+    if (originalLength > RPC_MAX_MESSAGE_SIZE)
+        throw C150Exception("rpc: message longer than RPC_MAX_MESSAGE_SIZE");
+    Buffer unpacked;
+    unpacked.resize(originalLength + 1);
+    uLongf unpackedLength = originalLength;
+    if (uncompress((Bytef *)&unpacked[0], &unpackedLength, (const Bytef *)p,
+                   length - 4) != Z_OK ||
+        unpackedLength != originalLength)
+        throw C150Exception("rpc: corrupt compressed payload");
+    unpacked[originalLength] = '\\0';
+    payload.swap(unpacked);
+    return originalLength;
+}
+"""
+
+compress_message = \
+    """
+// Called after endMessage: flag msg as able to take compressed replies,
+// and once the peer takes them too deflate a payload of at least
+// rpcCompressionThreshold bytes behind its original length, if that
+// makes it smaller
+void compressMessage(string &msg, size_t start)
 {
-    unsigned int i;
-    char *bufp; // next char to read
-    bool readnull;
-    ssize_t readlen; // amount of data read from socket
+    const char *hp = msg.data() + start;
+    uint32_t length = get_uint32(hp);
+    uint32_t functionId = get_uint32(hp) | RPC_ACCEPTS_COMPRESSED;
+    if (peerAcceptsCompression &&
+        length >= rpcCompressionThreshold.load(memory_order_relaxed))
+    {
+        static thread_local string packed;
+        uLongf packedLength = compressBound(length);
+        packed.resize(4 + packedLength);
+        set_uint32(packed, 0, length);
+        if (compress2((Bytef *)&packed[4], &packedLength,
+                      (const Bytef *)msg.data() + start + FRAME_HEADER_SIZE,
+                      length, Z_BEST_SPEED) == Z_OK &&
+            4 + packedLength < length)
+        {
+            msg.resize(start + FRAME_HEADER_SIZE);
+            msg.append(packed, 0, 4 + packedLength);
+            set_uint32(msg, start, 4 + packedLength);
+            functionId |= RPC_COMPRESSED;
+        }
+    }
+    set_uint32(msg, start + 4, functionId);
+}
+"""
+
+# Request id of the message being dispatched, echoed in its reply
+stub_request_id = \
+    """
+static thread_local uint32_t currentRequestId = 0;
+"""
 
-    readnull = false;
-    bufp = buffer;
-    for (i = 0; i < bufSize; i++)
+# Client runtime for --pool: persistent connections to the server, each
+# able to carry many calls at once with replies matched by request id
+connection_pool = \
+    """
+bool readFromSocket(C150StreamSocket *sock, char *buffer, size_t length)
+{
+    while (length > 0)
     {
-        readlen = RPCSTUBSOCKET->read(bufp, 1); // read a byte
-        // check for eof or error
+        ssize_t readlen = sock->read(buffer, length);
         if (readlen == 0)
+            return false;
+        buffer += readlen;
+        length -= readlen;
+    }
+    return true;
+}
+
+// Called on the reader thread with the reply to a request sent with it,
+// or with NULL if the connection is lost before the reply arrives
+typedef function<void(const string *reply)> RPCReplyHandler;
+
+// A connection shared by every thread that picks it. A reader thread
+// collects replies as they arrive, so the server is never left blocked
+// on a reply while the client is still sending requests.
+class RPCConnection
+{
+public:
+    RPCConnection(C150StreamSocket *sock)
+        : sock(sock), nextRequestId(1), broken(false)
+    {
+        thread(&RPCConnection::readReplies, this).detach();
+    }
+
+    // Send a message built with beginMessage/endMessage, stamping it with
+    // a fresh request id that wait() takes to collect the reply
+    uint32_t send(string &msg)
+    {
+        lock_guard<mutex> guard(writeLock);
+        uint32_t requestId = nextRequestId++;
+        set_uint32(msg, 8, requestId);
+        sock->write(msg.data(), msg.length());
+        return requestId;
+    }
+
+    // Send msg like send(msg), handing its reply to onReply instead of
+    // keeping it for wait()
+    void send(string &msg, const RPCReplyHandler &onReply)
+    {
+        lock_guard<mutex> guard(writeLock);
+        uint32_t requestId = nextRequestId++;
         {
-            break;
+            lock_guard<mutex> handlerGuard(lock);
+            if (broken)
+            {
+                onReply(NULL);
+                return;
+            }
+            handlers[requestId] = onReply;
         }
-        // check for null and bump buffer pointer
-        if (*bufp++ == '\\0')
+        set_uint32(msg, 8, requestId);
+        try
         {
-            readnull = true;
-            break;
+            sock->write(msg.data(), msg.length());
+        }
+        catch (...)
+        {
+            lock_guard<mutex> handlerGuard(lock);
+            handlers.erase(requestId);
+            throw;
         }
     }
 
-    if (readlen == 0)
+    // Block until the reply to requestId arrives
+    void wait(uint32_t requestId, string &reply)
     {
-        if (RPCSTUBSOCKET->eof())
+        unique_lock<mutex> guard(lock);
+        while (true)
         {
-            c150debug->printf(C150RPCDEBUG, "stub: EOF signaled on input");
+            map<uint32_t, string>::iterator it = replies.find(requestId);
+            if (it != replies.end())
+            {
+                reply.swap(it->second);
+                replies.erase(it);
+                return;
+            }
+            if (broken)
+                throw C150Exception("proxy: connection to server lost");
+            replied.wait(guard);
         }
-        else
+    }
+
+private:
+    void readReplies()
+    {
+        while (true)
+        {
+            uint32_t requestId = 0;
+            string payload;
+            bool ok = readReply(requestId, payload);
+            RPCReplyHandler onReply;
+            map<uint32_t, RPCReplyHandler> orphaned;
+            {
+                lock_guard<mutex> guard(lock);
+                map<uint32_t, RPCReplyHandler>::iterator it =
+                    handlers.find(requestId);
+                if (!ok)
+                {
+                    broken = true;
+                    orphaned.swap(handlers);
+                }
+                else if (it != handlers.end())
+                {
+                    onReply.swap(it->second);
+                    handlers.erase(it);
+                }
+                else
+                    replies[requestId].swap(payload);
+                replied.notify_all();
+            }
+            // handlers run unlocked, so they may send further requests
+            if (onReply)
+                onReply(&payload);
+            for (auto &handler : orphaned)
+                handler.second(NULL);
+            if (!ok)
+                return;
+        }
+    }
+
+    bool readReply(uint32_t &requestId, string &payload)
+    {
+        try
+        {
+            char header[FRAME_HEADER_SIZE];
+            if (!readFromSocket(sock, header, FRAME_HEADER_SIZE))
+                return false;
+            const char *hp = header;
+            uint32_t length = get_uint32(hp);
+            uint32_t functionId = get_uint32(hp);
+            requestId = get_uint32(hp);
+            if (length > RPC_MAX_MESSAGE_SIZE)
+                return false;
+            payload.resize(length);
+            if (!payload.empty() &&
+                !readFromSocket(sock, &payload[0], payload.length()))
+                return false;
+            payload.resize(
+                unpackPayload(functionId, payload, payload.length()));
+            return true;
+        }
+        catch (C150Exception &e)
         {
-            throw C150Exception("stub: unexpected zero length read without eof");
+            return false;
         }
     }
 
-    else if (!readnull)
-        throw C150Exception("stub: data received not null terminated or too long");
+    C150StreamSocket *sock;
+    mutex writeLock; // keeps concurrent requests from interleaving
+    mutex lock;      // guards everything below
+    condition_variable replied;
+    uint32_t nextRequestId;
+    bool broken;
+    map<uint32_t, string> replies; // arrived but not yet collected
+    map<uint32_t, RPCReplyHandler> handlers; // sent with a handler
+};
 
+static vector<RPCConnection *> rpcConnections;
+static atomic<size_t> rpcNextConnection(0);
+
+// Open count connections using connectToServer, which returns a newly
+// connected socket. Call before any RPC; calls are then spread over the
+// connections round robin.
+void rpcPoolInitialize(size_t count, C150StreamSocket *(*connectToServer)())
+{
+    for (size_t i = 0; i < count; i++)
+        rpcConnections.push_back(new RPCConnection(connectToServer()));
+}
+
+// Without rpcPoolInitialize all calls share RPCPROXYSOCKET. Like the
+// pool it is never freed, as its reader thread runs until exit.
+RPCConnection &rpcConnection()
+{
+    if (rpcConnections.empty())
+    {
+        static RPCConnection *defaultConnection =
+            new RPCConnection(RPCPROXYSOCKET);
+        return *defaultConnection;
+    }
+    return *rpcConnections[rpcNextConnection++ % rpcConnections.size()];
 }
 """
 
-# Checks if filename specified on command line is valid
+# Reply path for --server-runtime: workers answer on the connection the
+# request came in on, dispatchFunction still answers on RPCSTUBSOCKET
+server_reply = \
+    """
+struct RPCServerConnection
+{
+    RPCServerConnection(int fd) : fd(fd), failed(false) {}
+    ~RPCServerConnection() { close(fd); }
 
+    int fd;
+    string input;       // received bytes not yet split into requests
+    mutex writeLock;    // keeps replies from concurrent workers apart
+    atomic<bool> failed; // a request failed, the client is being dropped
+};
 
-def is_file_valid(filename):
-    if (not os.path.isfile(filename)):
-        print("Path %s does not designate a file" % filename, file=sys.stderr)
-        raise Exception("No file named " + filename)
-    if (not os.access(filename, os.R_OK)):
-        print("File %s is not readable" % filename, file=sys.stderr)
-        raise Exception("File " + filename + " not readable")
-    if (not os.path.isfile(IDL_TO_JSON_EXECUTABLE)):
-        print("Path %s does not designate a file...run \"make\" to create it" %
-              IDL_TO_JSON_EXECUTABLE, file=sys.stderr)
-        raise Exception("No file named " + IDL_TO_JSON_EXECUTABLE)
+// Connection the current worker is serving, NULL in dispatchFunction
+static thread_local RPCServerConnection *currentConnection = NULL;
 
-    if (not os.access(IDL_TO_JSON_EXECUTABLE, os.X_OK)):
-        print("File %s exists but is not executable" %
-              IDL_TO_JSON_EXECUTABLE, file=sys.stderr)
-        raise Exception("File " + IDL_TO_JSON_EXECUTABLE + " not executable")
+void rpcReply(const string &msg)
+{
+    if (currentConnection == NULL)
+    {
+        RPCSTUBSOCKET->write(msg.data(), msg.length());
+        return;
+    }
+    lock_guard<mutex> guard(currentConnection->writeLock);
+    const char *p = msg.data();
+    size_t left = msg.length();
+    while (left > 0)
+    {
+        ssize_t written = send(currentConnection->fd, p, left, MSG_NOSIGNAL);
+        if (written < 0 && errno == EINTR)
+            continue;
+        if (written < 0)
+            return; // client went away, nobody to reply to
+        p += written;
+        left -= written;
+    }
+}
+"""
 
+# Server runtime for --server-runtime: one epoll thread accepts
+# connections and splits their input into requests, and a pool of
+# worker threads runs the requests through the dispatch table
+server_queue = \
+    """
+struct RPCJob
+{
+    shared_ptr<RPCServerConnection> conn;
+    uint32_t functionId;
+    uint32_t requestId;
+    string payload;
+};
 
-def array_type(ty):
-    end_pos = ty.find("[")
-    return ty[2:end_pos]
+static mutex jobLock;
+static condition_variable jobReady;
+static deque<RPCJob> jobs;
 
-# Return array size in a list up to N dimensions
+RPCJob nextJob()
+{
+    unique_lock<mutex> guard(jobLock);
+    while (jobs.empty())
+        jobReady.wait(guard);
+    RPCJob job = std::move(jobs.front());
+    jobs.pop_front();
+    return job;
+}
 
+// Move every complete request at the front of conn's input to the queue.
+// Returns false, failing conn, if a request is longer than
+// RPC_MAX_MESSAGE_SIZE.
+bool queueRequests(const shared_ptr<RPCServerConnection> &conn)
+{
+    string &input = conn->input;
+    size_t pos = 0;
+    while (input.length() - pos >= FRAME_HEADER_SIZE)
+    {
+        const char *hp = input.data() + pos;
+        uint32_t length = get_uint32(hp);
+        if (length > RPC_MAX_MESSAGE_SIZE)
+        {
+            c150debug->printf(C150RPCDEBUG,
+                              "server: dropping client, request too long");
+            conn->failed = true;
+            return false;
+        }
+        if (input.length() - pos - FRAME_HEADER_SIZE < length)
+            break;
+        RPCJob job;
+        job.conn = conn;
+        job.functionId = get_uint32(hp);
+        job.requestId = get_uint32(hp);
+        job.payload.assign(hp, length);
+        pos += FRAME_HEADER_SIZE + length;
 
-def array_size(ty):
-    ty = ty[2:]
-    ty = ty.replace("][", "_")
-    ty = ty.replace("[", "_")
-    ty = ty.replace("]", "")
-    l = ty.split("_")[1:]
-    return l
+        lock_guard<mutex> guard(jobLock);
+        jobs.push_back(std::move(job));
+        jobReady.notify_one();
+    }
+    input.erase(0, pos);
+    // give back what a long request took once it is queued
+    if (input.capacity() > RPC_RETAINED_BUFFER_SIZE &&
+        input.length() < RPC_RETAINED_BUFFER_SIZE)
+        input.shrink_to_fit();
+    return true;
+}
+"""
 
-# Format array parser and serializer function names
+server_loop = \
+    """
+// Serve RPCs on port until the process exits, running requests on the
+// given number of worker threads and accepting at most maxConnections
+// clients at once. The IDL function implementations must be safe to call
+// concurrently.
+void rpcServe(int port, size_t workers, size_t maxConnections)
+{
+    int listener = socket(AF_INET, SOCK_STREAM, 0);
+    if (listener < 0)
+        throw C150Exception("server: cannot create listening socket");
+    int on = 1;
+    if (setsockopt(listener, SOL_SOCKET, SO_REUSEADDR, &on, sizeof(on)) < 0)
+        throw C150Exception("server: cannot set SO_REUSEADDR");
+    sockaddr_in addr;
+    memset(&addr, 0, sizeof(addr));
+    addr.sin_family = AF_INET;
+    addr.sin_addr.s_addr = htonl(INADDR_ANY);
+    addr.sin_port = htons(port);
+    if (::bind(listener, (sockaddr *)&addr, sizeof(addr)) < 0)
+        throw C150Exception("server: cannot bind requested port");
+    if (listen(listener, SOMAXCONN) < 0)
+        throw C150Exception("server: cannot listen on requested port");
 
+    int epfd = epoll_create1(0);
+    if (epfd < 0)
+        throw C150Exception("server: cannot create epoll instance");
+    epoll_event event;
+    event.events = EPOLLIN;
+    event.data.fd = listener;
+    if (epoll_ctl(epfd, EPOLL_CTL_ADD, listener, &event) < 0)
+        throw C150Exception("server: cannot watch listening socket");
 
-def format_array_funname(ty):
-    dimension = len(ty.split("[")) - 1
-    # string replace "][" with "_"
-    if ty[:2] == "__":
-        ty = ty[2:]
-    ty = ty.replace("][", "_")
-    # string replace "[" with "_"
-    ty = ty.replace("[", str(dimension) + "DArray_")
-    # string replace "]" with "_array_"
-    ty = ty.replace("]", "")
-    return ty
+    for (size_t i = 0; i < workers; i++)
+        thread(rpcWorker).detach();
 
+    map<int, shared_ptr<RPCServerConnection> > connections;
+    epoll_event events[64];
+    vector<char> buffer(65536);
+    while (true)
+    {
+        int count = epoll_wait(epfd, events, 64, -1);
+        for (int i = 0; i < count; i++)
+        {
+            int fd = events[i].data.fd;
+            if (fd == listener)
+            {
+                int client = accept(listener, NULL, NULL);
+                if (client < 0)
+                    continue;
+                if (connections.size() >= maxConnections)
+                {
+                    close(client);
+                    continue;
+                }
+                event.events = EPOLLIN;
+                event.data.fd = client;
+                if (epoll_ctl(epfd, EPOLL_CTL_ADD, client, &event) < 0)
+                {
+                    // a client that cannot be watched is turned away
+                    close(client);
+                    continue;
+                }
+                connections[client] = make_shared<RPCServerConnection>(client);
+                continue;
+            }
 
-def format_array_arg(n, ty):
-    start = ty.find("[")
-    end = len(ty)
-    return array_type(ty) + " " + n + ty[start:end]
+            ssize_t readlen = read(fd, &buffer[0], buffer.size());
+            if (readlen < 0 && errno == EINTR)
+                continue;
+            if (readlen <= 0)
+            {
+                // the socket closes once queued requests are done with it
+                epoll_ctl(epfd, EPOLL_CTL_DEL, fd, NULL);
+                connections.erase(fd);
+                continue;
+            }
+            connections[fd]->input.append(&buffer[0], readlen);
+            if (!queueRequests(connections[fd]))
+            {
+                // closed once queued requests are done with it, as above
+                epoll_ctl(epfd, EPOLL_CTL_DEL, fd, NULL);
+                connections.erase(fd);
+            }
+        }
+    }
+}
+"""
 
+binary_int_parser = \
+    """
+int parse_int(const char *&strm, const char *end)
+{
+    return (int)get_uint32(strm, end);
+}
+"""
 
-def forward_declarations(x, f, decls):
-    for ty, sig in decls["types"].items():
-        if sig["type_of_type"] == "struct":
-            f.write(struct_serializer_fdecl(ty, sig) + ";\n")
-            f.write(struct_parser_fdecl(ty, sig) + ";\n")
-        elif sig["type_of_type"] == "array":
-            f.write(array_serializer_fdecl(ty, sig) + ";\n")
+binary_float_parser = \
+    """
+float parse_float(const char *&strm, const char *end)
+{
+    uint32_t v = get_uint32(strm, end);
+    float x;
+    memcpy(&x, &v, sizeof(x));
+    return x;
+}
+"""
 
-            dimension = len(ty.split("[")) - 1
-            array_ty = array_type(ty)
-            if (dimension, array_ty) not in x.array_dimensions:
-                f.write(array_parser_fdecl(
-                    ty, sig, dimension, array_ty) + ";\n")
-                x.array_dimensions.add((dimension, array_ty))
-        elif sig["type_of_type"] == "builtin":
-            continue
-    f.write("\n")
+binary_string_parser = \
+    """
+string parse_string(const char *&strm, const char *end)
+{
+    uint32_t length = get_uint32(strm, end);
+    if (length > (size_t)(end - strm))
+        throw C150Exception("rpc: string runs past the end of the message");
+    string s(strm, length);
+    strm += length;
+    return s;
+}
+"""
 
+binary_int_serializer = \
+    """
+void serialize_int(string &msg, int x)
+{
+    put_uint32(msg, (uint32_t)x);
+}
+"""
 
-def array_parser_fdecl(ty, sig, dimension, array_ty):
-    template_decl = "template <"
-    array_size = ""
-    for i in range(dimension):
-        template_decl += "int " + ARRAY_SIZE_VARS[i]
-        array_size += "[" + ARRAY_SIZE_VARS[i] + "]"
+binary_float_serializer = \
+    """
+void serialize_float(string &msg, float x)
+{
+    uint32_t v;
+    memcpy(&v, &x, sizeof(v));
+    put_uint32(msg, v);
+}
+"""
 
-        if i != dimension - 1:
-            template_decl += ", "
-    template_decl += ">\n"
+binary_string_serializer = \
+    """
+void serialize_string(string &msg, const string &s)
+{
+    put_uint32(msg, s.length());
+    msg += s;
+}
+"""
 
-    fundecl = "void parse_" + array_ty + \
-        str(dimension) + "DArray(stringstream &strm, " + \
-        array_ty + " " + "(&array)" + array_size + ")"
-    return template_decl + fundecl
+BUILTIN_PARSERS = {
+    "text": [int_parser, float_parser, string_parser],
+    "binary": [binary_int_parser, binary_float_parser, binary_string_parser],
+}
+BUILTIN_SERIALIZERS = {
+    "text": [int_serializer, float_serializer, string_serializer],
+    "binary": [binary_int_serializer, binary_float_serializer,
+               binary_string_serializer],
+}
 
+find_handler = \
+    """
+RPCHandler findHandler(const char *functionName)
+{
+    size_t low = 0;
+    size_t high = DISPATCH_TABLE_SIZE;
+    while (low < high)
+    {
+        size_t mid = (low + high) / 2;
+        int cmp = strcmp(functionName, dispatchTable[mid].name);
+        if (cmp == 0)
+            return dispatchTable[mid].handler;
+        if (cmp < 0)
+            high = mid;
+        else
+            low = mid + 1;
+    }
+    return NULL;
+}
+"""
 
-def array_serializer_fdecl(ty, sig):
-    size_list = array_size(ty)
+# With --function-ids the proxy sends the id as decimal text in place of
+# the function name
+find_handler_by_id = \
+    """
+RPCHandler findHandlerById(const char *functionId)
+{
+    char *end;
+    unsigned long id = strtoul(functionId, &end, 10);
+    if (end == functionId || *end != '\\0' || id >= DISPATCH_TABLE_SIZE)
+        return NULL;
+    return dispatchTable[id].handler;
+}
+"""
+
+bad_function = \
+    """
+void __badFunction(char *functionName)
+{
+    exit(EXIT_FAILURE);
+
+}
+"""
+
+get_data_from_stream = \
+    """
+// Bytes received on RPCSTUBSOCKET but not yet consumed. Whatever follows
+// the current message stays here for the next call, so pipelined requests
+// are not lost.
+const size_t STREAM_CHUNK_SIZE = 65536;
+static vector<char> streamBuffer(STREAM_CHUNK_SIZE);
+static size_t streamStart = 0; // first unconsumed byte
+static size_t streamEnd = 0;   // one past the last buffered byte
+
+// Read the next chunk from the socket, returns false on eof
+bool fillStreamBuffer()
+{
+    // move unconsumed bytes to the front, growing if the buffer is full
+    // and shrinking back once a long message has been consumed
+    if (streamStart > 0)
+    {
+        memmove(&streamBuffer[0], &streamBuffer[streamStart],
+                streamEnd - streamStart);
+        streamEnd -= streamStart;
+        streamStart = 0;
+    }
+    if (streamEnd == streamBuffer.size())
+        streamBuffer.resize(streamBuffer.size() * 2);
+    else if (streamBuffer.size() > STREAM_CHUNK_SIZE &&
+             streamEnd < STREAM_CHUNK_SIZE)
+    {
+        vector<char> chunk(STREAM_CHUNK_SIZE);
+        memcpy(&chunk[0], &streamBuffer[0], streamEnd);
+        streamBuffer.swap(chunk);
+    }
+
+    ssize_t readlen = stubRead(&streamBuffer[streamEnd],
+                               streamBuffer.size() - streamEnd);
+    if (readlen == 0)
+    {
+        if (RPCSTUBSOCKET->eof())
+        {
+            c150debug->printf(C150RPCDEBUG, "stub: EOF signaled on input");
+            streamStart = streamEnd = 0;
+            return false;
+        }
+        throw C150Exception("stub: unexpected zero length read without eof");
+    }
+    streamEnd += readlen;
+    return true;
+}
+
+// Copy the next null terminated string, including the null, into buffer
+void getDataFromStream(char *buffer, unsigned int bufSize)
+{
+    size_t scanned = 0; // buffered bytes already known not to be null
+
+    while (true)
+    {
+        char *start = &streamBuffer[streamStart];
+        size_t available = streamEnd - streamStart;
+        char *null = (char *)memchr(start + scanned, '\\0',
+                                    available - scanned);
+        if (null != NULL)
+        {
+            size_t length = null - start + 1;
+            if (length > bufSize)
+                break;
+            memcpy(buffer, start, length);
+            streamStart += length;
+            return;
+        }
+        if (available >= bufSize)
+            break;
+        scanned = available;
+        if (!fillStreamBuffer())
+        {
+            *buffer = '\\0';
+            return;
+        }
+    }
+
+    throw C150Exception("stub: data received not null terminated or too long");
+}
+
+// The next null terminated message, parsed where it lies in streamBuffer
+// and valid until the stream is read again, and in end its terminator.
+// Empty at eof.
+const char *nextMessage(const char *&end)
+{
+    size_t scanned = 0; // buffered bytes already known not to be null
+
+    while (true)
+    {
+        char *start = streamBuffer.data() + streamStart;
+        size_t available = streamEnd - streamStart;
+        char *null = (char *)memchr(start + scanned, '\\0',
+                                    available - scanned);
+        size_t length = null != NULL ? null - start : available;
+        if (length > RPC_MAX_MESSAGE_SIZE)
+            throw C150Exception(
+                "stub: message longer than RPC_MAX_MESSAGE_SIZE");
+        if (null != NULL)
+        {
+            streamStart += length + 1;
+            end = null;
+            return start;
+        }
+        scanned = available;
+        if (!fillStreamBuffer())
+        {
+            end = "";
+            return end;
+        }
+    }
+}
+
+// True if the connection closed before another message started
+bool endOfStream()
+{
+    return streamStart == streamEnd && !fillStreamBuffer();
+}
+
+void readExactly(char *buffer, size_t length)
+{
+    while (true)
+    {
+        size_t count = min(length, streamEnd - streamStart);
+        memcpy(buffer, &streamBuffer[streamStart], count);
+        streamStart += count;
+        buffer += count;
+        length -= count;
+        if (length == 0)
+            return;
+        if (!fillStreamBuffer())
+            throw C150Exception("stub: message truncated by eof");
+    }
+}
+"""
+
+# Outgoing messages are serialized into one buffer that keeps its capacity
+# between calls and is sent with a single write, unless send_ahead sends
+# it in chunks
+send_buffer = \
+    """
+static thread_local string sendBuffer;
+"""
+
+
+# Null terminated messages need no length up front, so serializers send
+# what they have built every SEND_CHUNK_SIZE bytes. The send buffer stays
+# small and the peer starts reading while the rest is serialized.
+def send_ahead(socket):
+    return """
+const size_t SEND_CHUNK_SIZE = 65536;
+
+// Counts the bytes of messages sent before they were complete
+static size_t bytesSentAhead = 0;
+
+// Send msg, the start of a message still being serialized, and then s
+void sendAhead(string &msg, const string &s = string())
+{
+    bytesSentAhead += msg.length() + s.length();
+    """ + socket + """->write(msg.data(), msg.length());
+    msg.clear();
+    if (!s.empty())
+        """ + socket + """->write(s.data(), s.length());
+}
+
+void streamChunk(string &msg)
+{
+    if (msg.length() >= SEND_CHUNK_SIZE)
+        sendAhead(msg);
+}
+"""
+
+
+# Bounds on what either side buffers of a message from its peer
+def message_limits(max_size):
+    return """
+// Longest message accepted from the peer; a longer one ends the
+// connection instead of being buffered
+const size_t RPC_MAX_MESSAGE_SIZE = """ + str(max_size) + """;
+// Receive buffers grown past this by a long message are shrunk back
+const size_t RPC_RETAINED_BUFFER_SIZE = 65536;
+"""
+
+
+# Null terminated text replies are read until their terminator into a
+# buffer that grows to fit the reply, and is shrunk back before the next
+# once it has grown past RPC_RETAINED_BUFFER_SIZE
+text_reply_reader = \
+    """
+static vector<char> replyBuffer(4096);
+
+// The reply, and in end its terminator
+const char *readTextReply(const char *&end)
+{
+    if (replyBuffer.size() > RPC_RETAINED_BUFFER_SIZE)
+        vector<char>(4096).swap(replyBuffer);
+    size_t length = 0;
+    while (length == 0 || replyBuffer[length - 1] != '\\0')
+    {
+        if (length == replyBuffer.size())
+            replyBuffer.resize(replyBuffer.size() * 2);
+        ssize_t readlen = RPCPROXYSOCKET->read(&replyBuffer[length],
+                                               replyBuffer.size() - length);
+        if (readlen == 0)
+            throw C150Exception("proxy: reply truncated by eof");
+        length += readlen;
+        if (length > RPC_MAX_MESSAGE_SIZE + 1)
+            throw C150Exception(
+                "proxy: reply longer than RPC_MAX_MESSAGE_SIZE");
+    }
+    end = &replyBuffer[length - 1];
+    return &replyBuffer[0];
+}
+"""
+
+# Binary and length framed replies are read with exact length reads
+proxy_read_exactly = \
+    """
+void readExactly(char *buffer, size_t length)
+{
+    while (length > 0)
+    {
+        ssize_t readlen = RPCPROXYSOCKET->read(buffer, length);
+        if (readlen == 0)
+            throw C150Exception("proxy: reply truncated by eof");
+        buffer += readlen;
+        length -= readlen;
+    }
+}
+"""
+
+# With --transport=shm the proxy reads replies from its shared memory
+# channel, defined after the length framing that uses readExactly
+proxy_read_exactly_declaration = \
+    """
+void readExactly(char *buffer, size_t length);
+"""
+
+# The stub reads what proxies send through stubRead, from RPCSTUBSOCKET
+# unless --transport=shm has a proxy's channel attached
+socket_stub_read = \
+    """
+static inline ssize_t stubRead(char *buffer, size_t length)
+{
+    return RPCSTUBSOCKET->read(buffer, length);
+}
+"""
+
+stub_read_declaration = \
+    """
+ssize_t stubRead(char *buffer, size_t length);
+"""
+
+
+# --transport=shm: once the proxy has asked the stub over the socket to
+# map a shared memory object, messages go through two single producer,
+# single consumer byte rings in it, one each way. A side waiting for
+# data or space spins briefly, then sleeps on a futex word of the ring;
+# its waits time out every 10ms to notice a peer that is gone.
+def shm_channel(ring_size):
+    return """
+const uint32_t RPC_SHM_ATTACH = 0x0fffffff;
+// Bytes of each ring, a power of two
+const size_t RPC_SHM_RING_SIZE = """ + str(ring_size) + """;
+// Polls of a ring before sleeping, where the peer can run meanwhile
+const int RPC_SHM_SPINS = 2000;
+static const int shmSpins = sysconf(_SC_NPROCESSORS_ONLN) > 1 ? RPC_SHM_SPINS
+                                                              : 0;
+
+static_assert(ATOMIC_LLONG_LOCK_FREE == 2 && ATOMIC_INT_LOCK_FREE == 2,
+              "shared memory rings need lock free atomics");
+
+// Positions count the bytes ever written and read, the writer's and the
+// reader's fields on cache lines of their own
+struct RPCShmRing
+{
+    alignas(64) atomic<uint64_t> head;
+    atomic<uint32_t> written; // bumped after each write
+    atomic<uint32_t> writerWaiting;
+    alignas(64) atomic<uint64_t> tail;
+    atomic<uint32_t> consumed; // bumped after each read
+    atomic<uint32_t> readerWaiting;
+};
+
+// Followed by the data of the request ring, then of the reply ring
+struct RPCShmHeader
+{
+    atomic<uint32_t> closed; // set by the proxy as it exits
+    int32_t proxyPid;
+    int32_t stubPid;
+    RPCShmRing requests;
+    RPCShmRing replies;
+};
+
+const size_t RPC_SHM_SIZE = sizeof(RPCShmHeader) + 2 * RPC_SHM_RING_SIZE;
+
+static void futexWait(atomic<uint32_t> &word, uint32_t seen)
+{
+    timespec timeout = {0, 10000000};
+    syscall(SYS_futex, (uint32_t *)&word, FUTEX_WAIT, seen, &timeout, NULL,
+            0);
+}
+
+static void futexWake(atomic<uint32_t> &word)
+{
+    syscall(SYS_futex, (uint32_t *)&word, FUTEX_WAKE, INT_MAX, NULL, NULL, 0);
+}
+
+class RPCShmChannel
+{
+  public:
+    RPCShmChannel(RPCShmHeader *header, bool proxy)
+        : header(header), in(proxy ? header->replies : header->requests),
+          out(proxy ? header->requests : header->replies),
+          peer(proxy ? header->stubPid : header->proxyPid)
+    {
+        char *rings = (char *)(header + 1);
+        inData = rings + (proxy ? RPC_SHM_RING_SIZE : 0);
+        outData = rings + (proxy ? 0 : RPC_SHM_RING_SIZE);
+    }
+
+    ~RPCShmChannel()
+    {
+        munmap(header, RPC_SHM_SIZE);
+    }
+
+    // Copy data into the outgoing ring, waiting for space as the peer
+    // reads once it is full
+    void write(const char *data, size_t length)
+    {
+        while (length > 0)
+        {
+            uint64_t head = out.head.load(memory_order_relaxed);
+            size_t space = 0;
+            if (!waitFor(out.consumed, out.writerWaiting, [&]()
+                         {
+                             uint64_t tail =
+                                 out.tail.load(memory_order_acquire);
+                             space = RPC_SHM_RING_SIZE - (head - tail);
+                             return space > 0;
+                         }))
+                throw C150Exception("rpc: shared memory peer is gone");
+            size_t count = min(length, space);
+            size_t offset = head & (RPC_SHM_RING_SIZE - 1);
+            size_t first = min(count, RPC_SHM_RING_SIZE - offset);
+            memcpy(outData + offset, data, first);
+            memcpy(outData, data + first, count - first);
+            out.head.store(head + count, memory_order_release);
+            out.written.fetch_add(1);
+            if (out.readerWaiting.load())
+                futexWake(out.written);
+            data += count;
+            length -= count;
+        }
+    }
+
+    // Copy up to length bytes from the incoming ring into buffer,
+    // waiting for at least one. Returns 0 once the peer is gone and the
+    // ring empty.
+    size_t read(char *buffer, size_t length)
+    {
+        uint64_t tail = in.tail.load(memory_order_relaxed);
+        size_t available = 0;
+        if (!waitFor(in.written, in.readerWaiting, [&]()
+                     {
+                         available = in.head.load(memory_order_acquire) - tail;
+                         return available > 0;
+                     }))
+            return 0;
+        size_t count = min(length, available);
+        size_t offset = tail & (RPC_SHM_RING_SIZE - 1);
+        size_t first = min(count, RPC_SHM_RING_SIZE - offset);
+        memcpy(buffer, inData + offset, first);
+        memcpy(buffer + first, inData, count - first);
+        in.tail.store(tail + count, memory_order_release);
+        in.consumed.fetch_add(1);
+        if (in.writerWaiting.load())
+            futexWake(in.consumed);
+        return count;
+    }
+
+    // Tell the stub the proxy is done with the channel
+    void close()
+    {
+        header->closed.store(1);
+        futexWake(header->requests.written);
+    }
+
+  private:
+    RPCShmHeader *header;
+    RPCShmRing &in;
+    RPCShmRing &out;
+    pid_t peer;
+    char *inData;
+    char *outData;
+
+    bool peerAlive()
+    {
+        return !header->closed.load() &&
+               (kill(peer, 0) == 0 || errno != ESRCH);
+    }
+
+    // Wait until ready(), returning false if the peer goes first. The
+    // waiting flag tells the peer to wake word once it makes progress.
+    template <class Ready>
+    bool waitFor(atomic<uint32_t> &word, atomic<uint32_t> &waiting,
+                 Ready ready)
+    {
+        for (int i = 0; i < shmSpins; i++)
+            if (ready())
+                return true;
+        while (true)
+        {
+            uint32_t seen = word.load();
+            if (ready())
+                return true;
+            waiting.store(1);
+            if (!ready())
+                futexWait(word, seen);
+            waiting.store(0);
+            if (ready())
+                return true;
+            if (!peerAlive())
+                return false;
+        }
+    }
+};
+"""
+
+
+# The proxy sets its channel up on first use: it creates the shared
+# memory object, asks the stub over RPCPROXYSOCKET to map it too, and
+# waits for the stub's empty answer before removing its name
+shm_proxy_transport = \
+    """
+static RPCShmChannel *shmChannel = NULL;
+
+static void closeShmChannel()
+{
+    shmChannel->close();
+}
+
+RPCShmChannel &rpcShmChannel()
+{
+    if (shmChannel != NULL)
+        return *shmChannel;
+    // a leftover object of this name belongs to a process that is gone
+    char name[32];
+    snprintf(name, sizeof(name), "/rpc-%d", (int)getpid());
+    shm_unlink(name);
+    int fd = shm_open(name, O_RDWR | O_CREAT | O_EXCL, 0600);
+    if (fd < 0)
+        throw C150Exception("proxy: cannot create shared memory channel");
+    void *memory = MAP_FAILED;
+    if (ftruncate(fd, RPC_SHM_SIZE) == 0)
+        memory = mmap(NULL, RPC_SHM_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED,
+                      fd, 0);
+    close(fd);
+    if (memory == MAP_FAILED)
+    {
+        shm_unlink(name);
+        throw C150Exception("proxy: cannot map shared memory channel");
+    }
+    RPCShmHeader *header = new (memory) RPCShmHeader();
+    header->proxyPid = getpid();
+
+    string msg;
+    size_t start = beginMessage(msg, RPC_SHM_ATTACH, 0);
+    msg += name;
+    endMessage(msg, start);
+    RPCPROXYSOCKET->write(msg.data(), msg.length());
+    char answer[FRAME_HEADER_SIZE];
+    size_t length = 0;
+    while (length < sizeof(answer))
+    {
+        ssize_t readlen = RPCPROXYSOCKET->read(answer + length,
+                                               sizeof(answer) - length);
+        if (readlen == 0)
+            break;
+        length += readlen;
+    }
+    shm_unlink(name);
+    const char *ap = answer + 4;
+    if (length < sizeof(answer) || get_uint32(ap) != RPC_SHM_ATTACH)
+    {
+        munmap(memory, RPC_SHM_SIZE);
+        throw C150Exception("proxy: stub did not map the shared memory "
+                            "channel");
+    }
+    shmChannel = new RPCShmChannel(header, true);
+    atexit(closeShmChannel);
+    return *shmChannel;
+}
+
+void rpcShmSend(const char *data, size_t length)
+{
+    rpcShmChannel().write(data, length);
+}
+
+void readExactly(char *buffer, size_t length)
+{
+    RPCShmChannel &channel = rpcShmChannel();
+    while (length > 0)
+    {
+        size_t readlen = channel.read(buffer, length);
+        if (readlen == 0)
+            throw C150Exception("proxy: reply truncated by eof");
+        buffer += readlen;
+        length -= readlen;
+    }
+}
+"""
+
+# The stub reads and writes its socket until a proxy asks it to map a
+# channel, and again once that proxy is done with it
+shm_stub_transport = \
+    """
+static RPCShmChannel *shmChannel = NULL;
+
+void rpcShmAttach(const char *name)
+{
+    int fd = shm_open(name, O_RDWR, 0);
+    if (fd < 0)
+        throw C150Exception("stub: cannot open shared memory channel");
+    struct stat st;
+    void *memory = MAP_FAILED;
+    if (fstat(fd, &st) == 0 && (size_t)st.st_size == RPC_SHM_SIZE)
+        memory = mmap(NULL, RPC_SHM_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED,
+                      fd, 0);
+    close(fd);
+    if (memory == MAP_FAILED)
+        throw C150Exception("stub: cannot map shared memory channel");
+    RPCShmHeader *header = (RPCShmHeader *)memory;
+    header->stubPid = getpid();
+    shmChannel = new RPCShmChannel(header, false);
+
+    string msg;
+    size_t start = beginMessage(msg, RPC_SHM_ATTACH, currentRequestId);
+    endMessage(msg, start);
+    RPCSTUBSOCKET->write(msg.data(), msg.length());
+}
+
+ssize_t stubRead(char *buffer, size_t length)
+{
+    if (shmChannel != NULL)
+    {
+        size_t readlen = shmChannel->read(buffer, length);
+        if (readlen > 0)
+            return readlen;
+        delete shmChannel;
+        shmChannel = NULL;
+    }
+    return RPCSTUBSOCKET->read(buffer, length);
+}
+
+void rpcShmSend(const char *data, size_t length)
+{
+    if (shmChannel != NULL)
+        shmChannel->write(data, length);
+    else
+        RPCSTUBSOCKET->write(data, length);
+}
+"""
+
+# Checks if filename specified on command line is valid
+
+
+def is_file_valid(filename, check_idl_to_json=True):
+    if (not os.path.isfile(filename)):
+        print("Path %s does not designate a file" % filename, file=sys.stderr)
+        raise Exception("No file named " + filename)
+    if (not os.access(filename, os.R_OK)):
+        print("File %s is not readable" % filename, file=sys.stderr)
+        raise Exception("File " + filename + " not readable")
+    if not check_idl_to_json:
+        return
+    if (not os.path.isfile(IDL_TO_JSON_EXECUTABLE)):
+        print("Path %s does not designate a file...run \"make\" to create it" %
+              IDL_TO_JSON_EXECUTABLE, file=sys.stderr)
+        raise Exception("No file named " + IDL_TO_JSON_EXECUTABLE)
+
+    if (not os.access(IDL_TO_JSON_EXECUTABLE, os.X_OK)):
+        print("File %s exists but is not executable" %
+              IDL_TO_JSON_EXECUTABLE, file=sys.stderr)
+        raise Exception("File " + IDL_TO_JSON_EXECUTABLE + " not executable")
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# In-process IDL front end, building the same {"types", "functions"}
+# dictionary that idl_to_json prints, without running it
+
+IDL_RESERVED_WORDS = ["struct", "int", "float", "string", "void"]
+IDL_BUILTINS = ["float", "int", "string", "void"]
+IDL_TOKEN = re.compile(r"[{}()\[\];,]|[^\s{}()\[\];,]+")
+IDL_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class IDLParser:
+    def __init__(self, idl_filename, text):
+        self.idl = idl_filename
+        # tokens are consumed from self.pos, and end with None so that
+        # peek needs no bounds check
+        self.tokens = []
+        self.lines = []
+        for line_number, line in enumerate(text.split("\n"), 1):
+            tokens = IDL_TOKEN.findall(line)
+            self.tokens += tokens
+            self.lines += [line_number] * len(tokens)
+        self.tokens.append(None)
+        self.lines.append(self.lines[-1] if self.lines else 1)
+        self.pos = 0
+        self.types = {ty: {"type_of_type": "builtin"} for ty in IDL_BUILTINS}
+        self.functions = {}
+
+    def error(self, message):
+        raise Exception("%s:%d: %s" % (self.idl, self.lines[self.pos], message))
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        if token is None:
+            self.error("unterminated declaration")
+        self.pos += 1
+        return token
+
+    def expect(self, token):
+        if self.tokens[self.pos] != token:
+            self.error("expected \"%s\" but found \"%s\"" %
+                       (token, self.peek() or "end of file"))
+        self.pos += 1
+
+    def name(self, what):
+        token = self.next()
+        if not IDL_NAME.match(token) or token in IDL_RESERVED_WORDS:
+            self.pos -= 1
+            self.error("\"%s\" is not a legal %s name" % (token, what))
+        return token
+
+    def type_name(self, allow_void):
+        token = self.next()
+        if token not in self.types:
+            self.pos -= 1
+            self.error("\"%s\" is not a declared type name" % token)
+        if token == "void" and not allow_void:
+            self.pos -= 1
+            self.error("\"void\" is not allowed as function argument or "
+                       "struct member type")
+        return token
+
+    # Parse any [n] bounds after a member or argument name, registering
+    # the array type and those of its rows, e.g. __int[10][100] and
+    # __int[100]
+    def array_type(self, ty):
+        bounds = []
+        while self.peek() == "[":
+            self.next()
+            bound = self.next()
+            if not bound.isdigit():
+                self.pos -= 1
+                self.error("array bound \"%s\" is not an integer" % bound)
+            bounds.append(int(bound))
+            self.expect("]")
+        if not bounds:
+            return ty
+        suffixes = ["[%d]" % b for b in bounds]
+        array = "__" + ty + "".join(suffixes)
+        # the rows of a known array type are already registered
+        if array in self.types:
+            return array
+        member = ty
+        for i in reversed(range(len(bounds))):
+            row = "__" + ty + "".join(suffixes[i:])
+            self.types[row] = {"type_of_type": "array",
+                               "member_type": member,
+                               "element_count": bounds[i]}
+            member = row
+        return array
+
+    # One "type name[bounds]" of a struct member or function argument
+    def variable(self, what):
+        ty = self.type_name(False)
+        name = self.name(what)
+        return {"name": name, "type": self.array_type(ty)}
+
+    def struct(self):
+        self.expect("struct")
+        name = self.name("struct")
+        if name in self.types:
+            self.pos -= 1
+            self.error("duplicate type name: " + name)
+        self.expect("{")
+        members = []
+        while self.peek() != "}":
+            members.append(self.variable("member"))
+            self.expect(";")
+        self.expect("}")
+        self.expect(";")
+        self.types[name] = {"type_of_type": "struct", "members": members}
+
+    def function(self):
+        return_type = self.type_name(True)
+        name = self.name("function")
+        if name in self.functions:
+            self.pos -= 1
+            self.error("duplicate function name: " + name)
+        self.expect("(")
+        arguments = []
+        while self.peek() != ")":
+            if arguments:
+                self.expect(",")
+            arguments.append(self.variable("argument"))
+        self.expect(")")
+        self.expect(";")
+        self.functions[name] = {"return_type": return_type,
+                                "arguments": arguments}
+
+    # Declarations in the order idl_to_json lists them: sorted by name
+    def parse(self):
+        while self.peek() is not None:
+            if self.peek() == ";":
+                self.next()
+            elif self.peek() == "struct":
+                self.struct()
+            else:
+                self.function()
+        return {"types": {ty: self.types[ty] for ty in sorted(self.types)},
+                "functions": {fn: self.functions[fn]
+                              for fn in sorted(self.functions)}}
+
+
+def parse_idl(idl):
+    is_file_valid(idl, check_idl_to_json=False)
+    with open(idl) as f:
+        return IDLParser(idl, f.read()).parse()
+
+
+# Run idl_to_json on idl, or reuse its output from an earlier run on the
+# same IDL with the same idl_to_json
+def load_decls(idl):
+    is_file_valid(idl)
+    key = file_hash(idl) + "-" + file_hash(IDL_TO_JSON_EXECUTABLE)
+    cached = os.path.join(IDL_CACHE_DIR, key + ".json")
+    if os.path.isfile(cached):
+        with open(cached) as f:
+            return json.load(f)
+
+    output = subprocess.check_output(
+        [IDL_TO_JSON_EXECUTABLE, idl]).decode('utf-8')
+    decls = json.loads(output)
+    # write then rename, so a concurrent run never reads a partial file
+    os.makedirs(IDL_CACHE_DIR, exist_ok=True)
+    temp = cached + "." + str(os.getpid())
+    with open(temp, 'w') as f:
+        f.write(output)
+    os.replace(temp, cached)
+    return decls
+
+
+# Leave filename untouched when it already holds contents, so make does
+# not rebuild what depends on it
+def write_if_changed(filename, contents):
+    try:
+        with open(filename) as f:
+            if f.read() == contents:
+                return False
+    except OSError:
+        pass
+    with open(filename, 'w') as f:
+        f.write(contents)
+    return True
+
+
+# Function ids are each function's position in the sorted list of IDL
+# functions, which is also its slot in the stub's dispatch table
+def function_ids(decls):
+    return {name: i for i, name in enumerate(sorted(decls["functions"]))}
+
+
+def create_function_id_enum(decls):
+    ids = function_ids(decls)
+    body = "enum RPCFunctionId\n{\n"
+    for name in sorted(ids, key=ids.get):
+        body += "\tRPCFUNC_" + name + " = " + str(ids[name]) + ",\n"
+    body += "};\n"
+    return body
+
+
+# Set in the function id of a batch request and its reply, which carry
+# many calls of that function in one message
+batch_flag = \
+    """
+const uint32_t RPC_BATCH = 0x80000000;
+
+// Most calls one batch may carry, and most bytes a stub reserves up front
+// for the results of one
+const size_t RPC_MAX_BATCH = 1 << 24;
+const size_t RPC_BATCH_RESERVE_LIMIT = 1 << 24;
+"""
+
+# Result cache for the functions named by --pure: a bounded LRU map from
+# the serialized arguments of a call to its serialized result, so a
+# repeated call is answered without running the implementation
+result_cache = \
+    """
+// Entries whose arguments and result take more than this are not cached
+const size_t RPC_RESULT_CACHE_MAX_ENTRY = 65536;
+
+class RPCResultCache
+{
+public:
+    explicit RPCResultCache(size_t capacity) : capacity(capacity) {}
+
+    // Append the result cached for the length bytes at args to msg and
+    // make it the most recently used, or count a miss
+    bool lookup(const char *args, size_t length, string &msg)
+    {
+        lock_guard<mutex> lock(guard);
+        auto found = index.find(string(args, length));
+        if (found == index.end())
+        {
+            misses++;
+            return false;
+        }
+        entries.splice(entries.begin(), entries, found->second);
+        msg += found->second->second;
+        hits++;
+        return true;
+    }
+
+    // Remember result for args, evicting the least recently used entry
+    // once the cache is full
+    void insert(const char *args, size_t length, const char *result,
+                size_t resultLength)
+    {
+        if (length + resultLength > RPC_RESULT_CACHE_MAX_ENTRY)
+            return;
+        string key(args, length);
+        lock_guard<mutex> lock(guard);
+        if (index.count(key) > 0) // another worker got here first
+            return;
+        if (entries.size() >= capacity)
+        {
+            index.erase(entries.back().first);
+            entries.pop_back();
+        }
+        entries.emplace_front(key, string(result, resultLength));
+        index[key] = entries.begin();
+    }
+
+    atomic<size_t> hits{0};
+    atomic<size_t> misses{0};
+
+private:
+    typedef list<pair<string, string>> Entries;
+
+    size_t capacity;
+    mutex guard;
+    Entries entries; // most recently used first
+    unordered_map<string, Entries::iterator> index;
+};
+"""
+
+# Per-function metrics for --metrics: call, error and byte counts, and a
+# histogram of the time spent in each phase of a call. Recording uses
+# relaxed atomics only, so it never blocks or formats anything; text and
+# JSON snapshots are built on demand. Bytes count the serialized
+# arguments and results, without headers and before compression.
+metrics_runtime = \
+    """
+enum RPCPhase
+{
+    RPC_SERIALIZE, // encoding and decoding arguments and results
+    RPC_NETWORK,   // sending, and on the proxy waiting for the reply
+    RPC_EXECUTE,   // running the implementation, on the stub
+    RPC_PHASES
+};
+
+static const char *const rpcPhaseNames[RPC_PHASES] = {
+    "serialize", "network", "execute"};
+
+// Bucket i counts the times of fewer than 2^i but at least 2^(i-1)
+// nanoseconds; the last also counts everything longer
+const size_t RPC_HISTOGRAM_BUCKETS = 40;
+
+struct RPCHistogram
+{
+    atomic<uint64_t> count;
+    atomic<uint64_t> totalNs;
+    atomic<uint64_t> buckets[RPC_HISTOGRAM_BUCKETS];
+
+    void record(uint64_t ns)
+    {
+        size_t bucket = ns == 0 ? 0 : 64 - __builtin_clzll(ns);
+        if (bucket >= RPC_HISTOGRAM_BUCKETS)
+            bucket = RPC_HISTOGRAM_BUCKETS - 1;
+        count.fetch_add(1, memory_order_relaxed);
+        totalNs.fetch_add(ns, memory_order_relaxed);
+        buckets[bucket].fetch_add(1, memory_order_relaxed);
+    }
+};
+
+struct RPCFunctionMetrics
+{
+    atomic<uint64_t> calls;
+    atomic<uint64_t> errors;
+    atomic<uint64_t> bytesIn;
+    atomic<uint64_t> bytesOut;
+    RPCHistogram phases[RPC_PHASES];
+};
+
+static uint64_t rpcNow()
+{
+    return chrono::duration_cast<chrono::nanoseconds>(
+               chrono::steady_clock::now().time_since_epoch())
+        .count();
+}
+
+// Times the phases of one call. Each mark adds the time since the last
+// to a phase, and finish records the phases timed; a call that never
+// finishes, as it threw, counts as an error instead.
+class RPCCallTimer
+{
+public:
+    explicit RPCCallTimer(RPCFunctionMetrics &metrics)
+        : metrics(metrics), last(rpcNow()), finished(false)
+    {
+        metrics.calls.fetch_add(1, memory_order_relaxed);
+        for (size_t i = 0; i < RPC_PHASES; i++)
+            phaseNs[i] = UINT64_MAX;
+    }
+
+    ~RPCCallTimer()
+    {
+        if (!finished)
+            metrics.errors.fetch_add(1, memory_order_relaxed);
+    }
+
+    void mark(RPCPhase phase)
+    {
+        uint64_t now = rpcNow();
+        if (phaseNs[phase] == UINT64_MAX)
+            phaseNs[phase] = 0;
+        phaseNs[phase] += now - last;
+        last = now;
+    }
+
+    void bytesIn(size_t n) { metrics.bytesIn.fetch_add(n, memory_order_relaxed); }
+    void bytesOut(size_t n) { metrics.bytesOut.fetch_add(n, memory_order_relaxed); }
+
+    void finish()
+    {
+        for (size_t i = 0; i < RPC_PHASES; i++)
+            if (phaseNs[i] != UINT64_MAX)
+                metrics.phases[i].record(phaseNs[i]);
+        finished = true;
+    }
+
+private:
+    RPCFunctionMetrics &metrics;
+    uint64_t last;
+    uint64_t phaseNs[RPC_PHASES]; // UINT64_MAX for phases not timed
+    bool finished;
+};
+"""
+
+# Snapshots of the rpcMetrics of every function, in rpcMetricsNames order
+metrics_snapshots = \
+    """
+// One line per function, then one per phase it timed, with the buckets
+// that counted anything
+string rpcMetricsText()
+{
+    string text;
+    char line[160];
+    for (size_t f = 0; f < RPC_METRICS_FUNCTIONS; f++)
+    {
+        const RPCFunctionMetrics &m = rpcMetrics[f];
+        snprintf(line, sizeof(line),
+                 "%s calls=%llu errors=%llu bytes_in=%llu bytes_out=%llu\\n",
+                 rpcMetricsNames[f], (unsigned long long)m.calls.load(),
+                 (unsigned long long)m.errors.load(),
+                 (unsigned long long)m.bytesIn.load(),
+                 (unsigned long long)m.bytesOut.load());
+        text += line;
+        for (size_t p = 0; p < RPC_PHASES; p++)
+        {
+            const RPCHistogram &h = m.phases[p];
+            if (h.count.load() == 0)
+                continue;
+            snprintf(line, sizeof(line), "  %s count=%llu total_ns=%llu",
+                     rpcPhaseNames[p], (unsigned long long)h.count.load(),
+                     (unsigned long long)h.totalNs.load());
+            text += line;
+            for (size_t b = 0; b < RPC_HISTOGRAM_BUCKETS; b++)
+            {
+                uint64_t n = h.buckets[b].load();
+                if (n == 0)
+                    continue;
+                snprintf(line, sizeof(line), " lt_2^%zu_ns=%llu", b,
+                         (unsigned long long)n);
+                text += line;
+            }
+            text += '\\n';
+        }
+    }
+    return text;
+}
+
+// An object keyed by function name, each holding its counts and, for
+// every phase, its count, total time and all of its buckets
+string rpcMetricsJson()
+{
+    string json = "{";
+    char field[160];
+    for (size_t f = 0; f < RPC_METRICS_FUNCTIONS; f++)
+    {
+        const RPCFunctionMetrics &m = rpcMetrics[f];
+        snprintf(field, sizeof(field),
+                 "%s\\"%s\\": {\\"calls\\": %llu, \\"errors\\": %llu, "
+                 "\\"bytes_in\\": %llu, \\"bytes_out\\": %llu",
+                 f > 0 ? ", " : "", rpcMetricsNames[f],
+                 (unsigned long long)m.calls.load(),
+                 (unsigned long long)m.errors.load(),
+                 (unsigned long long)m.bytesIn.load(),
+                 (unsigned long long)m.bytesOut.load());
+        json += field;
+        for (size_t p = 0; p < RPC_PHASES; p++)
+        {
+            const RPCHistogram &h = m.phases[p];
+            snprintf(field, sizeof(field),
+                     ", \\"%s\\": {\\"count\\": %llu, \\"total_ns\\": %llu, "
+                     "\\"buckets\\": [",
+                     rpcPhaseNames[p], (unsigned long long)h.count.load(),
+                     (unsigned long long)h.totalNs.load());
+            json += field;
+            for (size_t b = 0; b < RPC_HISTOGRAM_BUCKETS; b++)
+            {
+                snprintf(field, sizeof(field), "%s%llu", b > 0 ? ", " : "",
+                         (unsigned long long)h.buckets[b].load());
+                json += field;
+            }
+            json += "]}";
+        }
+        json += "}";
+    }
+    return json + "}";
+}
+"""
+
+
+# Largest encodings of the builtins, not counting string contents: text
+# ints need up to 11 chars ("-2147483648"), text floats up to 16
+# ("-0x1.fffffep+127", or 15 for "%.9g" as in "-1.17549435e-38") and a
+# string's length prefix up to 20 digits plus a space
+TEXT_BUILTIN_SIZES = {"int": 11, "float": 16, "string": 21}
+BINARY_BUILTIN_SIZES = {"int": 4, "float": 4, "string": 4}
+
+
+# Smallest encodings of the builtins: text "0" for an int or a float and
+# "0 " for an empty string
+TEXT_BUILTIN_MIN_SIZES = {"int": 1, "float": 1, "string": 2}
+
+
+# Return the most bytes an encoded ty can take, leaving out the contents of
+# any strings, which are only known at run time
+def max_encoded_size(ty, decls, wire, sizes=None):
+    if wire == "binary":
+        builtin_sizes = BINARY_BUILTIN_SIZES
+    else:
+        builtin_sizes = TEXT_BUILTIN_SIZES
+    return encoded_size(ty, decls, wire, builtin_sizes, sizes)
+
+
+# Return the fewest bytes an encoded ty can take
+def min_encoded_size(ty, decls, wire, sizes=None):
+    if wire == "binary":
+        builtin_sizes = BINARY_BUILTIN_SIZES
+    else:
+        builtin_sizes = TEXT_BUILTIN_MIN_SIZES
+    return encoded_size(ty, decls, wire, builtin_sizes, sizes)
+
+
+# Return the bytes an encoded ty takes when each builtin takes those of
+# builtin_sizes
+def encoded_size(ty, decls, wire, builtin_sizes, sizes=None):
+    if sizes is not None and ty in sizes:
+        return sizes[ty]
+    sig = decls["types"][ty]
+    if sig["type_of_type"] == "builtin":
+        size = builtin_sizes.get(ty, 0)
+    elif sig["type_of_type"] == "array":
+        count = sig["element_count"]
+        size = count * encoded_size(sig["member_type"], decls, wire,
+                                    builtin_sizes, sizes)
+        if wire == "text":
+            size += count - 1
+    else:
+        size = sum(encoded_size(m["type"], decls, wire, builtin_sizes, sizes)
+                   for m in sig["members"])
+        if wire == "text" and sig["members"]:
+            size += len(sig["members"]) - 1
+    # sizes memoizes the result, as nested types are shared by many
+    # functions
+    if sizes is not None:
+        sizes[ty] = size
+    return size
+
+
+def array_type(ty):
+    end_pos = ty.find("[")
+    return ty[2:end_pos]
+
+# Return array size in a list up to N dimensions
+
+
+def array_size(ty):
+    ty = ty[2:]
+    ty = ty.replace("][", "_")
+    ty = ty.replace("[", "_")
+    ty = ty.replace("]", "")
+    l = ty.split("_")[1:]
+    return l
+
+# Format array parser and serializer function names
+
+
+def format_array_funname(ty):
+    dimension = len(ty.split("[")) - 1
+    # string replace "][" with "_"
+    if ty[:2] == "__":
+        ty = ty[2:]
+    ty = ty.replace("][", "_")
+    # string replace "[" with "_"
+    ty = ty.replace("[", str(dimension) + "DArray_")
+    # string replace "]" with "_array_"
+    ty = ty.replace("]", "")
+    return ty
+
+
+def format_array_arg(n, ty):
+    start = ty.find("[")
+    end = len(ty)
+    return array_type(ty) + " " + n + ty[start:end]
+
+
+# Parameter that passes ty without copying it: int and float by value,
+# strings and structs by const reference, arrays as const
+def const_ref_param(n, ty):
+    if ty[:2] == "__":
+        return "const " + format_array_arg(n, ty)
+    if ty in ("int", "float"):
+        return ty + " " + n
+    return "const " + ty + " &" + n
+
+
+# Parameter of a _batch proxy holding the n values of argument n: a
+# pointer to ty, or for arrays an array of n of them
+def batch_param(n, ty):
+    if ty[:2] == "__":
+        start = ty.find("[")
+        return "const " + array_type(ty) + " " + n + "[]" + ty[start:]
+    return "const " + ty + " *" + n
+
+
+# Statement decoding ty from strm, up to end, into the existing variable
+# dest
+def parse_into(ty, dest, strm="strm", end="end"):
+    if ty[:2] == "__":
+        dimension = len(ty.split("[")) - 1
+        return "parse_" + array_type(ty) + str(dimension) + \
+            "DArray(" + strm + ", " + end + ", " + dest + ");"
+    if ty in BUILTIN_TYPES:
+        return dest + " = parse_" + ty + "(" + strm + ", " + end + ");"
+    return "parse_" + ty + "(" + strm + ", " + end + ", " + dest + ");"
+
+
+def forward_declarations(x, f, decls):
+    for ty, sig in decls["types"].items():
+        if sig["type_of_type"] == "struct":
+            f.write(struct_serializer_fdecl(ty, sig) + ";\n")
+            f.write(struct_parser_fdecl(ty, sig, x.wire) + ";\n")
+        elif sig["type_of_type"] == "array":
+            f.write(array_serializer_fdecl(ty, sig) + ";\n")
+
+            dimension = len(ty.split("[")) - 1
+            array_ty = array_type(ty)
+            if (dimension, array_ty) not in x.array_dimensions:
+                f.write(array_parser_fdecl(
+                    ty, sig, dimension, array_ty, x.wire) + ";\n")
+                x.array_dimensions.add((dimension, array_ty))
+        elif sig["type_of_type"] == "builtin":
+            continue
+    f.write("\n")
+
+
+def array_parser_fdecl(ty, sig, dimension, array_ty, wire):
+    template_decl = "template <"
+    array_size = ""
+    for i in range(dimension):
+        template_decl += "int " + ARRAY_SIZE_VARS[i]
+        array_size += "[" + ARRAY_SIZE_VARS[i] + "]"
+
+        if i != dimension - 1:
+            template_decl += ", "
+    template_decl += ">\n"
+
+    fundecl = "void parse_" + array_ty + \
+        str(dimension) + "DArray(" + PARSER_STREAM + ", " + \
+        array_ty + " " + "(&array)" + array_size + ")"
+    return template_decl + fundecl
+
+
+def array_serializer_fdecl(ty, sig):
+    size_list = array_size(ty)
+
+    arg_type = "const " + array_type(ty) + " array"
+    fundecl = "void serialize_" + format_array_funname(ty) + "(string &msg, "
+
+    for size in size_list:
+        arg_type += "[" + size + "]"
+
+    fundecl += arg_type + ")"
+    return fundecl
+
+# Generate a specific serializer for an nDarray with type ty and dimension n
+
+
+def create_array_serializer(ty, sig, wire, streamed=False):
+    fundecl = array_serializer_fdecl(ty, sig) + "\n"
+    element_ty = array_type(ty)
+    if element_ty in BUILTIN_TYPES:
+        # Arrays of builtins of any dimension are one contiguous run of
+        # elements, encoded exactly as the row by row loop would
+        dimensions = array_size(ty)
+        body = "\tint size = " + " * ".join(dimensions) + ";\n"
+        body += "\tconst " + element_ty + " *elements = &array" + \
+            "[0]" * len(dimensions) + ";\n"
+        member = "elements[i]"
+        member_ty = element_ty
+    else:
+        body = "\tint size = " + str(sig["element_count"]) + ";\n"
+        member = "array[i]"
+        member_ty = format_array_funname(sig["member_type"])
+    loop = "\tfor (int i = 0; i < size; i++)\n"
+    loop += "\t{\n"
+    loop += "\t\tserialize_" + member_ty + "(msg, " + member + ");\n"
+    if wire == "text":
+        loop += "\t\tif(i != size - 1)\n"
+        loop += "\t\t\tmsg += ' ';\n"
+    if streamed:
+        loop += "\t\tstreamChunk(msg);\n"
+    loop += "\t}\n"
+
+    # Little-endian hosts can copy arrays of int/float straight to the wire
+    if wire == "binary" and element_ty in ("int", "float"):
+        body += "#if __BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__\n"
+        body += "\tmsg.append((const char *)elements, sizeof(elements[0]) * size);\n"
+        body += "#else\n"
+        body += loop
+        body += "#endif\n"
+    else:
+        body += loop
+
+    return fundecl + "{\n" + body + "}\n"
+
+
+def struct_serializer_fdecl(ty, sig):
+    arg = "struct__" + ty[0].lower()
+    return "void serialize_" + ty + "(string &msg, " + \
+        const_ref_param(arg, ty) + ")"
+
+
+def struct_parser_fdecl(ty, sig, wire):
+    arg = "struct__" + ty[0].lower()
+    return "void parse_" + ty + "(" + PARSER_STREAM + ", " + \
+        ty + " &" + arg + ")"
+
+
+def create_struct_serializer(ty, sig, wire):
+    fundecl = struct_serializer_fdecl(ty, sig) + "\n"
+    arg = "struct__" + ty[0].lower()
+    body = ""
+
+    for i, member in enumerate(sig["members"]):
+        if member["type"][:2] == "__":
+            funname = format_array_funname(member["type"])
+        else:
+            funname = member["type"]
+        body += "\tserialize_" + funname + \
+            "(msg, " + arg + "." + member["name"] + ");\n"
+        if wire == "text" and i != len(sig["members"]) - 1:
+            body += "\tmsg += ' ';\n"
+
+    serializer = fundecl + "{\n" + body + "}\n"
+    return serializer
+
+
+def create_struct_parser(ty, sig, wire):
+    fundecl = struct_parser_fdecl(ty, sig, wire) + "\n"
+    arg = "struct__" + ty[0].lower()
+    body = ""
+
+    for member in sig["members"]:
+        body += "\t" + parse_into(member["type"],
+                                  arg + "." + member["name"]) + "\n"
+
+    parser = fundecl + "{\n" + body + "}\n"
+    return parser
+
+
+# Most bytes a message needs beyond its payload: a length framed header,
+# or the null terminator
+FRAME_OVERHEAD = 12
+
+
+# Statements that open and close the framing around a payload serialized
+# into buf, for the given wire format and framing
+def begin_message(x, buf, name, request_id="0"):
+    if x.framing == "length":
+        return "\tsize_t start = beginMessage(" + buf + ", RPCFUNC_" + \
+            name + ", " + request_id + ");\n"
+    if x.wire == "binary":
+        return "\tsize_t start = beginFrame(" + buf + ");\n"
+    return ""
+
+
+def end_message(x, buf):
+    if x.framing == "length" and x.compress:
+        return "\tendMessage(" + buf + ", start);\n" + \
+            "\tcompressMessage(" + buf + ", start);\n"
+    if x.framing == "length":
+        return "\tendMessage(" + buf + ", start);\n"
+    if x.wire == "binary":
+        return "\tendFrame(" + buf + ", start);\n"
+    return "\t" + buf + " += '\\0';\n"
+
+
+# What the proxy and stub generators share: options, the file header,
+# and the serializers and parsers of the builtin and IDL types
+# What the C++ and the Python generators both take from the options: how
+# values and messages go on the wire
+class WireGenerator:
+    def __init__(self, idl_filename, options):
+        self.idl = idl_filename
+        self.wire = options.wire
+        self.framing = options.framing
+        # Length framing always names functions by id
+        self.function_ids = options.function_ids or self.framing == "length"
+        self.compress = options.compress
+        self.compress_threshold = options.compress_threshold
+        self.max_message_size = options.max_message_size
+        self.decls = None
+
+
+class Generator(WireGenerator):
+    def __init__(self, idl_filename, options):
+        WireGenerator.__init__(self, idl_filename, options)
+        self.batch = options.batch
+        # Null terminated text is sent in chunks as it is serialized
+        self.streamed = self.wire == "text" and self.framing == "null"
+        self.transport = options.transport
+        self.shm_ring_size = options.shm_ring_size
+        self.metrics = options.metrics
+        self.grading_log = options.grading_log
+        self.h_files = self.get_h_files()
+        self.libraries = self.get_libraries()
+        self.builtin_parsers = BUILTIN_PARSERS[self.wire]
+        self.builtin_serializers = BUILTIN_SERIALIZERS[self.wire]
+        if options.hex_floats:
+            self.builtin_serializers = [
+                hex_float_serializer if s is float_serializer else s
+                for s in self.builtin_serializers]
+        if self.streamed:
+            self.builtin_serializers = [
+                streamed_string_serializer if s is string_serializer else s
+                for s in self.builtin_serializers]
+        self.array_dimensions = set()
+        self.sizes = {}
+        self.min_sizes = {}
+
+    # unpackPayload, and with --compress what it and compressMessage
+    # need, given the side's record of whether its peer takes compressed
+    # messages
+    def write_payload_unpacking(self, f, compression_state):
+        if not self.compress:
+            f.write(no_compression)
+            return
+        f.write(compression_flags)
+        f.write("atomic<size_t> rpcCompressionThreshold(" +
+                str(self.compress_threshold) + ");\n")
+        f.write(compression_state)
+        f.write(unpack_payload)
+
+    # Generate boilerplate at the top of the .cpp file: its dependencies
+    # and the IDL itself
+    def create_template(self, f):
+        h_files = list(
+            map((lambda x: "#include \"" + x + "\"\n"), self.h_files))
+        libraries = list(
+            map((lambda x: "#include <" + x + ">\n"), self.libraries))
+        f.writelines(libraries)
+        f.writelines(h_files)
+        f.write("using namespace std;\n")
+        f.write("using namespace C150NETWORK;\n")
+        f.write("#include \"" + os.path.basename(self.idl) + "\"\n")
+
+    def write_builtin_parsers(self, f):
+        f.writelines(self.builtin_parsers)
+
+    def write_builtin_serializers(self, f):
+        f.writelines(self.builtin_serializers)
+
+    # Generate a generic array parser for nDarray of type ty and dimenson n
+    def create_array_parser(self, ty, sig, dimension, array_ty):
+        fundecl = array_parser_fdecl(
+            ty, sig, dimension, array_ty, self.wire) + "\n"
+        body = ""
+        if self.wire == "binary" and array_ty in ("int", "float"):
+            body += "#if __BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__\n"
+            body += "\tif ((size_t)(end - strm) < sizeof(array))\n"
+            body += "\t\tthrow C150Exception(\"rpc: array runs past the " \
+                "end of the message\");\n"
+            body += "\tmemcpy(array, strm, sizeof(array));\n"
+            body += "\tstrm += sizeof(array);\n"
+            body += "\treturn;\n"
+            body += "#endif\n"
+        if array_ty in BUILTIN_TYPES:
+            # one loop over all the elements, whatever the dimension
+            body += "\t" + array_ty + " *elements = &array" + \
+                "[0]" * dimension + ";\n"
+            body += "\tfor (int i = 0; i < " + \
+                " * ".join(ARRAY_SIZE_VARS[:dimension]) + "; i++)\n"
+            body += "\t\t" + parse_into(array_ty, "elements[i]") + "\n"
+            self.array_dimensions.add((dimension, array_ty))
+            return fundecl + "{\n" + body + "}\n"
+        body += "\tfor (int i = 0; i < " + ARRAY_SIZE_VARS[0] + "; i++)\n"
+        body += "\t{\n"
+        if dimension == 1:
+            body += "\t\t" + parse_into(array_ty, "array[i]") + "\n"
+        else:
+            body += "\t\tparse_" + array_ty + \
+                str(dimension-1) + "DArray(strm, end, array[i]);\n"
+        body += "\t}\n"
+
+        self.array_dimensions.add((dimension, array_ty))
+        return fundecl + "{\n" + body + "}\n"
+
+    def max_size(self, ty):
+        return max_encoded_size(ty, self.decls, self.wire, self.sizes)
+
+    def min_size(self, ty):
+        return min_encoded_size(ty, self.decls, self.wire, self.min_sizes)
+
+    # Statement sending msg to the peer, through the shared memory channel
+    # with --transport=shm
+    def send_message(self, socket):
+        if self.transport == "shm":
+            return "\trpcShmSend(msg.data(), msg.length());\n"
+        return "\t" + socket + "->write(msg.data(), msg.length());\n"
+
+    # A statement logging text, a C++ stream expression, to GRADING. Only
+    # --grading-log keeps these, as they format on every call.
+    def grading(self, text, indent="\t"):
+        if not self.grading_log:
+            return ""
+        return indent + "*GRADING << " + text + " << endl;\n"
+
+    # With --metrics, the timer of a call of name
+    def start_timer(self, name, indent="\t"):
+        if not self.metrics:
+            return ""
+        return indent + "RPCCallTimer timer(rpcMetrics[" + \
+            str(function_ids(self.decls)[name]) + "]);\n"
+
+    # Bytes serialized into msg since it held start bytes, counting those
+    # a streamed message sent ahead since bytesSentAhead was sent_ahead
+    def serialized_bytes(self, start, sent_ahead="sentAhead"):
+        if self.streamed:
+            return "msg.length() + (bytesSentAhead - " + sent_ahead + \
+                ") - " + start
+        return "msg.length() - " + start
+
+    # The --metrics runtime, with a slot in rpcMetrics for each function
+    # at its function id
+    def write_metrics(self, f, decls):
+        if not self.metrics:
+            return
+        ids = function_ids(decls)
+        names = sorted(ids, key=ids.get)
+        f.write(metrics_runtime)
+        f.write("\nconst size_t RPC_METRICS_FUNCTIONS = " +
+                str(len(names)) + ";\n")
+        f.write("static const char *const rpcMetricsNames[] = {\n")
+        for name in names:
+            f.write("\t\"" + name + "\",\n")
+        f.write("};\n")
+        # zero initialized, as it is static
+        f.write("static RPCFunctionMetrics rpcMetrics[" +
+                "RPC_METRICS_FUNCTIONS];\n")
+        f.write(metrics_snapshots + "\n")
+
+    # What to reserve for a message of at most size bytes plus the given
+    # strings. Streamed messages are sent every SEND_CHUNK_SIZE bytes, and
+    # their long strings straight from the caller's, so a chunk will do.
+    def reserved_size(self, size, strings):
+        if self.streamed:
+            return "min((size_t)" + str(size) + ", SEND_CHUNK_SIZE)"
+        return " + ".join([str(size)] + [s + ".length()" for s in strings])
+
+    # Serializer and parser for every struct and array type in the IDL
+    def write_type_codecs(self, f):
+        self.array_dimensions.clear()
+        for ty, sig in self.decls["types"].items():
+            if sig["type_of_type"] == "struct":
+                f.write(create_struct_serializer(ty, sig, self.wire) + "\n")
+                f.write(create_struct_parser(ty, sig, self.wire) + "\n")
+            elif sig["type_of_type"] == "array":
+                f.write(create_array_serializer(
+                    ty, sig, self.wire, self.streamed) + "\n")
+
+                dimension = len(ty.split("[")) - 1
+                array_ty = array_type(ty)
+                if (dimension, array_ty) not in self.array_dimensions:
+                    f.write(self.create_array_parser(
+                        ty, sig, dimension, array_ty) + "\n")
+
+
+class ProxyGenerator(Generator):
+    def __init__(self, idl_filename, options):
+        self.pool = options.pool
+        self.async_calls = options.async_calls
+        Generator.__init__(self, idl_filename, options)
+        self.proxy = self.proxy_name()
+        self.ids = {}
+
+    def get_h_files(self):
+        headers = ["rpcproxyhelper.h", "c150debug.h"]
+        return headers
+
+    def get_libraries(self):
+        libraries = ["stdio.h", "stdlib.h", "cstdio", "cstring",
+                     "string", "memory", "iostream"]
+        if self.wire == "binary" or self.framing == "length":
+            libraries.append("cstdint")
+        if self.framing == "length" or self.streamed:
+            libraries.append("vector")
+        if self.streamed:
+            libraries.append("algorithm")
+        if self.pool:
+            libraries += ["map", "mutex", "condition_variable", "thread",
+                          "functional"]
+        if self.pool or self.compress:
+            libraries.append("atomic")
+        if self.compress:
+            libraries.append("zlib.h")
+        if self.async_calls:
+            libraries.append("future")
+        if self.transport == "shm":
+            libraries += SHM_LIBRARIES
+        if self.metrics:
+            libraries += ["atomic", "chrono", "cstdint"]
+        return libraries
+
+    def proxy_name(self):
+        idl_file = os.path.splitext(self.idl)[0]
+        return idl_file + ".proxy.cpp"
+
+    def write_wire_helpers(self, f):
+        f.write(message_limits(self.max_message_size))
+        f.write(send_buffer)
+        if self.streamed:
+            f.write(send_ahead("RPCPROXYSOCKET"))
+            f.write(text_reply_reader)
+        if self.transport == "shm":
+            f.write(proxy_read_exactly_declaration)
+            f.write(uint32_helpers)
+        elif self.wire == "binary" or self.framing == "length":
+            f.write(proxy_read_exactly)
+            f.write(uint32_helpers)
+        if self.wire == "binary":
+            f.write(binary_helpers)
+        if self.framing == "length":
+            self.write_payload_unpacking(f, proxy_compression_state)
+            f.write(length_framing)
+        if self.transport == "shm":
+            f.write(shm_channel(self.shm_ring_size))
+            f.write(shm_proxy_transport)
+        if self.compress:
+            f.write(compress_message)
+        if self.pool:
+            f.write(connection_pool)
+
+    def create_function_serializer(self, funname, sig):
+        return_ty = sig["return_type"]
+        a = [const_ref_param(arg["name"], arg["type"])
+             for arg in sig["arguments"]]
+
+        args = ", ".join(["string &msg"] + a)
+        fundecl = "void serialize_{fn}({params})\n".format(
+            fn=funname, params=args)
+
+        # Reserve the whole payload up front, sized from the IDL
+        size = self.reserved_size(
+            sum(self.max_size(arg["type"]) for arg in sig["arguments"]) +
+            max(len(sig["arguments"]) - 1, 0),
+            [arg["name"] for arg in sig["arguments"]
+             if arg["type"] == "string"])
+        body = "\tmsg.reserve(msg.length() + " + size + ");\n"
+
+        a.clear()
+        for arg in sig["arguments"]:
+            if arg["type"][:2] == "__":
+                ty = format_array_funname(arg["type"])
+            else:
+                ty = arg["type"]
+            a.append(
+                "\tserialize_{t}(msg, {n});\n".format(t=ty, n=arg["name"]))
+
+        if self.wire == "text":
+            body += "\tmsg += ' ';\n".join(a)
+        else:
+            body += "".join(a)
+
+        return fundecl + "{\n" + body + "}\n"
+
+    # Parameter list of the proxy function for sig, as declared in the IDL
+    def function_params(self, sig):
+        a = []
+        for arg in sig["arguments"]:
+            arg_ty = arg["type"]
+            arg_name = arg["name"]
+            if arg_ty[:2] == "__":
+                start = arg_ty.find("[")
+                end = len(arg_ty)
+                param = array_type(arg_ty) + " " + \
+                    arg_name + arg_ty[start:end]
+            else:
+                param = arg_ty + " " + arg_name
+            a.append(param)
+        return ", ".join(a)
+
+    def create_top_level_function(self, name, sig):
+        return_ty = sig["return_type"]
+        fundecl = return_ty + " " + name + "(" + \
+            self.function_params(sig) + ")\n"
+        arg_list = [arg["name"] for arg in sig["arguments"]]
+        if self.pool:
+            return fundecl + "{\n" + \
+                self.pooled_call(name, return_ty, arg_list) + "}\n"
+
+        # The request is serialized into sendBuffer and sent with a
+        # single write, or in chunks if it is null terminated text
+        body = self.start_timer(name)
+        body += "\tstring &msg = sendBuffer;\n"
+        body += "\tmsg.clear();\n"
+        if self.framing == "null" and self.function_ids:
+            fid = str(self.ids[name])
+            body += "\tmsg.append(\"" + fid + "\", " + \
+                str(len(fid) + 1) + ");\n"
+            body += self.grading("\"Client sending function id " + fid +
+                                 " for " + name + "\"")
+        elif self.framing == "null":
+            body += "\tmsg.append(\"" + name + "\", " + \
+                str(len(name) + 1) + ");\n"
+            body += self.grading("\"Client sending function name " + name +
+                                 "\"")
+        body += begin_message(self, "msg", name)
+        body += self.serialize_arguments(name, arg_list)
+        body += end_message(self, "msg")
+        if self.metrics:
+            body += "\ttimer.mark(RPC_SERIALIZE);\n"
+        body += self.send_message("RPCPROXYSOCKET")
+        body += self.grading("\"Client sending serialized data for " + name +
+                             "(" + ", ".join(arg_list) + ")\"")
+        if return_ty != "void" and self.framing == "length":
+            body += self.read_length_framed_reply(name, "RPCFUNC_" + name)
+        elif return_ty != "void" and self.wire == "binary":
+            body += "\tstring reply = readFrame();\n"
+            body += "\tconst char *data_strm = reply.data();\n"
+            body += "\tconst char *data_end = data_strm + reply.length();\n"
+        elif return_ty != "void":
+            body += "\tconst char *data_end;\n"
+            body += "\tconst char *data_strm = readTextReply(data_end);\n"
+        body += self.grading("\"Client received return value of type " +
+                             return_ty + " for " + name + "\"")
+        body += self.return_reply(return_ty, "\t")
+        return fundecl + "{\n" + body + "}\n"
+
+    # Statements appending the arguments of a call of name to msg
+    def serialize_arguments(self, name, arg_list):
+        call = "\tserialize_" + name + \
+            "(" + ", ".join(["msg"] + arg_list) + ");\n"
+        if not self.metrics:
+            return call
+        body = "\tsize_t argsStart = msg.length();\n"
+        if self.streamed:
+            body += "\tsize_t sentAhead = bytesSentAhead;\n"
+        body += call
+        body += "\ttimer.bytesOut(" + self.serialized_bytes("argsStart") + \
+            ");\n"
+        return body
+
+    # Statements that finish a call once its request is sent, parsing and
+    # returning the reply from data_strm to data_end unless return_ty is
+    # void. With
+    # --metrics they time sending and waiting as network, and parsing as
+    # serialize.
+    def return_reply(self, return_ty, indent):
+        body = ""
+        if self.metrics:
+            body += indent + "timer.mark(RPC_NETWORK);\n"
+        if return_ty == "void":
+            if self.metrics:
+                body += indent + "timer.finish();\n"
+            return body + indent + "return;\n"
+        if self.metrics:
+            body += indent + "const char *replyStart = data_strm;\n"
+        elif return_ty in BUILTIN_TYPES:
+            return body + indent + "return parse_" + return_ty + \
+                "(data_strm, data_end);\n"
+        if return_ty in BUILTIN_TYPES:
+            body += indent + return_ty + " res = parse_" + return_ty + \
+                "(data_strm, data_end);\n"
+        else:
+            body += indent + return_ty + " res;\n"
+            body += indent + "parse_" + return_ty + \
+                "(data_strm, data_end, res);\n"
+        if self.metrics:
+            body += indent + "timer.bytesIn(data_strm - replyStart);\n"
+            body += indent + "timer.mark(RPC_SERIALIZE);\n"
+            body += indent + "timer.finish();\n"
+        return body + indent + "return res;\n"
+
+    # Statements that read the reply to a length framed request for
+    # function_id into data_strm and data_end
+    def read_length_framed_reply(self, name, function_id):
+        body = "\tuint32_t functionId, requestId;\n"
+        body += "\tuint32_t replyLength = readMessage(functionId, requestId);\n"
+        body += "\tif (functionId != " + function_id + ")\n"
+        body += "\t\tthrow C150Exception(\"proxy: reply does not match " + \
+            name + " request\");\n"
+        body += "\tconst char *data_strm = &messageBuffer[0];\n"
+        body += "\tconst char *data_end = data_strm + replyLength;\n"
+        return body
+
+    # Body of a proxy function that sends through the connection pool,
+    # possibly alongside calls from other threads on the same connection
+    def pooled_call(self, name, return_ty, arg_list):
+        body = self.start_timer(name)
+        body += self.pooled_send(name, return_ty, arg_list)
+        if return_ty != "void":
+            body += self.pooled_wait("\t")
+        body += self.return_reply(return_ty, "\t")
+        return body
+
+    # Statements that send the request, leaving its id in requestId
+    def pooled_send(self, name, return_ty, arg_list):
+        body = "\tstring &msg = sendBuffer;\n"
+        body += "\tmsg.clear();\n"
+        body += begin_message(self, "msg", name)
+        body += self.serialize_arguments(name, arg_list)
+        body += end_message(self, "msg")
+        if self.metrics:
+            body += "\ttimer.mark(RPC_SERIALIZE);\n"
+        body += "\tRPCConnection &conn = rpcConnection();\n"
+        if return_ty == "void":
+            body += "\tconn.send(msg);\n"
+        else:
+            body += "\tuint32_t requestId = conn.send(msg);\n"
+        return body
+
+    # Statements that wait for the reply to requestId, into data_strm and
+    # data_end
+    def pooled_wait(self, indent):
+        body = indent + "string reply;\n"
+        body += indent + "conn.wait(requestId, reply);\n"
+        body += indent + "const char *data_strm = reply.data();\n"
+        body += indent + "const char *data_end = data_strm + reply.length();\n"
+        return body
+
+    # <name>_batch makes n calls of name in one round trip. Argument i of
+    # call k is the k-th element of the i-th parameter, and the results
+    # are stored in out.
+    def create_batch_function(self, name, sig):
+        return_ty = sig["return_type"]
+        params = [batch_param(arg["name"], arg["type"])
+                  for arg in sig["arguments"]]
+        params.append("size_t n")
+        if return_ty != "void":
+            params.append(return_ty + " *out")
+        fundecl = "void " + name + "_batch(" + ", ".join(params) + ")\n"
+        function_id = "(RPCFUNC_" + name + " | RPC_BATCH)"
+
+        body = "\tif (n > RPC_MAX_BATCH)\n"
+        body += "\t\tthrow C150Exception(\"proxy: batch of more than " \
+            "RPC_MAX_BATCH calls\");\n"
+        body += "\tstring &msg = sendBuffer;\n"
+        body += "\tmsg.clear();\n"
+        body += "\tsize_t start = beginMessage(msg, " + function_id + ", 0);\n"
+        body += "\tserialize_int(msg, (int)n);\n"
+        body += "\tfor (size_t i = 0; i < n; i++)\n"
+        body += "\t{\n"
+        if self.wire == "text":
+            body += "\t\tmsg += ' ';\n"
+        body += "\t\tserialize_" + name + "(" + ", ".join(
+            ["msg"] + [arg["name"] + "[i]" for arg in sig["arguments"]]) + ");\n"
+        body += "\t}\n"
+        body += end_message(self, "msg")
+        if self.pool:
+            body += "\tRPCConnection &conn = rpcConnection();\n"
+            if return_ty == "void":
+                body += "\tconn.send(msg);\n"
+                return fundecl + "{\n" + body + "}\n"
+            body += "\tuint32_t requestId = conn.send(msg);\n"
+            body += self.pooled_wait("\t")
+        else:
+            body += self.send_message("RPCPROXYSOCKET")
+            if return_ty == "void":
+                return fundecl + "{\n" + body + "}\n"
+            body += self.read_length_framed_reply(name, function_id)
+        body += "\tfor (size_t i = 0; i < n; i++)\n"
+        body += "\t\t" + parse_into(return_ty, "out[i]", "data_strm",
+                                     "data_end") + "\n"
+        return fundecl + "{\n" + body + "}\n"
+
+    # <name>_async sends the request straight away and returns a future
+    # of the result, which the connection's reader thread fulfils as the
+    # reply arrives. One thread can so have many calls in flight on the
+    # pool and poll them with wait_for, and replies never pile up
+    # uncollected. Void functions get no reply, their future is ready
+    # once the request is sent.
+    def create_async_function(self, name, sig):
+        return_ty = sig["return_type"]
+        fundecl = "future<" + return_ty + "> " + name + "_async(" + \
+            self.function_params(sig) + ")\n"
+        arg_list = [arg["name"] for arg in sig["arguments"]]
+        body = "\tstring &msg = sendBuffer;\n"
+        body += "\tmsg.clear();\n"
+        body += begin_message(self, "msg", name)
+        body += "\tserialize_" + name + \
+            "(" + ", ".join(["msg"] + arg_list) + ");\n"
+        body += end_message(self, "msg")
+        if return_ty == "void":
+            body += "\trpcConnection().send(msg);\n"
+            body += "\tpromise<void> sent;\n"
+            body += "\tsent.set_value();\n"
+            body += "\treturn sent.get_future();\n"
+            return fundecl + "{\n" + body + "}\n"
+
+        promise_ty = "promise<" + return_ty + "> "
+        body += "\tshared_ptr<" + promise_ty + "> result = make_shared<" + \
+            promise_ty + ">();\n"
+        body += "\trpcConnection().send(msg, [result](const string *reply) {\n"
+        body += "\t\tif (reply == NULL)\n"
+        body += "\t\t{\n"
+        body += "\t\t\tresult->set_exception(make_exception_ptr(\n"
+        body += "\t\t\t\tC150Exception(\"proxy: connection to server " \
+            "lost\")));\n"
+        body += "\t\t\treturn;\n"
+        body += "\t\t}\n"
+        body += "\t\ttry\n"
+        body += "\t\t{\n"
+        body += "\t\t\tconst char *data_strm = reply->data();\n"
+        body += "\t\t\tconst char *data_end = data_strm + reply->length();\n"
+        if return_ty in BUILTIN_TYPES:
+            body += "\t\t\tresult->set_value(parse_" + return_ty + \
+                "(data_strm, data_end));\n"
+        else:
+            body += "\t\t\t" + return_ty + " res;\n"
+            body += "\t\t\tparse_" + return_ty + \
+                "(data_strm, data_end, res);\n"
+            body += "\t\t\tresult->set_value(res);\n"
+        body += "\t\t}\n"
+        body += "\t\tcatch (...)\n"
+        body += "\t\t{\n"
+        body += "\t\t\tresult->set_exception(current_exception());\n"
+        body += "\t\t}\n"
+        body += "\t});\n"
+        body += "\treturn result->get_future();\n"
+        return fundecl + "{\n" + body + "}\n"
+
+
+class StubGenerator(Generator):
+    def __init__(self, idl_filename, options):
+        self.server_runtime = options.server_runtime
+        self.pure = set(options.pure)
+        self.pure_cache_size = options.pure_cache_size
+        Generator.__init__(self, idl_filename, options)
+        self.stub = self.stub_name()
+
+    def get_h_files(self):
+        headers = ["rpcstubhelper.h", "c150debug.h"]
+        return headers
+
+    def get_libraries(self):
+        libraries = ["stdio.h", "stdlib.h", "cstdio", "cstring", "string",
+                     "memory", "iostream", "vector", "algorithm"]
+        if self.wire == "binary" or self.framing == "length":
+            libraries.append("cstdint")
+        if self.server_runtime:
+            libraries += ["deque", "map", "mutex", "condition_variable",
+                          "thread", "atomic", "cerrno", "unistd.h", "sys/epoll.h",
+                          "sys/socket.h", "netinet/in.h"]
+        if self.compress:
+            libraries += ["atomic", "zlib.h"]
+        if self.pure:
+            libraries += ["list", "unordered_map", "mutex", "atomic"]
+        if self.transport == "shm":
+            libraries += SHM_LIBRARIES
+        if self.metrics:
+            libraries += ["atomic", "chrono"]
+        return libraries
+
+    def stub_name(self):
+        idl_file = os.path.splitext(self.idl)[0]
+        return idl_file + ".stub.cpp"
+
+    def write_wire_helpers(self, f):
+        f.write(send_buffer)
+        if self.streamed:
+            f.write(send_ahead("RPCSTUBSOCKET"))
+        if self.wire == "binary" or self.framing == "length":
+            f.write(uint32_helpers)
+        if self.wire == "binary":
+            f.write(binary_helpers)
+        if self.framing == "length":
+            f.write(stub_request_id)
+            self.write_payload_unpacking(f, stub_compression_state)
+            f.write(length_framing)
+        if self.transport == "shm":
+            f.write(shm_channel(self.shm_ring_size))
+            f.write(shm_stub_transport)
+        if self.compress:
+            f.write(compress_message)
+        if self.server_runtime:
+            f.write(server_reply)
+
+    # Functions named by --pure whose results are cached. Results of void
+    # functions are never sent, so there is nothing to cache for them.
+    def is_pure(self, name, sig):
+        return name in self.pure and sig["return_type"] != "void"
+
+    def create_function_parser(self, name, sig):
+        fundecl = "void parse_" + name + \
+            "(" + PARSER_STREAM + ")\n"
+        body = self.start_timer(name)
+        arg_list = []
+        # pure functions are looked up by the bytes their arguments span
+        if self.is_pure(name, sig) or self.metrics:
+            body += "\tconst char *args = strm;\n"
+        for arg in sig["arguments"]:
+            arg_name = arg["name"]
+            arg_ty = arg["type"]
+            arg_list.append(arg_name)
+            # decode straight into the locals passed to the implementation
+            if arg_ty[:2] == "__":
+                body += "\t" + format_array_arg(arg_name, arg_ty) + ";\n"
+            else:
+                body += "\t{t} {n};\n".format(t=arg_ty, n=arg_name)
+            body += "\t" + parse_into(arg_ty, arg_name) + "\n"
+
+        if self.metrics:
+            body += "\ttimer.bytesIn(strm - args);\n"
+            body += "\ttimer.mark(RPC_SERIALIZE);\n"
+        if self.is_pure(name, sig):
+            arg_list += ["args", "strm - args"]
+        if self.metrics:
+            arg_list.append("timer")
+        body += "\t__{fun}(".format(fun=name) + ", ".join(arg_list) + ");\n"
+        if self.metrics:
+            body += "\ttimer.finish();\n"
+        return fundecl + "{\n" + body + "}\n\n"
+
+    # Statements appending the serialized result of call to msg, from
+    # name's result cache if it holds the result for the length bytes at
+    # args, and adding it to the cache otherwise. If timed, the call is
+    # timed as execute and the result counted in bytes out.
+    def cached_result(self, name, return_ty, call, args, length, indent,
+                      timed=False):
+        cache = "rpcResultCache_" + name
+        body = indent + "size_t resultStart = msg.length();\n"
+        # a result partly sent ahead is no longer all in msg
+        if self.streamed:
+            body += indent + "size_t sentAhead = bytesSentAhead;\n"
+        body += indent + "if (!" + cache + ".lookup(" + args + ", " + \
+            length + ", msg))\n"
+        body += indent + "{\n"
+        insert = cache + ".insert(" + args + ", " + length + \
+            ", msg.data() + resultStart, msg.length() - resultStart);\n"
+        if timed:
+            body += indent + "\t" + return_ty + " res = " + call + ";\n"
+            body += indent + "\ttimer.mark(RPC_EXECUTE);\n"
+            call = "res"
+        body += indent + "\tserialize_" + return_ty + "(msg, " + call + \
+            ");\n"
+        if self.streamed:
+            body += indent + "\tif (bytesSentAhead == sentAhead)\n"
+            body += indent + "\t\t" + insert
+        else:
+            body += indent + "\t" + insert
+        body += indent + "}\n"
+        if timed:
+            body += indent + "timer.bytesOut(" + \
+                self.serialized_bytes("resultStart") + ");\n"
+        return body
+
+    # One cache per pure function, and counters of the hits and misses of
+    # each by function name
+    def create_result_caches(self, decls):
+        names = sorted(name for name, sig in decls["functions"].items()
+                       if self.is_pure(name, sig))
+        if not names:
+            return ""
+        body = result_cache + "\n"
+        for name in names:
+            body += "RPCResultCache rpcResultCache_" + name + "(" + \
+                str(self.pure_cache_size) + ");\n"
+        for counter in ["hits", "misses"]:
+            body += "\nsize_t rpcResultCache" + counter.capitalize() + \
+                "(const char *function)\n{\n"
+            for name in names:
+                body += "\tif (strcmp(function, \"" + name + "\") == 0)\n"
+                body += "\t\treturn rpcResultCache_" + name + "." + \
+                    counter + ";\n"
+            body += "\treturn 0;\n}\n"
+        return body + "\n"
+
+    # parse_<name>_batch runs every call of a batch request through the
+    # implementation and sends all the results back in one reply
+    def create_batch_parser(self, name, sig):
+        return_ty = sig["return_type"]
+        fundecl = "void parse_" + name + "_batch(" + \
+            PARSER_STREAM + ")\n"
+        body = "\tint n = parse_int(strm, end);\n"
+        body += "\tif (n < 0 || (size_t)n > RPC_MAX_BATCH)\n"
+        body += "\t\tthrow C150Exception(\"stub: bad batch size\");\n"
+        # each call takes at least call_size bytes of the payload, so a
+        # count of more calls than fit is refused before any is run
+        call_size = sum(self.min_size(arg["type"])
+                        for arg in sig["arguments"])
+        if self.wire == "text":
+            call_size += len(sig["arguments"])
+        if call_size > 0:
+            body += "\tif ((size_t)n > (size_t)(end - strm) / " + \
+                str(call_size) + ")\n"
+            body += "\t\tthrow C150Exception(\"stub: batch of more calls " \
+                "than its payload holds\");\n"
+        if return_ty != "void":
+            size = self.max_size(return_ty)
+            if self.wire == "text":
+                size += 1
+            # capped so that it cannot overflow whatever n says
+            reserved = "min((size_t)n, RPC_BATCH_RESERVE_LIMIT / " + \
+                str(size) + ") * " + str(size)
+            body += "\tstring &msg = sendBuffer;\n"
+            body += "\tmsg.clear();\n"
+            body += "\tmsg.reserve(" + str(FRAME_OVERHEAD) + " + " + \
+                reserved + ");\n"
+            body += "\tsize_t start = beginMessage(msg, RPCFUNC_" + name + \
+                " | RPC_BATCH, currentRequestId);\n"
+        body += "\tfor (int i = 0; i < n; i++)\n"
+        body += "\t{\n"
+        if self.is_pure(name, sig):
+            # keyed by the same bytes as a single call, without the space
+            # separating the call from the one before
+            if self.wire == "text":
+                body += "\t\tif (strm < end && *strm == ' ')\n"
+                body += "\t\t\tstrm++;\n"
+            body += "\t\tconst char *args = strm;\n"
+        arg_list = []
+        for arg in sig["arguments"]:
+            arg_name = arg["name"]
+            arg_ty = arg["type"]
+            arg_list.append(arg_name)
+            if arg_ty[:2] == "__":
+                body += "\t\t" + format_array_arg(arg_name, arg_ty) + ";\n"
+            else:
+                body += "\t\t{t} {n};\n".format(t=arg_ty, n=arg_name)
+            body += "\t\t" + parse_into(arg_ty, arg_name) + "\n"
+        call = name + "(" + ", ".join(arg_list) + ")"
+        if return_ty == "void":
+            body += "\t\t" + call + ";\n"
+            return fundecl + "{\n" + body + "\t}\n}\n\n"
+        if self.wire == "text":
+            body += "\t\tif (i > 0)\n"
+            body += "\t\t\tmsg += ' ';\n"
+        if self.is_pure(name, sig):
+            body += self.cached_result(name, return_ty, call, "args",
+                                       "strm - args", "\t\t")
+        else:
+            body += "\t\tserialize_" + return_ty + "(msg, " + call + ");\n"
+        body += "\t}\n"
+        body += end_message(self, "msg")
+        if self.server_runtime:
+            body += "\trpcReply(msg);\n"
+        else:
+            body += self.send_message("RPCSTUBSOCKET")
+            body += self.grading("\"Server sent \" << n << \" return values "
+                                 "of type " + return_ty + " for " + name +
+                                 "_batch\"")
+        return fundecl + "{\n" + body + "}\n\n"
+
+    def create_top_level_function(self, name, sig):
+        return_ty = sig["return_type"]
+        funname = "__" + name
+        p = []
+        refs = []
+        a = []
+        for arg in sig["arguments"]:
+            arg_name = arg["name"]
+            arg_ty = arg["type"]
+            a.append(arg_name)
+            if arg_ty[:2] == "__":
+                p.append(format_array_arg(arg_name, arg_ty))
+                refs.append(format_array_arg(arg_name, arg_ty))
+            else:
+                p.append(arg_ty + " " + arg_name)
+                refs.append(const_ref_param(arg_name, arg_ty))
+        params = ", ".join(p)
+        if self.is_pure(name, sig):
+            return self.create_pure_top_level_function(name, sig, refs, a,
+                                                       params)
+        if self.metrics:
+            refs.append("RPCCallTimer &timer")
+        fundecl = return_ty + " " + funname + "(" + ", ".join(refs) + ")\n"
+        body = "\t" + ("" if return_ty == "void" else return_ty + " res = ") + \
+            name + "(" + ", ".join(a) + ");\n"
+        if self.metrics:
+            body += "\ttimer.mark(RPC_EXECUTE);\n"
+        if return_ty == "void":
+            return fundecl + "{\n" + body + "\treturn;\n}\n\n"
+        # GRADING is not safe to share between server runtime workers
+        if not self.server_runtime:
+            body += self.grading("\"Server received request to invoke " +
+                                 name + "(" + ", ".join(a) + ")\"")
+        size = self.reserved_size(
+            self.max_size(return_ty) + FRAME_OVERHEAD,
+            ["res"] if return_ty == "string" else [])
+        body += "\tstring &msg = sendBuffer;\n"
+        body += "\tmsg.clear();\n"
+        body += "\tmsg.reserve(" + size + ");\n"
+        body += begin_message(self, "msg", name, "currentRequestId")
+        if self.metrics:
+            body += "\tsize_t resultStart = msg.length();\n"
+            if self.streamed:
+                body += "\tsize_t sentAhead = bytesSentAhead;\n"
+        body += "\tserialize_" + return_ty + "(msg, res);\n"
+        if self.metrics:
+            body += "\ttimer.bytesOut(" + \
+                self.serialized_bytes("resultStart") + ");\n"
+        body += end_message(self, "msg")
+        body += self.send_reply(return_ty, name, params)
+        body += "\treturn res;\n"
+        return fundecl + "{\n" + body + "}\n\n"
+
+    # Statements sending the reply in msg, timed as network with --metrics
+    def send_reply(self, return_ty, name, params):
+        body = ""
+        if self.metrics:
+            body += "\ttimer.mark(RPC_SERIALIZE);\n"
+        if self.server_runtime:
+            body += "\trpcReply(msg);\n"
+        else:
+            body += self.send_message("RPCSTUBSOCKET")
+            body += self.grading("\"Server sent return value of type " +
+                                 return_ty + " for " + name + "(" + params +
+                                 ")\"")
+        if self.metrics:
+            body += "\ttimer.mark(RPC_NETWORK);\n"
+        return body
+
+    # __<fn> for a pure function, replying from its result cache when the
+    # cache holds the result for the argsLength bytes at args
+    def create_pure_top_level_function(self, name, sig, refs, a, params):
+        return_ty = sig["return_type"]
+        params_with_args = refs + ["const char *args", "size_t argsLength"]
+        if self.metrics:
+            params_with_args.append("RPCCallTimer &timer")
+        fundecl = "void __" + name + "(" + ", ".join(params_with_args) + \
+            ")\n"
+        call = name + "(" + ", ".join(a) + ")"
+        size = self.reserved_size(
+            self.max_size(return_ty) + FRAME_OVERHEAD, [])
+        body = "\tstring &msg = sendBuffer;\n"
+        body += "\tmsg.clear();\n"
+        body += "\tmsg.reserve(" + size + ");\n"
+        body += begin_message(self, "msg", name, "currentRequestId")
+        body += self.cached_result(name, return_ty, call, "args",
+                                   "argsLength", "\t", self.metrics)
+        body += end_message(self, "msg")
+        body += self.send_reply(return_ty, name, params)
+        return fundecl + "{\n" + body + "}\n\n"
+
+    # Table of parse_<fn> handlers sorted by function name, so that a name
+    # is found by binary search and a function id is the table index
+    def create_dispatch_table(self, funnames):
+        body = "typedef void (*RPCHandler)(" + \
+            PARSER_STREAM + ");\n\n"
+        body += "struct RPCDispatchEntry\n{\n"
+        body += "\tconst char *name;\n"
+        body += "\tRPCHandler handler;\n"
+        body += "};\n\n"
+        body += "static const RPCDispatchEntry dispatchTable[] = {\n"
+        for n in sorted(funnames):
+            body += "\t{\"" + n + "\", parse_" + n + "},\n"
+        body += "};\n"
+        body += "const size_t DISPATCH_TABLE_SIZE = " + \
+            str(len(funnames)) + ";\n"
+        if self.batch:
+            body += "\n// Batch handlers, indexed like dispatchTable\n"
+            body += "static const RPCHandler batchTable[] = {\n"
+            for n in sorted(funnames):
+                body += "\tparse_" + n + "_batch,\n"
+            body += "};\n"
+        # length framed dispatch indexes the table directly
+        if self.framing == "null" and self.function_ids:
+            body += find_handler_by_id
+        elif self.framing == "null":
+            body += find_handler
+        return body + "\n"
+
+    def dispatch_function(self, funnames):
+        fundecl = "void dispatchFunction()\n"
+        if self.framing == "length":
+            return fundecl + "{\n" + self.dispatch_by_id(funnames) + "}\n"
+        if self.wire == "binary":
+            body = \
+                """
+    char functionNameBuffer[50];
+    getDataFromStream(functionNameBuffer, sizeof(functionNameBuffer));
+    if (!RPCSTUBSOCKET->eof())
+    {
+        string data = readFrame();
+        const char *data_strm = data.data();
+        const char *data_end = data_strm + data.length();
+"""
+        else:
+            body = \
+                """
+    char functionNameBuffer[50];
+    getDataFromStream(functionNameBuffer, sizeof(functionNameBuffer));
+    const char *data_end;
+    const char *data_strm = nextMessage(data_end);
+    if (!RPCSTUBSOCKET->eof())
+    {
+"""
+        if self.function_ids:
+            body += "\t\tRPCHandler handler = findHandlerById(functionNameBuffer);\n"
+        else:
+            body += "\t\tRPCHandler handler = findHandler(functionNameBuffer);\n"
+        body += "\t\tif (handler == NULL)\n"
+        body += "\t\t\t__badFunction(functionNameBuffer);\n"
+        body += "\t\telse\n"
+        body += "\t\t\thandler(data_strm, data_end);\n"
+        body += "\t}\n"
+        return fundecl + "{\n" + body + "}\n"
+
+    # Worker thread of the server runtime, running queued requests. A
+    # request that throws, or names no function, drops its client only:
+    # shutting the socket down makes the acceptor see it end, and the
+    # requests that client still has queued are skipped
+    def create_server_worker(self):
+        body = "void rpcWorker()\n{\n"
+        body += "\twhile (true)\n"
+        body += "\t{\n"
+        body += "\t\tRPCJob job = nextJob();\n"
+        body += "\t\tif (job.conn->failed)\n"
+        body += "\t\t\tcontinue;\n"
+        body += "\t\tcurrentConnection = job.conn.get();\n"
+        body += "\t\tcurrentRequestId = job.requestId;\n"
+        body += "\t\ttry\n"
+        body += "\t\t{\n"
+        if self.compress:
+            body += "\t\t\tjob.payload.resize(unpackPayload(job.functionId, " \
+                "job.payload, job.payload.length()));\n"
+        body += "\t\t\tconst char *data_strm = job.payload.data();\n"
+        body += "\t\t\tconst char *data_end = data_strm + " \
+            "job.payload.length();\n"
+        body += self.call_handler(
+            "job.functionId", "\t\t\t",
+            "throw C150Exception(\"server: unknown function id\");")
+        body += "\t\t}\n"
+        body += "\t\tcatch (...)\n"
+        body += "\t\t{\n"
+        body += "\t\t\tc150debug->printf(C150RPCDEBUG, \"server: request " \
+            "failed, dropping its client\");\n"
+        body += "\t\t\tjob.conn->failed = true;\n"
+        body += "\t\t\tshutdown(job.conn->fd, SHUT_RDWR);\n"
+        body += "\t\t}\n"
+        body += "\t\tcurrentConnection = NULL;\n"
+        body += "\t}\n"
+        return body + "}\n"
+
+    def write_server_runtime(self, f):
+        f.write(server_queue + "\n")
+        f.write(self.create_server_worker())
+        f.write(server_loop)
+
+    # Length framed messages name the function by id in their header
+    def dispatch_by_id(self, funnames):
+        body = \
+            """
+    if (endOfStream())
+        return;
+    uint32_t functionId;
+"""
+        body += "\tuint32_t length = readMessage(functionId, " \
+            "currentRequestId);\n"
+        body += "\tconst char *data_strm = &messageBuffer[0];\n"
+        body += "\tconst char *data_end = data_strm + length;\n"
+        if self.transport == "shm":
+            body += "\tif (functionId == RPC_SHM_ATTACH)\n"
+            body += "\t{\n"
+            body += "\t\trpcShmAttach(data_strm);\n"
+            body += "\t\treturn;\n"
+            body += "\t}\n"
+        body += self.call_handler("functionId", "\t")
+        return body
+
+    # Statements running the handler for a length framed function id, or
+    # bad for ids naming no function
+    def call_handler(self, function_id, indent,
+                     bad="__badFunction((char *)\"unknown function id\");"):
+        if self.batch:
+            batch_id = function_id + " & ~RPC_BATCH"
+            body = indent + "if (" + function_id + " < DISPATCH_TABLE_SIZE)\n"
+            body += indent + "\tdispatchTable[" + function_id + \
+                "].handler(data_strm, data_end);\n"
+            body += indent + "else if ((" + function_id + " & RPC_BATCH) && (" + \
+                batch_id + ") < DISPATCH_TABLE_SIZE)\n"
+            body += indent + "\tbatchTable[" + batch_id + \
+                "](data_strm, data_end);\n"
+            body += indent + "else\n"
+            body += indent + "\t" + bad + "\n"
+            return body
+        body = indent + "if (" + function_id + " >= DISPATCH_TABLE_SIZE)\n"
+        body += indent + "\t" + bad + "\n"
+        body += indent + "else\n"
+        body += indent + "\tdispatchTable[" + function_id + \
+            "].handler(data_strm, data_end);\n"
+        return body
+
+
+# --python writes <idl>_proxy.py, a Python client speaking the wire
+# format and framing of the stub generated with the same options. Its
+# runtime follows: what every client needs, then the codecs of the
+# builtins in each wire format and the framings, as for the C++ proxy.
+python_client_runtime = \
+    """
+class RPCError(Exception):
+    pass
+
+
+_INT32 = struct.Struct("<i")
+_UINT32 = struct.Struct("<I")
+_FLOAT32 = struct.Struct("<f")
+# Little-endian numpy dtypes of int and float array elements
+_DTYPES = {"int": "<i4", "float": "<f4"}
+
+
+# x as the server's 32 bit int or float holds it, refusing ints that do
+# not fit
+def _int32(x):
+    return _INT32.unpack(_INT32.pack(x))[0]
+
+
+def _float32(x):
+    return _FLOAT32.unpack(_FLOAT32.pack(x))[0]
+
+
+def _encode_string(s):
+    if isinstance(s, str):
+        return s.encode("utf-8", "surrogateescape")
+    return bytes(s)
+
+
+def _decode_string(data):
+    return data.decode("utf-8", "surrogateescape")
+
+
+def _check_length(a, n):
+    if len(a) != n:
+        raise ValueError("array of %d elements where %d are declared" %
+                         (len(a), n))
+
+
+# An int or float array of the declared shape as a numpy array
+def _as_ndarray(a, shape, kind):
+    a = numpy.asarray(a, dtype=_DTYPES[kind])
+    if a.shape != shape:
+        raise ValueError("array of shape %s where %s is declared" %
+                         (a.shape, shape))
+    return a
+
+
+# The elements of nested sequences of the declared shape, row by row
+def _flatten(a, shape, flat=None):
+    if flat is None:
+        flat = []
+    _check_length(a, shape[0])
+    if len(shape) == 1:
+        flat.extend(a)
+    else:
+        for row in a:
+            _flatten(row, shape[1:], flat)
+    return flat
+
+
+# Nested lists of the given shape holding the elements of flat
+def _nest(flat, shape):
+    for n in reversed(shape[1:]):
+        flat = [flat[i:i + n] for i in range(0, len(flat), n)]
+    return flat
+
+
+def _zeros(shape, kind):
+    if numpy is not None:
+        return numpy.zeros(shape, _DTYPES[kind])
+    return _nest([0 if kind == "int" else 0.0] * math.prod(shape), shape)
+
+
+def _same(a, b):
+    if numpy is not None and (isinstance(a, numpy.ndarray) or
+                              isinstance(b, numpy.ndarray)):
+        return numpy.array_equal(a, b)
+    return a == b
+
+
+# Base of the IDL's structs, compared member by member
+class _Struct:
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            _same(getattr(self, m), getattr(other, m))
+            for m in self.__slots__)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % (m, getattr(self, m)) for m in self.__slots__))
+
+
+# Reads a socket as asyncio's StreamReader reads a stream, so that both
+# clients share the framings
+class _SocketReader:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def readexactly(self, n):
+        data = bytearray(n)
+        got = min(n, len(self.buffer))
+        data[:got] = self.buffer[:got]
+        del self.buffer[:got]
+        view = memoryview(data)
+        while got < n:
+            count = self.sock.recv_into(view[got:])
+            if count == 0:
+                raise RPCError("server closed the connection")
+            got += count
+        return data
+
+    def readuntil(self, separator):
+        start = 0
+        while True:
+            end = self.buffer.find(separator, start)
+            if end >= 0:
+                break
+            if len(self.buffer) > MAX_MESSAGE_SIZE:
+                raise RPCError("reply longer than MAX_MESSAGE_SIZE")
+            start = len(self.buffer)
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise RPCError("server closed the connection")
+            self.buffer += chunk
+        end += len(separator)
+        data = self.buffer[:end]
+        del self.buffer[:end]
+        return data
+
+
+class _Connection(_Framing):
+    def __init__(self, host, port, timeout):
+        _Framing.__init__(self)
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = _SocketReader(self.sock)
+
+    # Send a request and return the reply parsed by parse, or None if
+    # parse is None, as void functions get no reply
+    def call(self, name, payload, parse):
+        self.sock.sendall(self.frame(name, payload))
+        if parse is None:
+            return None
+        return parse(self.receive(self.reader, name), 0)[0]
+
+    def close(self):
+        self.sock.close()
+
+
+class _AsyncConnection(_Framing):
+    def __init__(self, reader, writer):
+        _Framing.__init__(self)
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(
+            host, port, limit=MAX_MESSAGE_SIZE + 1)
+        return cls(reader, writer)
+
+    async def call(self, name, payload, parse):
+        self.writer.write(self.frame(name, payload))
+        await self.writer.drain()
+        if parse is None:
+            return None
+        try:
+            reply = await self.receive_async(self.reader, name)
+        except asyncio.IncompleteReadError as e:
+            raise RPCError("server closed the connection") from e
+        except asyncio.LimitOverrunError as e:
+            raise RPCError("reply longer than MAX_MESSAGE_SIZE") from e
+        return parse(reply, 0)[0]
+
+    def close(self):
+        self.writer.close()
+
+
+# Connections are opened as concurrent calls need them, up to pool_size,
+# and each carries one call at a time. One whose call failed is closed,
+# as what it still holds of that call is unknown.
+class _Pool:
+    def __init__(self, host, port, pool_size=4, timeout=None):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _call(self, name, payload, parse):
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = _Connection(self.host, self.port, self.timeout)
+            try:
+                result = conn.call(name, payload, parse)
+            except BaseException:
+                conn.close()
+                raise
+            with self._lock:
+                self._idle.append(conn)
+            return result
+
+
+class _AsyncPool:
+    def __init__(self, host, port, pool_size=4):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.host = host
+        self.port = port
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _call(self, name, payload, parse):
+        async with self._slots:
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = await _AsyncConnection.open(self.host, self.port)
+            try:
+                result = await conn.call(name, payload, parse)
+            except BaseException:
+                conn.close()
+                raise
+            self._idle.append(conn)
+            return result
+"""
+
+# Builtins of the text wire format. Each _put_<type> appends a value to
+# msg, and each _get_<type> returns the value at pos in buf and the
+# position after it; parsers skip the spaces separating values.
+python_text_int_codec = \
+    """
+_TEXT_INT = re.compile(rb" *(-?[0-9]*)")
+
+
+def _put_int(msg, x):
+    msg += b"%d" % _int32(x)
+
+
+def _get_int(buf, pos):
+    m = _TEXT_INT.match(buf, pos)
+    digits = m.group(1)
+    if digits in (b"", b"-"):
+        raise RPCError("message holds no int where one belongs")
+    x = int(digits)
+    return (x + 0x80000000) % 0x100000000 - 0x80000000, m.end()
+"""
+
+python_text_float_parser = \
+    """
+_TEXT_FLOAT = re.compile(rb" *([^ ]*)")
+
+
+def _get_float(buf, pos):
+    m = _TEXT_FLOAT.match(buf, pos)
+    token = bytes(m.group(1))
+    try:
+        x = float(token)
+    except ValueError:
+        try:
+            x = float.fromhex(token.decode("ascii"))
+        except (ValueError, UnicodeDecodeError):
+            raise RPCError("not a float: %r" % token) from None
+    return _float32(x), m.end()
+"""
+
+# Nine significant digits, as the C++ serialize_float sends
+python_text_float_serializer = \
+    """
+def _put_float(msg, x):
+    msg += b"%.9g" % _float32(x)
+"""
+
+# Exact hexadecimal floats for --hex-floats
+python_hex_float_serializer = \
+    """
+def _put_float(msg, x):
+    msg += _float32(x).hex().encode("ascii")
+"""
+
+python_text_string_codec = \
+    """
+def _put_string(msg, s):
+    data = _encode_string(s)
+    msg += b"%d " % len(data)
+    msg += data
+
+
+def _get_string(buf, pos):
+    n, pos = _get_int(buf, pos)
+    pos += 1  # the space after the length
+    if n < 0 or pos + n > len(buf):
+        raise RPCError("string runs past the end of the message")
+    return _decode_string(buf[pos:pos + n]), pos + n
+"""
+
+# Arrays of ints and floats of any dimension, accepted as numpy arrays or
+# nested sequences and returned as numpy arrays where numpy is installed
+python_text_array_codec = \
+    """
+def _put_array(msg, a, shape, kind):
+    if numpy is not None:
+        flat = _as_ndarray(a, shape, kind).ravel().tolist()
+    else:
+        flat = _flatten(a, shape)
+    put = _put_int if kind == "int" else _put_float
+    for i, x in enumerate(flat):
+        if i > 0:
+            msg += b" "
+        put(msg, x)
+
+
+def _get_array(buf, pos, shape, kind):
+    get = _get_int if kind == "int" else _get_float
+    flat = []
+    for _ in range(math.prod(shape)):
+        x, pos = get(buf, pos)
+        flat.append(x)
+    if numpy is not None:
+        return numpy.array(flat, _DTYPES[kind]).reshape(shape), pos
+    return _nest(flat, shape), pos
+"""
+
+python_binary_codecs = \
+    """
+def _put_int(msg, x):
+    msg += _INT32.pack(x)
+
+
+# Raise if fewer than 4 bytes are left at pos
+def _need_word(buf, pos):
+    if pos + 4 > len(buf):
+        raise RPCError("message ends inside a value")
+
+
+def _get_int(buf, pos):
+    _need_word(buf, pos)
+    return _INT32.unpack_from(buf, pos)[0], pos + 4
+
+
+def _put_float(msg, x):
+    msg += _FLOAT32.pack(x)
+
+
+def _get_float(buf, pos):
+    _need_word(buf, pos)
+    return _FLOAT32.unpack_from(buf, pos)[0], pos + 4
+
+
+def _put_string(msg, s):
+    data = _encode_string(s)
+    msg += _UINT32.pack(len(data))
+    msg += data
+
+
+def _get_string(buf, pos):
+    _need_word(buf, pos)
+    n = _UINT32.unpack_from(buf, pos)[0]
+    pos += 4
+    if pos + n > len(buf):
+        raise RPCError("string runs past the end of the message")
+    return _decode_string(buf[pos:pos + n]), pos + n
 
-    arg_type = array_type(ty) + " array"
-    fundecl = "string serialize_" + format_array_funname(ty) + "("
 
-    for size in size_list:
-        arg_type += "[" + size + "]"
+# numpy arrays are copied to the wire as they are
+def _put_array(msg, a, shape, kind):
+    if numpy is not None:
+        msg += _as_ndarray(a, shape, kind).tobytes()
+    else:
+        flat = _flatten(a, shape)
+        msg += struct.pack("<%d%s" % (len(flat), kind[0]), *flat)
 
-    fundecl += arg_type + ")"
-    return fundecl
 
-# Generate a specific serializer for an nDarray with type ty and dimension n
+def _get_array(buf, pos, shape, kind):
+    n = math.prod(shape)
+    end = pos + 4 * n
+    if end > len(buf):
+        raise RPCError("array runs past the end of the message")
+    if numpy is not None:
+        a = numpy.frombuffer(buf, _DTYPES[kind], n, pos)
+        return a.reshape(shape).copy(), end
+    return _nest(list(struct.unpack_from("<%d%s" % (n, kind[0]), buf,
+                                         pos)), shape), end
+"""
 
+PYTHON_CODECS = {
+    "text": [python_text_int_codec, python_text_float_parser,
+             python_text_float_serializer, python_text_string_codec,
+             python_text_array_codec],
+    "binary": [python_binary_codecs],
+}
 
-def create_array_serializer(ty, sig):
-    fundecl = array_serializer_fdecl(ty, sig) + "\n"
-    body = "\tstring msg;\n"
-    body += "\tint size = " + str(sig["element_count"]) + ";\n"
-    body += "\tfor (int i = 0; i < size; i++)\n"
-    body += "\t{\n"
-    body += "\t\tmsg += serialize_" + \
-        format_array_funname(sig["member_type"]) + "(array[i]);\n"
-    body += "\t\tif(i != size - 1)\n"
-    body += "\t\t\tmsg += \" \";\n"
-    body += "\t}\n"
-    body += "\treturn msg;\n"
+# Each framing's _Framing frames requests and reads their replies, with
+# receive through a _SocketReader and receive_async through asyncio.
+# Null terminated requests name the function, or give its id, first.
+python_null_text_framing = \
+    """
+class _Framing:
+    def __init__(self):
+        pass
 
-    return fundecl + "{\n" + body + "}\n"
+    def frame(self, name, payload):
+        return b"".join((_FUNCTIONS[name], b"\\0", payload, b"\\0"))
 
+    def receive(self, reader, name):
+        return reader.readuntil(b"\\0")[:-1]
 
-def struct_serializer_fdecl(ty, sig):
-    arg = "struct__" + ty[0].lower()
-    return "string serialize_" + ty + "(" + ty + " " + arg + ")"
+    async def receive_async(self, reader, name):
+        return (await reader.readuntil(b"\\0"))[:-1]
+"""
 
+python_null_binary_framing = \
+    """
+class _Framing:
+    def __init__(self):
+        pass
 
-def struct_parser_fdecl(ty, sig):
-    return ty + " " + "parse_" + ty + "(stringstream &strm)"
+    def frame(self, name, payload):
+        return b"".join((_FUNCTIONS[name], b"\\0",
+                         _UINT32.pack(len(payload)), payload))
 
+    def reply_length(self, header):
+        length = _UINT32.unpack(header)[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise RPCError("reply longer than MAX_MESSAGE_SIZE")
+        return length
 
-def create_struct_serializer(ty, sig):
-    fundecl = struct_serializer_fdecl(ty, sig) + "\n"
-    arg = "struct__" + ty[0].lower()
-    body = "\tstring msg = \"\";\n"
+    def receive(self, reader, name):
+        return reader.readexactly(self.reply_length(reader.readexactly(4)))
 
-    for i, member in enumerate(sig["members"]):
-        if member["type"][:2] == "__":
-            funname = format_array_funname(member["type"])
-        else:
-            funname = member["type"]
-        body += "\tmsg += serialize_" + funname + \
-            "(" + arg + "." + member["name"] + ");\n"
-        if i != len(sig["members"]) - 1:
-            body += "\tmsg += \" \";\n"
+    async def receive_async(self, reader, name):
+        length = self.reply_length(await reader.readexactly(4))
+        return await reader.readexactly(length)
+"""
 
-    body += "\treturn msg;\n"
+# Length framed requests carry a request id that their replies must
+# echo. With COMPRESSION the client negotiates compression as the C++
+# proxy does.
+python_length_framing = \
+    """
+_HEADER = struct.Struct("<III")
+_COMPRESSED = 0x40000000
+_ACCEPTS_COMPRESSED = 0x20000000
 
-    serializer = fundecl + "{\n" + body + "}\n"
-    return serializer
 
+class _Framing:
+    def __init__(self):
+        self.request_id = 0
+        self.peer_accepts_compression = False
+        self.compressed = False
 
-def create_struct_parser(ty, sig):
-    fundecl = struct_parser_fdecl(ty, sig) + "\n"
-    arg = "struct__" + ty[0].lower()
-    body = "\t" + ty + " " + arg + ";\n"
+    def frame(self, name, payload):
+        self.request_id = (self.request_id + 1) & 0xffffffff
+        function_id = FUNCTION_IDS[name]
+        if COMPRESSION:
+            function_id |= _ACCEPTS_COMPRESSED
+            if self.peer_accepts_compression and \\
+                    len(payload) >= COMPRESS_THRESHOLD:
+                packed = _UINT32.pack(len(payload)) + \\
+                    zlib.compress(payload, 1)
+                if len(packed) < len(payload):
+                    payload = packed
+                    function_id |= _COMPRESSED
+        return b"".join((_HEADER.pack(len(payload), function_id,
+                                      self.request_id), payload))
 
-    for member in sig["members"]:
-        mty = member["type"]
-        if mty[:2] == "__":
-            dimension = len(mty.split("[")) - 1
-            funname = array_type(mty) + str(dimension) + "DArray"
-            body += "\tparse_" + \
-                funname + \
-                    "(strm, {memb});\n".format(
-                        memb=arg + "." + member["name"])
-        else:
-            funname = mty
-            body += "\t" + arg + "." + member["name"] + " = " + "parse_" + \
-                funname + "(strm);\n"
+    def reply_length(self, header, name):
+        length, function_id, request_id = _HEADER.unpack(header)
+        if length > MAX_MESSAGE_SIZE:
+            raise RPCError("reply longer than MAX_MESSAGE_SIZE")
+        self.peer_accepts_compression = \\
+            bool(function_id & _ACCEPTS_COMPRESSED)
+        self.compressed = bool(function_id & _COMPRESSED)
+        function_id &= ~(_COMPRESSED | _ACCEPTS_COMPRESSED)
+        if function_id != FUNCTION_IDS[name] or \\
+                request_id != self.request_id:
+            raise RPCError("reply does not match %s request" % name)
+        return length
 
-    body += "\treturn " + arg + ";\n"
+    # Inflate a payload compressed behind its original length
+    def unpack(self, payload):
+        if not self.compressed:
+            return payload
+        if len(payload) < 4:
+            raise RPCError("truncated compressed payload")
+        length = _UINT32.unpack_from(payload)[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise RPCError("reply longer than MAX_MESSAGE_SIZE")
+        inflater = zlib.decompressobj()
+        try:
+            data = inflater.decompress(bytes(payload[4:]), length)
+        except zlib.error as e:
+            raise RPCError("corrupt compressed payload") from e
+        if len(data) != length or inflater.unconsumed_tail:
+            raise RPCError("corrupt compressed payload")
+        return data
 
-    parser = fundecl + "{\n" + body + "}\n"
-    return parser
+    def receive(self, reader, name):
+        length = self.reply_length(reader.readexactly(_HEADER.size), name)
+        return self.unpack(reader.readexactly(length))
 
+    async def receive_async(self, reader, name):
+        length = self.reply_length(await reader.readexactly(_HEADER.size),
+                                   name)
+        return self.unpack(await reader.readexactly(length))
+"""
 
-class ProxyGenerator:
-    def __init__(self, idl_filename):
-        self.idl = idl_filename
-        self.h_files = self.get_h_files()
-        self.libraries = self.get_libraries()
-        self.proxy = self.proxy_name()
-        self.builtin_parsers = [int_parser, float_parser, string_parser]
-        self.builtin_serializers = [int_serializer,
-                                    float_serializer, string_serializer]
-        self.array_dimensions = set()
 
-    def get_h_files(self):
-        headers = ["rpcproxyhelper.h", "c150debug.h"]
-        return headers
+# Python tuple of the strings in items
+def python_tuple(items):
+    if len(items) == 1:
+        return "(" + items[0] + ",)"
+    return "(" + ", ".join(items) + ")"
 
-    def get_libraries(self):
-        return ["stdio.h", "stdlib.h", "cstdio", "cstring", "string", "sstream", "memory", "iostream"]
 
-    def proxy_name(self):
-        idl_file = self.idl[: self.idl.index(".")]
-        return idl_file + ".proxy.cpp"
+# Name of an IDL name in Python, which may not be a keyword
+def python_identifier(name):
+    if keyword.iskeyword(name) or name == "self":
+        return name + "_"
+    return name
 
-    # Generate boilerplate proelf.array_dimensions = set()xy.cpp file with dependencies,
-    # builtin parsers and serializers
-    def create_template(self, f):
-        h_files = list(
-            map((lambda x: "#include \"" + x + "\"\n"), self.h_files))
-        libraries = list(
-            map((lambda x: "#include <" + x + ">\n"), self.libraries))
-        f.writelines(libraries)
-        f.writelines(h_files)
-        f.write("using namespace std;\n")
-        f.write("using namespace C150NETWORK;\n")
-        f.write("#include \"" + self.idl + "\"\n")
 
-    def write_builtin_parsers(self, f):
-        f.writelines(self.builtin_parsers)
+# Writes <idl>_proxy.py. Shares the options of the C++ generators, but
+# none of their C++.
+class PythonProxyGenerator(WireGenerator):
+    def __init__(self, idl_filename, options):
+        WireGenerator.__init__(self, idl_filename, options)
+        self.hex_floats = options.hex_floats
+        self.proxy = os.path.splitext(idl_filename)[0] + "_proxy.py"
+        self.ids = {}
 
-    def write_builtin_serializers(self, f):
-        f.writelines(self.builtin_serializers)
+    def create_header(self, f):
+        framing = "null terminated" if self.framing == "null" else \
+            "length framed"
+        about = "Client(host, port) calls its functions over a pool of " \
+            "connections, and AsyncClient(host, port) from asyncio, " \
+            "sending " + self.wire + " values in " + framing + " messages " \
+            "as its stub generated with the same options expects. int and " \
+            "float arrays are numpy arrays where numpy is installed, and " \
+            "nested lists otherwise."
+        f.write("#\n")
+        f.write("#          Python client for " +
+                os.path.basename(self.idl) + "\n")
+        f.write("#\n")
+        f.write(textwrap.fill("Generated by rpcgenerate.py --python. " +
+                              about, 76, initial_indent="#     ",
+                              subsequent_indent="#     ") + "\n")
+        f.write("#\n")
+        modules = ["asyncio", "math", "re", "socket", "struct",
+                   "threading", "zlib"]
+        f.writelines("import " + m + "\n" for m in modules)
+        f.write("\ntry:\n    import numpy\nexcept ImportError:\n"
+                "    numpy = None\n\n")
+        f.write("MAX_MESSAGE_SIZE = " + str(self.max_message_size) + "\n")
+        if self.framing == "length":
+            f.write("COMPRESSION = " + str(self.compress) + "\n")
+            f.write("COMPRESS_THRESHOLD = " +
+                    str(self.compress_threshold) + "\n")
+            f.write("FUNCTION_IDS = {\n")
+            for name in sorted(self.ids, key=self.ids.get):
+                f.write("    \"" + name + "\": " + str(self.ids[name]) +
+                        ",\n")
+            f.write("}\n")
+        else:
+            # What a null terminated request names its function by
+            f.write("_FUNCTIONS = {\n")
+            for name in sorted(self.ids, key=self.ids.get):
+                tag = str(self.ids[name]) if self.function_ids else name
+                f.write("    \"" + name + "\": b\"" + tag + "\",\n")
+            f.write("}\n")
 
-    # Generate a generic array parser for nDarray of type ty and dimenson n
-    def create_array_parser(self, ty, sig, dimension, array_ty):
-        fundecl = array_parser_fdecl(ty, sig, dimension, array_ty) + "\n"
-        body = "\tfor (int i = 0; i < " + ARRAY_SIZE_VARS[0] + "; i++)\n"
-        body += "\t{\n"
-        if dimension == 1:
-            body += "\t\tarray[i] = parse_" + array_ty + "(strm);\n"
+    def write_runtime(self, f):
+        if self.framing == "length":
+            f.write(python_length_framing)
+        elif self.wire == "binary":
+            f.write(python_null_binary_framing)
         else:
-            body += "\t\tparse_" + array_ty + \
-                str(dimension-1) + "DArray(strm, array[i]);\n"
-        body += "\t}\n"
+            f.write(python_null_text_framing)
+        f.write(python_client_runtime)
+        codecs = PYTHON_CODECS[self.wire]
+        if self.hex_floats:
+            codecs = [python_hex_float_serializer
+                      if c is python_text_float_serializer else c
+                      for c in codecs]
+        f.writelines(codecs)
 
-        self.array_dimensions.add((dimension, array_ty))
-        return fundecl + "{\n" + body + "}\n"
+    # Python expression of a default value of ty
+    def default_value(self, ty):
+        if ty == "int":
+            return "0"
+        if ty == "float":
+            return "0.0"
+        if ty == "string":
+            return "\"\""
+        sig = self.decls["types"][ty]
+        if sig["type_of_type"] == "struct":
+            return python_identifier(ty) + "()"
+        element_ty = array_type(ty)
+        if element_ty in ("int", "float"):
+            return "_zeros(" + python_tuple(array_size(ty)) + ", \"" + \
+                element_ty + "\")"
+        return "[" + self.default_value(sig["member_type"]) + \
+            " for _ in range(" + str(sig["element_count"]) + ")]"
 
-    def create_function_serializer(self, funname, sig):
-        return_ty = sig["return_type"]
-        a = []
-        for arg in sig["arguments"]:
-            if arg["type"][:2] == "__":
-                a.append(format_array_arg(arg["name"], arg["type"]))
+    def create_struct_class(self, ty, sig):
+        names = [python_identifier(m["name"]) for m in sig["members"]]
+        body = "\n\nclass " + python_identifier(ty) + "(_Struct):\n"
+        body += "    __slots__ = " + python_tuple(
+            ["\"" + n + "\"" for n in names]) + "\n"
+        if not names:
+            return body
+        params = []
+        assigns = ""
+        for name, member in zip(names, sig["members"]):
+            if member["type"] in BUILTIN_TYPES:
+                params.append(name + "=" + self.default_value(member["type"]))
+                assigns += "        self." + name + " = " + name + "\n"
             else:
-                a.append(arg["type"] + " " + arg["name"])
-
-        args = ", ".join(a)
-        fundecl = "string serialize_{fn}({params})\n".format(
-            fn=funname, params=args)
+                params.append(name + "=None")
+                assigns += "        if " + name + " is None:\n"
+                assigns += "            " + name + " = " + \
+                    self.default_value(member["type"]) + "\n"
+                assigns += "        self." + name + " = " + name + "\n"
+        body += "\n    def __init__(self, " + ", ".join(params) + "):\n"
+        return body + assigns
 
-        body = "\tstring msg;\n"
-
-        a.clear()
-        for arg in sig["arguments"]:
-            if arg["type"][:2] == "__":
-                ty = format_array_funname(arg["type"])
-            else:
-                ty = arg["type"]
-            a.append(
-                "\tmsg += serialize_{t}({n});\n".format(t=ty, n=arg["name"]))
+    # Statements of a _put_ or _get_ function that join the values of
+    # items with spaces on the text wire
+    def separator(self, indent):
+        if self.wire == "text":
+            return indent + "msg += b\" \"\n"
+        return ""
 
-        body += "\tmsg += \" \";\n".join(a)
-        body += "\treturn msg;\n"
+    def create_type_codec(self, ty, sig):
+        funname = format_array_funname(ty)
+        put = "\n\ndef _put_" + funname + "(msg, v):\n"
+        get = "\n\ndef _get_" + funname + "(buf, pos):\n"
+        if sig["type_of_type"] == "struct":
+            names = [python_identifier(m["name"]) for m in sig["members"]]
+            if not names:
+                return put + "    pass\n" + get + "    return " + \
+                    python_identifier(ty) + "(), pos\n"
+            for i, (name, member) in enumerate(zip(names, sig["members"])):
+                if i > 0:
+                    put += self.separator("    ")
+                member_fn = format_array_funname(member["type"])
+                put += "    _put_" + member_fn + "(msg, v." + name + ")\n"
+                get += "    " + name + ", pos = _get_" + member_fn + \
+                    "(buf, pos)\n"
+            get += "    return " + python_identifier(ty) + "(" + \
+                ", ".join(names) + "), pos\n"
+            return put + get
+        element_ty = array_type(ty)
+        if element_ty in ("int", "float"):
+            shape = python_tuple(array_size(ty))
+            put += "    _put_array(msg, v, " + shape + ", \"" + \
+                element_ty + "\")\n"
+            get += "    return _get_array(buf, pos, " + shape + ", \"" + \
+                element_ty + "\")\n"
+            return put + get
+        member_fn = format_array_funname(sig["member_type"])
+        count = str(sig["element_count"])
+        put += "    _check_length(v, " + count + ")\n"
+        put += "    for i, element in enumerate(v):\n"
+        if self.wire == "text":
+            put += "        if i > 0:\n"
+            put += self.separator("            ")
+        put += "        _put_" + member_fn + "(msg, element)\n"
+        get += "    v = []\n"
+        get += "    for _ in range(" + count + "):\n"
+        get += "        element, pos = _get_" + member_fn + "(buf, pos)\n"
+        get += "        v.append(element)\n"
+        get += "    return v, pos\n"
+        return put + get
 
-        return fundecl + "{\n" + body + "}\n"
+    # _args_<fn>, returning the payload of a request to call name
+    def create_arguments_serializer(self, name, sig):
+        params = [python_identifier(a["name"]) for a in sig["arguments"]]
+        body = "\n\ndef _args_" + name + "(" + ", ".join(params) + "):\n"
+        body += "    msg = bytearray()\n"
+        for i, (param, arg) in enumerate(zip(params, sig["arguments"])):
+            if i > 0:
+                body += self.separator("    ")
+            body += "    _put_" + format_array_funname(arg["type"]) + \
+                "(msg, " + param + ")\n"
+        return body + "    return msg\n"
 
-    def create_top_level_function(self, name, sig):
+    # Method of Client, or of AsyncClient if asynchronous, calling name
+    def create_client_method(self, name, sig, asynchronous):
+        params = [python_identifier(a["name"]) for a in sig["arguments"]]
         return_ty = sig["return_type"]
-        fundecl = return_ty + " " + name + "("
+        body = "\n    " + ("async " if asynchronous else "") + "def " + \
+            python_identifier(name) + "(" + ", ".join(["self"] + params) + \
+            "):\n"
+        args = ", ".join(format_array_arg(a["name"], a["type"])
+                         if a["type"][:2] == "__" else
+                         a["type"] + " " + a["name"]
+                         for a in sig["arguments"])
+        body += "        \"\"\"" + return_ty + " " + name + "(" + args + \
+            ")\"\"\"\n"
+        body += "        payload = _args_" + name + "(" + \
+            ", ".join(params) + ")\n"
+        call = "self._call(\"" + name + "\", payload, " + \
+            ("None" if return_ty == "void" else "_get_" + return_ty) + ")"
+        if asynchronous:
+            call = "await " + call
+        if return_ty == "void":
+            return body + "        " + call + "\n"
+        return body + "        return " + call + "\n"
 
-        a = []
-        arg_list = []
-        for arg in sig["arguments"]:
-            arg_ty = arg["type"]
-            arg_name = arg["name"]
-            arg_list.append(arg_name)
-            if arg_ty[:2] == "__":
-                start = arg_ty.find("[")
-                end = len(arg_ty)
-                param = array_type(arg_ty) + " " + \
-                    arg_name + arg_ty[start:end]
-            else:
-                param = arg_ty + " " + arg_name
-            a.append(param)
-        fundecl += ", ".join(a) + ")\n"
-        body = ""
+    def create_clients(self, functions):
+        body = "\n\nclass Client(_Pool):\n"
+        body += "    \"\"\"Client(host, port, pool_size=4, timeout=None)" \
+            "\"\"\"\n"
+        for name, sig in sorted(functions.items()):
+            body += self.create_client_method(name, sig, False)
+        body += "\n\nclass AsyncClient(_AsyncPool):\n"
+        body += "    \"\"\"AsyncClient(host, port, pool_size=4)\"\"\"\n"
+        for name, sig in sorted(functions.items()):
+            body += self.create_client_method(name, sig, True)
+        return body
 
-        if return_ty == "int" or return_ty == "float":
-            body = "\tchar readBuffer[50];\n"
-        elif return_ty != "void":
-            body = "\tchar readBuffer[1000000];\n"
-
-        body += "\tstring funName = \"" + name + "\";\n"
-        body += "\tRPCPROXYSOCKET->write(funName.c_str(), funName.length() + 1);\n"
-        body += "\t*GRADING << \"Client sending function name " + name + "\" << endl;\n"
-        body += "\tstring data = serialize_" + name + \
-            "(" + ", ".join(arg_list) + ");\n"
-        body += "\tRPCPROXYSOCKET->write(data.c_str(), data.length() + 1);\n"
-        body += "\t*GRADING << \"Client sending serialized data for " + \
-            name + "(" + ", ".join(arg_list) + ")\" << endl;\n"
-        if return_ty != "void":
-            body += "\tRPCPROXYSOCKET->read(readBuffer, sizeof(readBuffer));\n"
-            body += "\tstring str(readBuffer);\n"
-            body += "\tstringstream data_strm(str);\n"
-        if return_ty[:2] == "__":
-            return_ty = self.format_array_funname(return_ty)
-        else:
-            return_ty
-        if return_ty != "void":
-            body += "\t*GRADING << \"Client received return value of type {ty} for {n}\" << endl;\n".format(
-                ty=return_ty, n=name)
-            body += "\treturn parse_" + return_ty + "(data_strm);\n"
-        else:
-            body += "\t*GRADING << \"Client received return value of type void for {n}\" << endl;\n".format(
-                n=name)
-            body += "\treturn;\n"
 
-        return fundecl + "{\n" + body + "}\n"
+# What parsers throw on malformed messages, for programs built without
+# the RPC framework that defines it
+standalone_exception = \
+    """
+namespace C150NETWORK
+{
+class C150Exception
+{
+  public:
+    C150Exception(const string &message) : message(message) {}
+    string formattedExplanation() const { return message; }
 
+  private:
+    string message;
+};
+}
+using namespace C150NETWORK;
+"""
 
-class StubGenerator:
-    def __init__(self, idl_filename):
-        self.idl = idl_filename
-        self.h_files = self.get_h_files()
-        self.libraries = self.get_libraries()
-        self.stub = self.stub_name()
-        self.builtin_parsers = [int_parser, float_parser, string_parser]
-        self.builtin_serializers = [int_serializer,
-                                    float_serializer, string_serializer]
-        self.array_dimensions = set()
 
-    def get_h_files(self):
-        headers = ["rpcstubhelper.h", "c150debug.h"]
-        return headers
+# --codec-test writes <idl>.codectest.cpp, a program needing only the
+# standard library that round trips random values of every IDL type
+# through the generated serializers and parsers, and times them.
+# <codectest> [seed [rounds [seconds [values]]]]: fill values messages
+# of each type with fresh random values rounds times, each decoded
+# message having to encode to the same bytes again; then, if seconds is
+# not 0, encode and decode one for at least that long each and print a
+# JSON line per type with its throughput.
+codec_test_runner = \
+    """
+// Random values for fuzzing: ints over their whole range, floats of any
+// bit pattern, infinities and NaNs included, and strings of any bytes
+// but NUL, which null terminated messages cannot carry
+static inline int randomInt(mt19937 &rng)
+{
+    return (int)rng();
+}
 
-    def get_libraries(self):
-        return ["stdio.h", "stdlib.h", "cstdio", "cstring", "string", "sstream", "memory", "iostream"]
+static inline float randomFloat(mt19937 &rng)
+{
+    uint32_t bits = rng();
+    float x;
+    memcpy(&x, &bits, sizeof(x));
+    return x;
+}
 
-    def stub_name(self):
-        idl_file = self.idl[: self.idl.index(".")]
-        return idl_file + ".stub.cpp"
+static inline string randomString(mt19937 &rng)
+{
+    string s(rng() % 4 == 0 ? 0 : rng() % 64, ' ');
+    for (auto &c : s)
+        c = (char)(1 + rng() % 255);
+    return s;
+}
 
-    # Generate boilerplate proelf.array_dimensions = set()xy.cpp file with dependencies,
-    # builtin parsers and serializers
-    def create_template(self, f):
-        h_files = list(
-            map((lambda x: "#include \"" + x + "\"\n"), self.h_files))
-        libraries = list(
-            map((lambda x: "#include <" + x + ">\n"), self.libraries))
-        f.writelines(libraries)
-        f.writelines(h_files)
-        f.write("using namespace std;\n")
-        f.write("using namespace C150NETWORK;\n")
-        f.write("#include \"" + self.idl + "\"\n")
+static double secondsSince(steady_clock::time_point start)
+{
+    return duration<double>(steady_clock::now() - start).count();
+}
 
-    def write_builtin_parsers(self, f):
-        f.writelines(self.builtin_parsers)
+template <typename Value, typename Fill, typename Encode, typename Decode>
+static bool codecTest(const char *type, uint32_t seed, size_t count,
+                      size_t rounds, double seconds, Fill fill,
+                      Encode encode, Decode decode)
+{
+    unique_ptr<Value[]> values(new Value[count]);
+    unique_ptr<Value[]> decoded(new Value[count]);
+    string msg, again;
+    auto encodeAll = [&](const unique_ptr<Value[]> &from, string &out)
+    {
+        out.clear();
+        for (size_t i = 0; i < count; i++)
+        {
+            if (TEXT_WIRE && i > 0)
+                out += ' ';
+            encode(out, from[i]);
+        }
+    };
+    // true if the values took up the whole message
+    auto decodeAll = [&]()
+    {
+        const char *strm = msg.c_str();
+        const char *end = strm + msg.length();
+        for (size_t i = 0; i < count; i++)
+            decode(strm, end, decoded[i]);
+        while (TEXT_WIRE && *strm == ' ')
+            strm++;
+        return strm == msg.c_str() + msg.length();
+    };
 
-    def write_builtin_serializers(self, f):
-        f.writelines(self.builtin_serializers)
+    for (size_t round = 0; round < rounds; round++)
+    {
+        for (size_t i = 0; i < count; i++)
+            fill(values[i]);
+        encodeAll(values, msg);
+        bool whole = decodeAll();
+        encodeAll(decoded, again);
+        if (!whole || again != msg)
+        {
+            fprintf(stderr, "%s: values do not round trip (seed %u, "
+                    "round %zu)\\n", type, (unsigned)seed, round);
+            return false;
+        }
+    }
+    if (seconds <= 0)
+        return true;
 
-    # Generate a generic array parser for nDarray of type ty and dimenson n
-    def create_array_parser(self, ty, sig, dimension, array_ty):
-        fundecl = array_parser_fdecl(ty, sig, dimension, array_ty) + "\n"
-        body = "\tfor (int i = 0; i < " + ARRAY_SIZE_VARS[0] + "; i++)\n"
-        body += "\t{\n"
-        if dimension == 1:
-            body += "\t\tarray[i] = parse_" + array_ty + "(strm);\n"
-        else:
-            body += "\t\tparse_" + array_ty + \
-                str(dimension-1) + "DArray(strm, array[i]);\n"
-        body += "\t}\n"
+    size_t encodes = 0;
+    steady_clock::time_point start = steady_clock::now();
+    do
+    {
+        encodeAll(values, msg);
+        encodes++;
+    } while (secondsSince(start) < seconds);
+    double encodeMBs = msg.length() * encodes / secondsSince(start) / 1e6;
 
-        self.array_dimensions.add((dimension, array_ty))
-        return fundecl + "{\n" + body + "}\n\n"
+    size_t decodes = 0;
+    start = steady_clock::now();
+    do
+    {
+        decodeAll();
+        decodes++;
+    } while (secondsSince(start) < seconds);
+    double decodeMBs = msg.length() * decodes / secondsSince(start) / 1e6;
 
-    def create_function_parser(self, name, sig):
-        fundecl = "void parse_" + name + "(stringstream &strm)\n"
-        body = ""
-        arg_list = []
-        for arg in sig["arguments"]:
-            arg_name = arg["name"]
-            arg_ty = arg["type"]
-            arg_list.append(arg_name)
-            if arg_ty[:2] == "__":
-                array_ty = array_type(arg_ty)
-                array_dim = len(arg_ty.split("[")) - 1
-                body += "\t" + format_array_arg(arg_name, arg_ty) + ";\n"
-                body += "\tparse_{t}{d}DArray(strm, {n});\n".format(
-                    t=array_ty, d=array_dim, n=arg_name)
-            else:
-                # handle other case
-                body += "\t{t} {n};\n".format(t=arg_ty, n=arg_name)
-                body += "\t{n} = parse_{t}(strm);\n".format(t=arg_ty,
-                                                            n=arg_name)
+    printf("{\\"type\\": \\"%s\\", \\"bytes_per_value\\": %zu, "
+           "\\"encode_mb_s\\": %.1f, \\"decode_mb_s\\": %.1f}\\n",
+           type, msg.length() / count, encodeMBs, decodeMBs);
+    return true;
+}
+"""
 
-        body += "\t__{fun}(".format(fun=name) + ", ".join(arg_list) + ");\n"
-        return fundecl + "{\n" + body + "}\n\n"
 
-    def create_top_level_function(self, name, sig):
-        return_ty = sig["return_type"]
-        funname = "__" + name
-        p = []
-        a = []
-        for arg in sig["arguments"]:
-            arg_name = arg["name"]
-            arg_ty = arg["type"]
-            a.append(arg_name)
-            if arg_ty[:2] == "__":
-                p.append(format_array_arg(arg_name, arg_ty))
-            else:
-                p.append(arg_ty + " " + arg_name)
-        params = ", ".join(p)
-        fundecl = return_ty + " " + funname + "(" + params + ")\n"
-        body = ""
-        if return_ty == "void":
-            body = "\t" + name + "(" + ", ".join(a) + ");\n"
-            body += "\treturn;\n"
-        else:
-            body = "\t" + return_ty + " res = " + \
-                name + "(" + ", ".join(a) + ");\n"
-            body += "\t*GRADING << \"Server received request to invoke " + \
-                name + "(" + ", ".join(a) + ")\" << endl;\n"
-            body += "\tstring str_res = serialize_" + return_ty + "(res);\n"
-            body += "\tRPCSTUBSOCKET->write(str_res.c_str(), str_res.length() + 1);\n"
-            body += "\t*GRADING << \"Server sent return value of type " + return_ty + " for " + \
-                funname[2:] + "(" + params + ")\" << endl;\n"
-            body += "\treturn res;\n"
+# Statements giving dest a random value of ty, its builtins drawn from
+# rng by the randomInt, randomFloat and randomString of the program
+def fill_value(ty, decls, dest, indent, depth=0):
+    if ty in BUILTIN_TYPES:
+        return indent + dest + " = random" + ty.capitalize() + "(rng);\n"
+    sig = decls["types"][ty]
+    if sig["type_of_type"] == "struct":
+        return "".join(fill_value(m["type"], decls, dest + "." + m["name"],
+                                  indent, depth)
+                       for m in sig["members"])
+    k = "k" + str(depth)
+    body = indent + "for (size_t " + k + " = 0; " + k + " < " + \
+        str(sig["element_count"]) + "; " + k + "++)\n"
+    body += indent + "{\n"
+    body += fill_value(sig["member_type"], decls, dest + "[" + k + "]",
+                       indent + "    ", depth + 1)
+    return body + indent + "}\n"
 
-        return fundecl + "{\n" + body + "}\n\n"
 
-    def dispatch_function(self, funnames):
-        fundecl = "void dispatchFunction()\n"
-        body = \
-            """
-    char functionNameBuffer[50];
-    char dataBuffer[1000000];
-    getDataFromStream(functionNameBuffer, sizeof(functionNameBuffer));
-    getDataFromStream(dataBuffer, sizeof(dataBuffer));
-    string str(dataBuffer);
-    stringstream data_strm(str);
-    if (!RPCSTUBSOCKET->eof())
-    {
-        """
-        body += "if (strcmp(functionNameBuffer, \"" + \
-            funnames[0] + "\") == 0)\n"
-        body += "\t\t\tparse_" + funnames[0] + "(data_strm);\n"
+def codec_test_name(idl):
+    return os.path.splitext(idl)[0] + ".codectest.cpp"
 
-        for n in funnames[1:]:
-            body += "\t\telse if (strcmp(functionNameBuffer, \"" + \
-                n + "\") == 0)\n"
-            body += "\t\t\tparse_" + n + "(data_strm);\n"
 
-        body += "\t\telse\n\t\t\t__badFunction(functionNameBuffer);\n"
-        body += "\t}\n"
-        return fundecl + "{\n" + body + "}\n"
+def codec_test_main(idl, options, decls):
+    # Null terminated text streams long strings ahead through a socket;
+    # the codecs of length framing encode the same bytes into msg alone
+    options = argparse.Namespace(**vars(options))
+    options.framing = "length"
+    x = ProxyGenerator(idl, options)
+    x.decls = decls
+    f = io.StringIO()
+    libraries = ["stdio.h", "stdlib.h", "cstdio", "cstring", "string",
+                 "cstdint", "memory", "random", "chrono"]
+    f.writelines("#include <" + lib + ">\n" for lib in libraries)
+    f.write("using namespace std;\n")
+    f.write("using namespace std::chrono;\n")
+    f.write(standalone_exception)
+    f.write("#include \"" + os.path.basename(idl) + "\"\n")
+    forward_declarations(x, f, decls)
+    if x.wire == "binary":
+        f.write(uint32_helpers)
+    x.write_builtin_parsers(f)
+    x.write_builtin_serializers(f)
+    x.write_type_codecs(f)
+    f.write("\nconst bool TEXT_WIRE = " +
+            ("true" if x.wire == "text" else "false") + ";\n")
+    f.write(codec_test_runner)
+
+    f.write("\nint main(int argc, char *argv[])\n{\n")
+    f.write("    uint32_t seed = argc > 1 ? strtoul(argv[1], NULL, 10) : 1;\n")
+    f.write("    size_t rounds = argc > 2 ? strtoul(argv[2], NULL, 10) : 100;\n")
+    f.write("    double seconds = argc > 3 ? strtod(argv[3], NULL) : 0;\n")
+    f.write("    size_t count = argc > 4 ? strtoul(argv[4], NULL, 10) : 16;\n")
+    f.write("    mt19937 rng(seed);\n")
+    f.write("    bool ok = true;\n")
+    for ty in sorted(decls["types"]):
+        if ty == "void":
+            continue
+        if ty[:2] == "__":
+            value_ty = format_array_arg("Value", ty)
+        else:
+            value_ty = ty + " Value"
+        funname = format_array_funname(ty)
+        f.write("    {\n")
+        f.write("        typedef " + value_ty + ";\n")
+        f.write("        ok = codecTest<Value>(\n")
+        f.write("            \"" + ty + "\", seed, count, rounds, seconds,\n")
+        f.write("            [&rng](Value &v)\n")
+        f.write("            {\n")
+        f.write(fill_value(ty, decls, "v", "                "))
+        f.write("            },\n")
+        f.write("            [](string &msg, Value &v) { serialize_" +
+                funname + "(msg, v); },\n")
+        f.write("            [](const char *&strm, const char *end, "
+                "Value &v) { " +
+                parse_into(ty, "v") + " }) && ok;\n")
+        f.write("    }\n")
+    f.write("    return ok ? 0 : 1;\n}\n")
+    write_if_changed(codec_test_name(idl), f.getvalue())
 
 
-def stub_main(idl):
-    x = StubGenerator(idl)
-    f = open(x.stub, 'w')
+def stub_main(idl, options, decls):
+    x = StubGenerator(idl, options)
+    f = io.StringIO()
     x.create_template(f)
 
     # traverse through JSON
-    if len(sys.argv) != 2:
-        raise Exception("Wrong number of arguments")
-
-    filename = sys.argv[1]
-    is_file_valid(filename)
-
-    decls = json.loads((subprocess.check_output(
-        [IDL_TO_JSON_EXECUTABLE, filename]).decode('utf-8')))
+    x.decls = decls
 
     forward_declarations(x, f, decls)
+    if x.function_ids:
+        f.write(create_function_id_enum(decls) + "\n")
+    if x.batch:
+        f.write(batch_flag)
     f.write(bad_function + "\n")
+    f.write(message_limits(x.max_message_size))
+    x.write_metrics(f, decls)
+    f.write(stub_read_declaration if x.transport == "shm" else
+            socket_stub_read)
     f.write(get_data_from_stream + "\n")
+    x.write_wire_helpers(f)
     x.write_builtin_parsers(f)
     x.write_builtin_serializers(f)
-    x.array_dimensions.clear()
-
-    for ty, sig in decls["types"].items():
-        # Create serializer and parser for each type in proxy.cpp
-        if sig["type_of_type"] == "struct":
-            f.write(create_struct_serializer(ty, sig) + "\n")
-            f.write(create_struct_parser(ty, sig) + "\n")
-        elif sig["type_of_type"] == "array":
-            f.write(create_array_serializer(ty, sig) + "\n")
-
-            dimension = len(ty.split("[")) - 1
-            array_ty = array_type(ty)
-            if (dimension, array_ty) not in x.array_dimensions:
-                f.write(x.create_array_parser(
-                    ty, sig, dimension, array_ty) + "\n")
-        elif sig["type_of_type"] == "builtin":
-            continue
+    x.write_type_codecs(f)
+    f.write(x.create_result_caches(decls))
 
     for name, sig in decls["functions"].items():
         f.write(x.create_top_level_function(name, sig))
         f.write(x.create_function_parser(name, sig))
+        if x.batch:
+            f.write(x.create_batch_parser(name, sig))
 
-    # TODO: dispatch function
+    f.write(x.create_dispatch_table(list(decls["functions"].keys())))
     f.write(x.dispatch_function(list(decls["functions"].keys())))
+    if x.server_runtime:
+        x.write_server_runtime(f)
+    write_if_changed(x.stub, f.getvalue())
 
 
-def proxy_main(idl):
-    x = ProxyGenerator(idl)
-    f = open(x.proxy, 'w')
+def proxy_main(idl, options, decls):
+    x = ProxyGenerator(idl, options)
+    f = io.StringIO()
     x.create_template(f)
 
     # traverse through JSON
-    if len(sys.argv) != 2:
-        raise "Wrong number of arguments"
-
-    filename = sys.argv[1]
-    is_file_valid(filename)
-
-    decls = json.loads((subprocess.check_output(
-        [IDL_TO_JSON_EXECUTABLE, filename]).decode('utf-8')))
+    x.decls = decls
+    x.ids = function_ids(decls)
 
     forward_declarations(x, f, decls)
+    if x.function_ids:
+        f.write(create_function_id_enum(decls) + "\n")
+    if x.batch:
+        f.write(batch_flag)
+    x.write_metrics(f, decls)
+    x.write_wire_helpers(f)
     x.write_builtin_parsers(f)
     x.write_builtin_serializers(f)
-    x.array_dimensions.clear()
     # TODO: empty parsers for empty structs?
-    for ty, sig in decls["types"].items():
-        # Create serializer and parser for each type in proxy.cpp
-        if sig["type_of_type"] == "struct":
-            f.write(create_struct_serializer(ty, sig) + "\n")
-            f.write(create_struct_parser(ty, sig) + "\n")
-        elif sig["type_of_type"] == "array":
-            f.write(create_array_serializer(ty, sig) + "\n")
-
-            dimension = len(ty.split("[")) - 1
-            array_ty = array_type(ty)
-            if (dimension, array_ty) not in x.array_dimensions:
-                f.write(x.create_array_parser(
-                    ty, sig, dimension, array_ty) + "\n")
-        elif sig["type_of_type"] == "builtin":
-            continue
+    x.write_type_codecs(f)
 
     for name, sig in decls["functions"].items():
         f.write(x.create_function_serializer(name, sig))
         f.write(x.create_top_level_function(name, sig))
+        if x.async_calls:
+            f.write(x.create_async_function(name, sig))
+        if x.batch:
+            f.write(x.create_batch_function(name, sig))
 
-    f.close()
+    write_if_changed(x.proxy, f.getvalue())
+
+
+def python_proxy_main(idl, options, decls):
+    x = PythonProxyGenerator(idl, options)
+    x.decls = decls
+    x.ids = function_ids(decls)
+    f = io.StringIO()
+    x.create_header(f)
+    x.write_runtime(f)
+    for ty, sig in sorted(decls["types"].items()):
+        if sig["type_of_type"] == "struct":
+            f.write(x.create_struct_class(ty, sig))
+    for ty, sig in sorted(decls["types"].items()):
+        if sig["type_of_type"] != "builtin":
+            f.write(x.create_type_codec(ty, sig))
+    for name, sig in sorted(decls["functions"].items()):
+        f.write(x.create_arguments_serializer(name, sig))
+    f.write(x.create_clients(decls["functions"]))
+    write_if_changed(x.proxy, f.getvalue())
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Generate RPC proxy and stub C++ files from IDL files")
+    parser.add_argument("idl", nargs="+",
+                        help="IDL files to generate code for, or directories "
+                        "whose .idl files are all generated")
+    parser.add_argument("--parser", choices=IDL_PARSERS, default="python",
+                        help="parse IDL files in process, or with the "
+                        "idl_to_json program (default: python)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of IDL files generated in parallel "
+                        "(default: one per CPU)")
+    parser.add_argument("--wire", choices=WIRE_FORMATS, default="text",
+                        help="encoding used for values on the wire "
+                        "(default: text)")
+    parser.add_argument("--hex-floats", action="store_true",
+                        help="send text floats in exact hexadecimal "
+                        "notation (requires --wire=text)")
+    parser.add_argument("--framing", choices=FRAMINGS, default="null",
+                        help="null terminated messages, or messages with a "
+                        "length and function id header (default: null)")
+    parser.add_argument("--function-ids", action="store_true",
+                        help="send a numeric function id instead of the "
+                        "function name (implied by --framing=length)")
+    parser.add_argument("--pool", action="store_true",
+                        help="generate a client runtime with a pool of "
+                        "pipelined connections (requires --framing=length)")
+    parser.add_argument("--server-runtime", action="store_true",
+                        help="add rpcServe(), an epoll server with a worker "
+                        "thread pool, to the stub (requires --framing=length)")
+    parser.add_argument("--batch", action="store_true",
+                        help="also generate <function>_batch proxies making "
+                        "many calls in one round trip (requires "
+                        "--framing=length)")
+    parser.add_argument("--compress", action="store_true",
+                        help="deflate large payloads with zlib once both "
+                        "sides have shown they can inflate them (requires "
+                        "--framing=length, link with -lz)")
+    parser.add_argument("--compress-threshold", type=int, default=1024,
+                        metavar="BYTES",
+                        help="smallest payload --compress deflates, also "
+                        "settable at run time through "
+                        "rpcCompressionThreshold (default: 1024)")
+    parser.add_argument("--async", action="store_true", dest="async_calls",
+                        help="also generate <function>_async proxies "
+                        "returning a std::future (requires --pool)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record per-function call, error and byte "
+                        "counts and phase time histograms, dumped with "
+                        "rpcMetricsText() or rpcMetricsJson()")
+    parser.add_argument("--grading-log", action="store_true",
+                        help="log every call to GRADING, as the course "
+                        "framework expects")
+    parser.add_argument("--python", action="store_true",
+                        help="also write <idl>_proxy.py, a Python client "
+                        "with a connection pool and an asyncio variant")
+    parser.add_argument("--codec-test", action="store_true",
+                        help="also write <idl>.codectest.cpp, round "
+                        "tripping random values of every IDL type through "
+                        "the codecs and timing them")
+    parser.add_argument("--pure", action="append", default=[],
+                        metavar="FUNCTIONS",
+                        help="comma separated functions whose results the "
+                        "stub caches by argument, calling each at most "
+                        "once per distinct arguments while cached "
+                        "(repeatable)")
+    parser.add_argument("--pure-cache-size", type=int, default=1024,
+                        metavar="ENTRIES",
+                        help="results each --pure function's cache holds "
+                        "before evicting the least recently used "
+                        "(default: 1024)")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="socket",
+                        help="how proxies and stubs exchange messages: over "
+                        "the socket, or with shm through shared memory rings "
+                        "set up over it, for clients on the server's host "
+                        "(default: socket)")
+    parser.add_argument("--shm-ring-size", type=int, default=1 << 20,
+                        metavar="BYTES",
+                        help="bytes of each of the two --transport=shm "
+                        "rings, a power of two (default: 1048576)")
+    parser.add_argument("--max-message-size", type=int, default=1 << 26,
+                        metavar="BYTES",
+                        help="longest message either side accepts from the "
+                        "other before dropping the connection (default: "
+                        "67108864)")
+    args = parser.parse_args(argv)
+    if args.hex_floats and args.wire != "text":
+        parser.error("--hex-floats requires --wire=text")
+    if args.pool and args.framing != "length":
+        parser.error("--pool requires --framing=length")
+    if args.server_runtime and args.framing != "length":
+        parser.error("--server-runtime requires --framing=length")
+    if args.batch and args.framing != "length":
+        parser.error("--batch requires --framing=length")
+    if args.async_calls and not args.pool:
+        parser.error("--async requires --pool")
+    if args.compress and args.framing != "length":
+        parser.error("--compress requires --framing=length")
+    if args.transport == "shm" and args.framing != "length":
+        parser.error("--transport=shm requires --framing=length")
+    if args.transport == "shm" and (args.pool or args.server_runtime):
+        parser.error("--transport=shm cannot be used with --pool or "
+                     "--server-runtime")
+    ring = args.shm_ring_size
+    if not 4096 <= ring <= 1 << 30 or ring & (ring - 1):
+        parser.error("--shm-ring-size must be a power of two between 4096 "
+                     "and 1073741824")
+    if args.compress_threshold < 0:
+        parser.error("--compress-threshold must not be negative")
+    args.pure = [name for names in args.pure for name in names.split(",")
+                 if name]
+    if args.pure_cache_size < 1:
+        parser.error("--pure-cache-size must be at least 1")
+    if not 1 <= args.max_message_size <= 0xffffffff:
+        parser.error("--max-message-size must be between 1 and 4294967295")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs must be at least 1")
+    return args
+
+
+# The IDL files named by paths, expanding directories to the .idl files
+# directly inside them
+def idl_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name)
+                            for name in os.listdir(path)
+                            if name.endswith(".idl"))
+        else:
+            files.append(path)
+    return files
+
+
+# Check that every function --pure names is declared, with a result to
+# cache, by at least one of the IDLs whose decls are given. Each stub
+# caches only the functions its own IDL declares.
+def check_pure(options, decls_list):
+    for name in options.pure:
+        sigs = [decls["functions"][name] for decls in decls_list
+                if name in decls["functions"]]
+        if not sigs:
+            raise Exception("--pure names " + name +
+                            ", which is not a function of any IDL")
+        if all(sig["return_type"] == "void" for sig in sigs):
+            raise Exception("--pure names " + name + ", which returns void")
+
+
+# The decls of idl, read with the parser options names
+def read_decls(idl, options):
+    if options.parser == "python":
+        return parse_idl(idl)
+    return load_decls(idl)
+
+
+# Generate the proxy and stub for one IDL, returning why it failed or
+# None on success
+def generate(idl, options):
+    try:
+        decls = read_decls(idl, options)
+        proxy_main(idl, options, decls)
+        stub_main(idl, options, decls)
+        if options.python:
+            python_proxy_main(idl, options, decls)
+        if options.codec_test:
+            codec_test_main(idl, options, decls)
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
 
 
 def main():
-    idl = sys.argv[1]
-    proxy_main(idl)
-    stub_main(idl)
+    args = parse_args(sys.argv[1:])
+    idls = idl_files(args.idl)
+    if not idls:
+        print("No IDL files to generate", file=sys.stderr)
+        sys.exit(1)
+    if args.pure:
+        # IDLs that do not parse are left for generate to report
+        decls_list = []
+        for idl in idls:
+            try:
+                decls_list.append(read_decls(idl, args))
+            except Exception:
+                pass
+        try:
+            check_pure(args, decls_list)
+        except Exception as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+    if len(idls) == 1 or args.jobs == 1:
+        errors = [generate(idl, args) for idl in idls]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            errors = list(pool.map(generate, idls, [args] * len(idls)))
+
+    failed = [(idl, error) for idl, error in zip(idls, errors)
+              if error is not None]
+    for idl, error in failed:
+        print("%s: %s" % (idl, error), file=sys.stderr)
+    if failed:
+        print("%d of %d IDL files failed" % (len(failed), len(idls)),
+              file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
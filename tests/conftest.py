@@ -0,0 +1,140 @@
+#
+#          Fixtures shared by the tests of rpcgenerate
+#
+#     Tests generate code for the IDL files under idl/ into a temporary
+#     directory. Those running generated C++ need g++, and those linking
+#     proxies and stubs also need the archives of the COMP 150 RPC
+#     framework under $COMP117, as for the Makefile. They are skipped
+#     where these are missing. tests/framework holds stand-ins for the
+#     framework's rpcproxyhelper.cpp, rpcstubhelper.cpp and rpcserver.cpp,
+#     which serve one client at a time on localhost:15117.
+#
+import importlib.util
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COMP117 = os.environ.get("COMP117", "")
+C150LIB = os.path.join(COMP117, "files", "c150Utils")
+C150IDSRPC = os.path.join(COMP117, "files", "RPC.framework")
+IDL_DIR = os.path.join(ROOT, "idl")
+CXXFLAGS = ["-O1", "-Wall", "-Werror", "-std=c++11"]
+FRAMEWORK_ARCHIVES = [os.path.join(C150LIB, "c150ids.a"),
+                      os.path.join(C150IDSRPC, "c150idsrpc.a")]
+FRAMEWORK_DIR = os.path.join(ROOT, "tests", "framework")
+
+
+def root_file(name):
+    return os.path.join(ROOT, name)
+
+
+def framework_file(name):
+    return os.path.join(FRAMEWORK_DIR, name)
+
+
+# Generate the code for idl/<name> with the given rpcgenerate options into
+# directory, returning the path of the copied IDL without its extension.
+# rpcgenerate looks for idl_to_json in the current directory, so it runs
+# in directory next to a copy
+def generate_idl(directory, name, *flags):
+    directory = str(directory)
+    idl = os.path.join(directory, name)
+    shutil.copyfile(os.path.join(IDL_DIR, name), idl)
+    idl_to_json = os.path.join(directory, "idl_to_json")
+    shutil.copyfile(root_file("idl_to_json"), idl_to_json)
+    os.chmod(idl_to_json, 0o755)
+    result = subprocess.run(
+        [sys.executable, root_file("rpcgenerate.py")] + list(flags) + [name],
+        cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+    return os.path.splitext(idl)[0]
+
+
+def compile_cpp(output, sources, flags=(), libs=()):
+    command = ["g++"] + CXXFLAGS + list(flags) + ["-o", str(output)] + \
+        [str(s) for s in sources] + list(libs)
+    result = subprocess.run(command, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+    return str(output)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert process.poll() is None, "server exited at startup"
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.02)
+    raise AssertionError("server never listened on port %d" % port)
+
+
+def load_module(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def generate(tmp_path):
+    return lambda name, *flags: generate_idl(tmp_path, name, *flags)
+
+
+# Compiles C++ that needs nothing beyond the standard library
+@pytest.fixture
+def cxx():
+    if shutil.which("g++") is None:
+        pytest.skip("needs g++")
+    return compile_cpp
+
+
+# Compiles and links C++ against the RPC framework, with tests/framework on
+# the include path for the helper headers
+@pytest.fixture
+def framework(cxx):
+    missing = [a for a in FRAMEWORK_ARCHIVES if not os.path.exists(a)]
+    if missing:
+        pytest.skip("needs the RPC framework: " + ", ".join(missing))
+
+    def build(output, sources, libs=()):
+        return cxx(output, sources,
+                   ["-I" + FRAMEWORK_DIR, "-I" + C150IDSRPC, "-I" + C150LIB],
+                   FRAMEWORK_ARCHIVES + ["-pthread"] + list(libs))
+    return build
+
+
+# Starts servers, each given as a command run until the test ends
+@pytest.fixture
+def servers():
+    processes = []
+
+    def start(command, port=None):
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        processes.append(process)
+        if port is not None:
+            wait_for_port(port, process)
+        return process
+    yield start
+    for process in processes:
+        process.kill()
+        process.wait()
@@ -0,0 +1,13 @@
+// Test stand-in for the framework's rpcproxyhelper.cpp: connects to
+// localhost:15117 whatever the server name
+#include "rpcproxyhelper.h"
+#include <unistd.h>
+C150NETWORK::C150StreamSocket *RPCPROXYSOCKET;
+void rpcproxyinitialize(std::string) {
+  for (int i = 0; i < 200; i++) {
+    C150NETWORK::C150StreamSocket *s = new C150NETWORK::C150StreamSocket();
+    try { s->connect("127.0.0.1", 15117); RPCPROXYSOCKET = s; return; }
+    catch (C150NETWORK::C150Exception &) { s->close(); delete s; usleep(20000); }
+  }
+  throw C150NETWORK::C150Exception("cannot connect");
+}
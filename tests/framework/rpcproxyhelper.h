@@ -0,0 +1,6 @@
+// Test stand-in for the framework's rpcproxyhelper.h
+#pragma once
+#include <string>
+#include "c150streamsocket.h"
+extern C150NETWORK::C150StreamSocket *RPCPROXYSOCKET;
+void rpcproxyinitialize(std::string servername);
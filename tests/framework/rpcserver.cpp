@@ -0,0 +1,11 @@
+// Test stand-in for the framework's rpcserver.cpp: serves clients one
+// after the other on port 15117
+#include "rpcstubhelper.h"
+#include <unistd.h>
+void dispatchFunction();
+int main() {
+  C150NETWORK::C150StreamSocket listener; listener.listen(15117);
+  while (true) { listener.accept(); RPCSTUBSOCKET = &listener;
+    try { while (!RPCSTUBSOCKET->eof()) dispatchFunction(); } catch (C150NETWORK::C150Exception &) {}
+    listener.close(); }
+}
@@ -0,0 +1,3 @@
+// Test stand-in for the framework's rpcstubhelper.cpp
+#include "rpcstubhelper.h"
+C150NETWORK::C150StreamSocket *RPCSTUBSOCKET;
@@ -0,0 +1,4 @@
+// Test stand-in for the framework's rpcstubhelper.h
+#pragma once
+#include "c150streamsocket.h"
+extern C150NETWORK::C150StreamSocket *RPCSTUBSOCKET;
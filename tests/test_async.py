@@ -0,0 +1,96 @@
+#
+#          --async proxies against the lotsofstuff server
+#
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from conftest import framework_file, root_file
+
+# Fans out calls without collecting them, so every future must become
+# ready by itself: <client> <server>
+async_client = \
+    """
+#include <chrono>
+#include <cstdio>
+#include <future>
+#include <string>
+#include <vector>
+#include "rpcproxyhelper.h"
+using namespace std;
+using namespace C150NETWORK;
+#include "lotsofstuff.idl"
+
+future<int> area_async(rectangle r);
+future<Person> findPerson_async(ThreePeople tp);
+future<string> upcase_async(string s);
+future<void> func1_async();
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    vector<future<int> > areas;
+    for (int i = 0; i < 200; i++)
+    {
+        rectangle r;
+        r.x = i;
+        r.y = 2;
+        areas.push_back(area_async(r));
+    }
+    for (size_t i = 0; i < areas.size(); i++)
+        if (areas[i].wait_for(chrono::seconds(10)) != future_status::ready)
+        {
+            printf("area %zu never became ready\\n", i);
+            return 1;
+        }
+    for (int i = 0; i < 200; i++)
+        if (areas[i].get() != 2 * i)
+        {
+            printf("area %d is wrong\\n", i);
+            return 1;
+        }
+
+    // futures dropped uncollected hold nothing up
+    for (int i = 0; i < 100; i++)
+        upcase_async("dropped");
+    ThreePeople tp = ThreePeople();
+    tp.p2.firstname = "John";
+    tp.p2.lastname = "Doe";
+    tp.p2.age = 7;
+    future<Person> person = findPerson_async(tp);
+    future<string> up = upcase_async("kept");
+    func1_async().get();
+    if (up.get() != "KEPT" || person.get().age != 7)
+    {
+        printf("wrong replies\\n");
+        return 1;
+    }
+    printf("ok\\n");
+    return 0;
+}
+"""
+
+
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_async_futures_become_ready(tmp_path, generate, framework, servers,
+                                    wire):
+    stem = generate("lotsofstuff.idl", "--framing=length", "--pool",
+                    "--async", "--wire=" + wire)
+    shutil.copyfile(root_file("lotsofstuff.cpp"),
+                    str(tmp_path / "lotsofstuff.cpp"))
+    (tmp_path / "client.cpp").write_text(async_client)
+    server = framework(tmp_path / "server", [
+        stem + ".stub.cpp", tmp_path / "lotsofstuff.cpp",
+        framework_file("rpcserver.cpp"), framework_file("rpcstubhelper.cpp")])
+    client = framework(tmp_path / "client", [
+        tmp_path / "client.cpp", stem + ".proxy.cpp",
+        framework_file("rpcproxyhelper.cpp")])
+
+    servers([server])
+    time.sleep(0.5)
+    result = subprocess.run([client, "localhost"], stdout=subprocess.PIPE,
+                            universal_newlines=True, timeout=60)
+    assert result.returncode == 0, result.stdout
+    assert result.stdout == "ok\n"
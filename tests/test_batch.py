@@ -0,0 +1,58 @@
+#
+#          Batched calls sent to a --batch --server-runtime server
+#
+import socket
+
+import pytest
+
+from test_server_runtime import (FUNCTION_IDS, HEADER, RawClient, encode,
+                                 start_lotsofstuff)
+
+RPC_BATCH = 0x80000000
+
+
+# Send area over a batch of n calls, one per rectangle, returning the
+# reply payload, or b"" if the server closes the connection instead
+def send_batch(port, n, rects, wire="text"):
+    payload = encode(wire, [n] + [v for r in rects for v in r])
+    with socket.create_connection(("127.0.0.1", port), 10) as sock:
+        sock.sendall(HEADER.pack(len(payload),
+                                 FUNCTION_IDS["area"] | RPC_BATCH, 1) +
+                     payload)
+        received = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return received
+            received += chunk
+            if len(received) >= HEADER.size and \
+                    len(received) >= HEADER.size + \
+                    HEADER.unpack(received[:HEADER.size])[0]:
+                return received[HEADER.size:]
+
+
+def test_batch_sizes(tmp_path, generate, framework, servers):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--batch")
+    rects = [(i, 3) for i in range(5)]
+    assert send_batch(port, 5, rects) == b"0 3 6 9 12"
+    # negative and oversized counts drop the connection without a reply,
+    # and without the server trying to reserve or parse that many calls
+    assert send_batch(port, -1, rects) == b""
+    assert send_batch(port, 0x7fffffff, rects) == b""
+    assert send_batch(port, 1 << 25, []) == b""
+    with RawClient(port) as client:
+        assert client.call(int, "area", 4, 5) == 20
+
+
+# A count within RPC_MAX_BATCH but of more calls than the payload holds is
+# refused before any call is parsed
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_batch_longer_than_payload(tmp_path, generate, framework, servers,
+                                   wire):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--batch", "--wire=" + wire)
+    assert send_batch(port, 1 << 24, [], wire) == b""
+    assert send_batch(port, 6, [(i, 3) for i in range(5)], wire) == b""
+    with RawClient(port, wire) as client:
+        assert client.call(int, "area", 4, 5) == 20
@@ -0,0 +1,39 @@
+#
+#          --codec-test programs fuzzing and timing the codecs
+#
+import json
+import os
+import subprocess
+
+import pytest
+
+import rpcgenerate
+
+
+@pytest.mark.parametrize("flags", [
+    (), ("--hex-floats",), ("--wire=binary",),
+    ("--wire=binary", "--framing=length")])
+def test_codec_test_round_trips_every_type(generate, cxx, flags):
+    stem = generate("lotsofstuff.idl", "--codec-test", *flags)
+    program = cxx(stem + ".codectest", [stem + ".codectest.cpp"])
+    for seed in ["1", "2", "117"]:
+        subprocess.run([program, seed, "200"], check=True)
+
+
+def test_codec_test_times_every_type(generate, cxx):
+    stem = generate("structs.idl", "--codec-test")
+    program = cxx(stem + ".codectest", [stem + ".codectest.cpp"])
+    output = subprocess.check_output([program, "1", "10", "0.01", "4"],
+                                     universal_newlines=True)
+    results = [json.loads(line) for line in output.splitlines()]
+    decls = rpcgenerate.parse_idl(stem + ".idl")
+    assert [r["type"] for r in results] == \
+        sorted(ty for ty in decls["types"] if ty != "void")
+    for result in results:
+        assert result["encode_mb_s"] > 0
+        assert result["decode_mb_s"] > 0
+
+
+def test_codec_test_only_when_asked(generate):
+    stem = generate("structs.idl")
+    assert not os.path.exists(stem + ".codectest.cpp")
@@ -0,0 +1,37 @@
+#
+#          codecbench.py on struct s of lotsofstuff.idl
+#
+import json
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, root_file
+
+
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_codecbench_compares_encodings(cxx, wire):
+    output = subprocess.check_output(
+        [sys.executable, root_file("codecbench.py"), "--values", "3",
+         "--seconds", "0.01", "--rpcgen-flags=--wire=" + wire,
+         "--baseline-generator", root_file("rpcgenerate.py")],
+        cwd=ROOT, universal_newlines=True)
+    result = json.loads(output)
+    assert result["type"] == "s"
+    assert result["same_encoding"]
+    assert result["bytes_per_value"] >= 4044 * (4 if wire == "binary" else 2)
+
+
+def test_codecbench_compress(cxx):
+    output = subprocess.check_output(
+        [sys.executable, root_file("codecbench.py"), "--values", "3",
+         "--seconds", "0.01", "--compress"],
+        cwd=ROOT, universal_newlines=True)
+    result = json.loads(output)
+    # the text of three structs s of random values deflates to at most
+    # two thirds of its bytes
+    assert 0 < result["compressed_bytes_per_value"] < \
+        result["bytes_per_value"] * 2 / 3
+    assert result["compress_us"] > 0 and result["decompress_us"] > 0
+    assert result["break_even_mbps"] > 0
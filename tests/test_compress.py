@@ -0,0 +1,255 @@
+#
+#          Payloads through --compress, compressed and not
+#
+import shutil
+import socket
+import struct
+import subprocess
+import threading
+import time
+import zlib
+
+import pytest
+
+from conftest import generate_idl, framework_file, root_file
+from test_malformed_payloads import RPCSERVER_PORT
+from test_message_limits import upcase_client
+from test_server_runtime import (FUNCTION_IDS, HEADER, RawClient, encode,
+                                 start_lotsofstuff)
+
+RPC_COMPRESSED = 0x40000000
+RPC_ACCEPTS_COMPRESSED = 0x20000000
+
+# Calls lotsofstuff functions with payloads zlib shrinks, the void
+# searchRectangles first as a client calling nothing else would:
+# <client> <server>
+compress_client = \
+    """
+#include <cstdio>
+#include <string>
+using namespace std;
+#include "rpcproxyhelper.h"
+using namespace C150NETWORK;
+#include "lotsofstuff.idl"
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    int failed = 0;
+    rectangle rects[200];
+    for (int i = 0; i < 200; i++)
+    {
+        rects[i].x = i % 4;
+        rects[i].y = 1;
+    }
+    searchRectangles(rects);
+
+    static s big;
+    for (int round = 0; round < 3; round++)
+    {
+        for (int i = 0; i < 4; i++)
+            for (int j = 0; j < 10; j++)
+                for (int k = 0; k < 100; k++)
+                    big.m3[i][j][k] = (k + round) % 10;
+        if (sum(big) != 4 * 10 * 450)
+            failed++;
+
+        string text;
+        for (int i = 0; i < 5000; i++)
+            text += "abcdefgh"[(i + round) % 8];
+        string upper = upcase(text);
+        for (int i = 0; i < 5000; i++)
+            if (upper[i] != "ABCDEFGH"[(i + round) % 8])
+            {
+                failed++;
+                break;
+            }
+        if (upcase("short") != "SHORT")
+            failed++;
+    }
+    printf("%d failed\\n", failed);
+    return failed;
+}
+"""
+
+
+# Build the lotsofstuff server and compress_client with the given
+# options and run them, checking every call came back right
+def run_compress_client(directory, framework, servers, *flags):
+    directory.mkdir()
+    stem = generate_idl(directory, "lotsofstuff.idl", "--framing=length",
+                        *flags)
+    shutil.copyfile(root_file("lotsofstuff.cpp"),
+                    str(directory / "lotsofstuff.cpp"))
+    (directory / "client.cpp").write_text(compress_client)
+    server = framework(directory / "server", [
+        stem + ".stub.cpp", directory / "lotsofstuff.cpp",
+        framework_file("rpcserver.cpp"), framework_file("rpcstubhelper.cpp")],
+        ["-lz"])
+    client = framework(directory / "client", [
+        directory / "client.cpp", stem + ".proxy.cpp",
+        framework_file("rpcproxyhelper.cpp")], ["-lz"])
+
+    process = servers([server])
+    time.sleep(0.5)
+    result = subprocess.run([client, "localhost"], stdout=subprocess.PIPE,
+                            universal_newlines=True, timeout=60)
+    process.kill()
+    process.wait()
+    assert result.returncode == 0, result.stdout
+
+
+# Send upcase(text) flagged as able to take compressed replies, deflated
+# when compress is set, returning the reply's flags and payload
+def upcase_flagged(port, wire, text, compress):
+    payload = encode(wire, [text])
+    function_id = FUNCTION_IDS["upcase"] | RPC_ACCEPTS_COMPRESSED
+    if compress:
+        payload = struct.pack("<I", len(payload)) + zlib.compress(payload)
+        function_id |= RPC_COMPRESSED
+    with RawClient(port, wire) as client:
+        client.sock.sendall(HEADER.pack(len(payload), function_id, 1) +
+                            payload)
+        function_id, request_id, reply = client.receive()
+    assert request_id == 1
+    flags = function_id & (RPC_COMPRESSED | RPC_ACCEPTS_COMPRESSED)
+    assert function_id & ~flags == FUNCTION_IDS["upcase"]
+    if flags & RPC_COMPRESSED:
+        length, = struct.unpack("<I", reply[:4])
+        reply = zlib.decompress(reply[4:])
+        assert len(reply) == length
+    return flags, reply
+
+
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_compressed_round_trip(tmp_path, framework, servers, wire):
+    run_compress_client(tmp_path / "plain", framework, servers,
+                        "--wire=" + wire)
+    run_compress_client(tmp_path / "packed", framework, servers,
+                        "--wire=" + wire, "--compress",
+                        "--compress-threshold=256")
+
+
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_compressed_payloads_on_the_wire(tmp_path, generate, framework,
+                                         servers, wire):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire, "--compress",
+                             "--compress-threshold=256", libs=["-lz"])
+    text = "abcdefgh" * 1000
+    upper = encode(wire, [text.upper()])
+    for compress in [False, True]:
+        flags, reply = upcase_flagged(port, wire, text, compress)
+        # the reply is deflated, as its request said it could be
+        assert flags == RPC_COMPRESSED | RPC_ACCEPTS_COMPRESSED
+        assert reply == upper
+    # payloads under the threshold go as they are
+    flags, reply = upcase_flagged(port, wire, "short", True)
+    assert flags == RPC_ACCEPTS_COMPRESSED
+    assert reply == encode(wire, ["SHORT"])
+
+
+# A client that never says it takes compressed replies gets them plain
+def test_plain_client_against_compressing_server(tmp_path, generate,
+                                                 framework, servers):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--compress", "--compress-threshold=64",
+                             libs=["-lz"])
+    text = "abcdefgh" * 1000
+    with RawClient(port) as client:
+        client.send("upcase", text)
+        function_id, request_id, payload = client.receive()
+    assert function_id & ~RPC_ACCEPTS_COMPRESSED == FUNCTION_IDS["upcase"]
+    assert payload == encode("text", [text.upper()])
+
+
+# A compressed payload whose original length is wrong drops the client,
+# and only that client
+def test_corrupt_compressed_payload(tmp_path, generate, framework, servers):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--compress", libs=["-lz"])
+    payload = encode("text", ["abcdefgh" * 1000])
+    payload = struct.pack("<I", 10) + zlib.compress(payload)
+    with socket.create_connection(("127.0.0.1", port), 10) as sock:
+        sock.sendall(HEADER.pack(len(payload),
+                                 FUNCTION_IDS["upcase"] | RPC_COMPRESSED, 1) +
+                     payload)
+        assert sock.recv(4096) == b""
+    with RawClient(port) as client:
+        client.send("area", 4, 5)
+        function_id, request_id, payload = client.receive()
+    assert payload == b"20"
+
+
+# An upcase payload whose string claims 4 bytes but holds "abc", deflated
+# behind its original length
+def short_upcase(wire, text):
+    if wire == "binary":
+        payload = struct.pack("<I", 4) + text
+    else:
+        payload = b"4 " + text
+    return struct.pack("<I", len(payload)) + zlib.compress(payload)
+
+
+# The inflated payload ends where its original length says, so a string
+# running past it drops the client like an uncompressed one does
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_compressed_payload_running_past_its_end(tmp_path, generate,
+                                                 framework, servers, wire):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire, "--compress", libs=["-lz"])
+    payload = short_upcase(wire, b"abc")
+    with socket.create_connection(("127.0.0.1", port), 10) as sock:
+        sock.sendall(HEADER.pack(len(payload),
+                                 FUNCTION_IDS["upcase"] | RPC_COMPRESSED, 1) +
+                     payload)
+        assert sock.recv(4096) == b""
+    with RawClient(port, wire) as client:
+        client.send("upcase", "after")
+        function_id, request_id, payload = client.receive()
+    assert payload == encode(wire, ["AFTER"])
+
+
+# Answer the first request on RPCSERVER_PORT with a compressed upcase
+# reply whose string runs past its end, then wait for the client to go
+def serve_short_reply(listener, wire):
+    sock, _ = listener.accept()
+    with sock:
+        header = b""
+        while len(header) < HEADER.size:
+            header += sock.recv(HEADER.size - len(header))
+        length, function_id, request_id = HEADER.unpack(header)
+        while length > 0:
+            length -= len(sock.recv(length))
+        payload = short_upcase(wire, b"ABC")
+        sock.sendall(HEADER.pack(len(payload), FUNCTION_IDS["upcase"] |
+                                 RPC_COMPRESSED | RPC_ACCEPTS_COMPRESSED,
+                                 request_id) + payload)
+        while sock.recv(4096):
+            pass
+
+
+# Proxies, pooled or not, reject such a reply rather than returning the
+# NUL after it as part of the string
+@pytest.mark.parametrize("pool", [[], ["--pool"]])
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_compressed_reply_running_past_its_end(tmp_path, framework, wire,
+                                               pool):
+    stem = generate_idl(tmp_path, "lotsofstuff.idl", "--framing=length",
+                        "--compress", "--wire=" + wire, *pool)
+    (tmp_path / "client.cpp").write_text(upcase_client)
+    client = framework(tmp_path / "client", [
+        tmp_path / "client.cpp", stem + ".proxy.cpp",
+        framework_file("rpcproxyhelper.cpp")], ["-lz"])
+    with socket.socket() as listener:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", RPCSERVER_PORT))
+        listener.listen(1)
+        server = threading.Thread(target=serve_short_reply,
+                                  args=(listener, wire))
+        server.start()
+        result = subprocess.run([client, "localhost", "3"],
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True, timeout=60)
+        server.join()
+    assert result.stdout.splitlines() == ["3 rejected"]
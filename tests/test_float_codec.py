@@ -0,0 +1,154 @@
+#
+#          Floats encoded and decoded back, edge values included
+#
+import shutil
+import subprocess
+import time
+
+import pytest
+
+import rpcgenerate
+from conftest import framework_file, root_file
+
+# Floats that must come back bit for bit, NaNs with their sign
+edge_floats = \
+    """
+#include <cfloat>
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <limits>
+using namespace std;
+
+static const float edgeFloats[] = {
+    0.0f, -0.0f, numeric_limits<float>::denorm_min(),
+    -numeric_limits<float>::denorm_min(), nextafterf(FLT_MIN, 0.0f),
+    1e-40f, FLT_MIN, -FLT_MIN, FLT_MAX, -FLT_MAX, INFINITY, -INFINITY,
+    numeric_limits<float>::quiet_NaN(), -numeric_limits<float>::quiet_NaN(),
+    0.1f, -0.1f, 1.0f / 3.0f, 16777215.0f, 3.14159274f, 1e30f};
+
+static inline bool sameFloat(float a, float b)
+{
+    if (isnan(a))
+        return isnan(b) && signbit(a) == signbit(b);
+    return memcmp(&a, &b, sizeof(a)) == 0;
+}
+"""
+
+# Each edge float through serialize_float and parse_float
+codec_main = \
+    """
+int main()
+{
+    int failed = 0;
+    for (float x : edgeFloats)
+    {
+        string msg;
+        serialize_float(msg, x);
+        const char *strm = msg.c_str();
+        float y = parse_float(strm, strm + msg.length());
+        if (!sameFloat(x, y) || strm != msg.c_str() + msg.length())
+        {
+            printf("%a encoded as \\"%s\\" came back as %a\\n", x,
+                   msg.c_str(), y);
+            failed++;
+        }
+    }
+    return failed;
+}
+"""
+
+# Each edge float through multiply(x, 1) on the lotsofstuff server:
+# <client> <server>
+multiply_client = \
+    """
+#include <string>
+#include "rpcproxyhelper.h"
+using namespace C150NETWORK;
+#include "lotsofstuff.idl"
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    int failed = 0;
+    for (float x : edgeFloats)
+    {
+        float y = multiply(x, 1.0f);
+        if (!sameFloat(x, y))
+        {
+            printf("%a came back as %a\\n", x, y);
+            failed++;
+        }
+    }
+    printf("%d failed\\n", failed);
+    return failed;
+}
+"""
+
+
+def float_serializer(options):
+    if options.hex_floats:
+        return rpcgenerate.hex_float_serializer
+    return rpcgenerate.BUILTIN_SERIALIZERS[options.wire][1]
+
+
+@pytest.mark.parametrize("flags", [[], ["--hex-floats"], ["--wire=binary"]])
+def test_float_round_trip(tmp_path, cxx, flags):
+    options = rpcgenerate.parse_args(flags + ["test.idl"])
+    source = tmp_path / "floats.cpp"
+    source.write_text(
+        "#include <cstdint>\n#include <string>\n" + edge_floats +
+        rpcgenerate.standalone_exception +
+        (rpcgenerate.uint32_helpers if options.wire == "binary" else "") +
+        rpcgenerate.BUILTIN_PARSERS[options.wire][1] +
+        float_serializer(options) + codec_main)
+    program = cxx(tmp_path / "floats", [source])
+    result = subprocess.run([program], stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+
+
+# Every text float fits the size reserved for it
+def test_text_float_size(tmp_path, cxx):
+    source = tmp_path / "lengths.cpp"
+    source.write_text(
+        "#include <string>\n" + edge_floats + rpcgenerate.float_serializer +
+        """
+int main()
+{
+    size_t longest = 0;
+    for (float x : edgeFloats)
+    {
+        string msg;
+        serialize_float(msg, x);
+        longest = msg.length() > longest ? msg.length() : longest;
+    }
+    printf("%zu\\n", longest);
+    return 0;
+}
+""")
+    program = cxx(tmp_path / "lengths", [source])
+    longest = int(subprocess.check_output([program]))
+    assert longest <= rpcgenerate.TEXT_BUILTIN_SIZES["float"]
+
+
+@pytest.mark.parametrize("flags", [[], ["--hex-floats"], ["--wire=binary"],
+                                   ["--framing=length"]])
+def test_float_round_trip_through_rpc(tmp_path, generate, framework, servers,
+                                      flags):
+    stem = generate("lotsofstuff.idl", *flags)
+    shutil.copyfile(root_file("lotsofstuff.cpp"),
+                    str(tmp_path / "lotsofstuff.cpp"))
+    (tmp_path / "client.cpp").write_text(edge_floats + multiply_client)
+    server = framework(tmp_path / "server", [
+        stem + ".stub.cpp", tmp_path / "lotsofstuff.cpp",
+        framework_file("rpcserver.cpp"), framework_file("rpcstubhelper.cpp")])
+    client = framework(tmp_path / "client", [
+        tmp_path / "client.cpp", stem + ".proxy.cpp",
+        framework_file("rpcproxyhelper.cpp")])
+
+    servers([server])
+    time.sleep(0.5)
+    result = subprocess.run([client, "localhost"], stdout=subprocess.PIPE,
+                            universal_newlines=True, timeout=60)
+    assert result.returncode == 0, result.stdout
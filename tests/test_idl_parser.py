@@ -0,0 +1,129 @@
+#
+#          The in-process IDL parser against idl_to_json
+#
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import rpcgenerate
+from conftest import IDL_DIR, root_file
+
+IDLS = sorted(name for name in os.listdir(IDL_DIR) if name.endswith(".idl"))
+
+# Legal IDLs beyond those under idl/
+EXTRA_IDLS = [
+    "int f(int a[0]);",
+    "int f(int a[007]);",
+    "struct t { int a[2][3]; };\nint g(t x, int y[3]);",
+    "struct e {};\n;;\nvoid h();",
+]
+
+# Illegal IDLs, what the Python parser says about them and on which line,
+# and what idl_to_json says
+BAD_IDLS = [
+    ("void f(Undeclared x);", 1,
+     '"Undeclared" is not a declared type name',
+     '"Undeclared" is not a declared type name'),
+    ("int ok();\nint f(int a[x]);", 2,
+     'array bound "x" is not an integer', "array bound is not an integer"),
+    ("int f(int a[-1]);", 1,
+     'array bound "-1" is not an integer', "array bound is not an integer"),
+    ("int f(int a[]);", 1,
+     'array bound "]" is not an integer', 'array declaration missing "]"'),
+    ("struct t { int a[2.5]; };", 1,
+     'array bound "2.5" is not an integer', 'array declaration missing "]"'),
+    ("struct s { int a; };\nstruct s { int b; };", 2,
+     "duplicate type name: s", "Duplicate type name: s"),
+    ("int f(int x);\nint f(int y);", 2,
+     "duplicate function name: f", "Duplicate function name: f"),
+    ("int f(void v);", 1,
+     '"void" is not allowed as function argument',
+     '"void" is not allowed as function argument'),
+    ("int int(int x);", 1,
+     '"int" is not a legal function name', '"int" is not a legal'),
+    ("int f(int x)", 1, 'expected ";" but found "end of file"',
+     "unterminated declaration"),
+]
+
+
+# idl_to_json copied where it can be made executable, as checkouts may
+# not keep its mode
+@pytest.fixture
+def idl_to_json(tmp_path):
+    program = str(tmp_path / "idl_to_json")
+    shutil.copyfile(root_file("idl_to_json"), program)
+    os.chmod(program, 0o755)
+    try:
+        subprocess.run([program, os.path.join(IDL_DIR, IDLS[0])],
+                       stdout=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("idl_to_json does not run here")
+    return program
+
+
+def write_idl(tmp_path, text):
+    idl = str(tmp_path / "test.idl")
+    with open(idl, "w") as f:
+        f.write(text + "\n")
+    return idl
+
+
+# Both parsers give the same declarations, in the same order
+def assert_same_decls(idl, idl_to_json):
+    output = subprocess.check_output([idl_to_json, idl])
+    expected = json.loads(output.decode("utf-8"))
+    decls = rpcgenerate.parse_idl(idl)
+    assert json.dumps(decls) == json.dumps(expected)
+
+
+@pytest.mark.parametrize("name", IDLS)
+def test_corpus_matches_idl_to_json(name, idl_to_json):
+    assert_same_decls(os.path.join(IDL_DIR, name), idl_to_json)
+
+
+@pytest.mark.parametrize("text", EXTRA_IDLS)
+def test_extra_idl_matches_idl_to_json(tmp_path, text, idl_to_json):
+    assert_same_decls(write_idl(tmp_path, text), idl_to_json)
+
+
+# --parser=idl_to_json goes through load_decls and its cache
+def test_load_decls_matches_parse_idl(tmp_path, idl_to_json, monkeypatch):
+    monkeypatch.setattr(rpcgenerate, "IDL_TO_JSON_EXECUTABLE", idl_to_json)
+    monkeypatch.setattr(rpcgenerate, "IDL_CACHE_DIR",
+                        str(tmp_path / "cache"))
+    idl = os.path.join(IDL_DIR, "lotsofstuff.idl")
+    assert rpcgenerate.load_decls(idl) == rpcgenerate.parse_idl(idl)
+    # the second load comes from the cache
+    assert rpcgenerate.load_decls(idl) == rpcgenerate.parse_idl(idl)
+    assert len(os.listdir(str(tmp_path / "cache"))) == 1
+
+
+@pytest.mark.parametrize("text, line, message, idl_to_json_message",
+                         BAD_IDLS)
+def test_errors(tmp_path, text, line, message, idl_to_json_message):
+    idl = write_idl(tmp_path, text)
+    with pytest.raises(Exception) as e:
+        rpcgenerate.parse_idl(idl)
+    assert str(e.value).startswith("%s:%d: " % (idl, line))
+    assert message in str(e.value)
+
+
+@pytest.mark.parametrize("text, line, message, idl_to_json_message",
+                         BAD_IDLS)
+def test_idl_to_json_rejects_the_same(tmp_path, text, line, message,
+                                      idl_to_json_message, idl_to_json):
+    result = subprocess.run([idl_to_json, write_idl(tmp_path, text)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.returncode != 0
+    assert idl_to_json_message in result.stderr
+
+
+def test_generate_reports_parse_errors(tmp_path):
+    idl = write_idl(tmp_path, "void f(Undeclared x);")
+    error = rpcgenerate.generate(idl, rpcgenerate.parse_args([idl]))
+    assert error == idl + ':1: "Undeclared" is not a declared type name'
+    assert not os.path.exists(str(tmp_path / "test.proxy.cpp"))
@@ -0,0 +1,139 @@
+#
+#          Payloads whose values run past their end
+#
+#     A request whose string claims more characters than the payload
+#     holds, or that ends before a value it needs, must drop its client
+#     without a reply and leave the server serving others.
+#
+import shutil
+import socket
+import struct
+import time
+import zlib
+
+import pytest
+
+from conftest import generate_idl, framework_file, root_file
+from test_server_runtime import (FUNCTION_IDS, HEADER, RawClient, encode,
+                                 run_clients, start_lotsofstuff)
+
+# Payloads of function, in each wire format, that end before their values
+MALFORMED = {
+    "text": [
+        ("upcase", b"2000000000 x"),
+        ("upcase", b"5 ab"),
+        # one byte short, the NUL after the payload not counting
+        ("upcase", b"4 abc"),
+        ("upcase", b"-1 x"),
+        ("upcase", b""),
+        ("area", b"3"),
+        ("multiply", b"1.5"),
+    ],
+    "binary": [
+        ("upcase", struct.pack("<I", 0x7fffffff)),
+        ("upcase", struct.pack("<I", 5) + b"ab"),
+        ("upcase", struct.pack("<I", 4) + b"abc"),
+        ("upcase", b"\1\0"),
+        ("area", struct.pack("<i", 3)),
+        ("multiply", b"\0\0"),
+        # arrays of ints are copied whole on little-endian hosts
+        ("takesTwoArrays", struct.pack("<30i", *range(30))),
+        ("sum", struct.pack("<100i", *range(100))),
+    ],
+}
+CASES = [pytest.param(wire, function, payload,
+                      id="%s-%s-%d" % (wire, function, i))
+         for wire in sorted(MALFORMED)
+         for i, (function, payload) in enumerate(MALFORMED[wire])]
+
+# The port rpcserver.cpp serves on
+RPCSERVER_PORT = 15117
+
+RPC_COMPRESSED = 0x40000000
+
+
+# Send data on a new connection and nothing after it, returning what the
+# server answers before closing it
+def send_raw(port, data):
+    with socket.create_connection(("127.0.0.1", port), 10) as sock:
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        received = b""
+        while True:
+            try:
+                chunk = sock.recv(4096)
+            except ConnectionResetError:
+                return received
+            if not chunk:
+                return received
+            received += chunk
+
+
+def length_framed(function, payload, flags=0):
+    return HEADER.pack(len(payload), FUNCTION_IDS[function] | flags, 1) + \
+        payload
+
+
+@pytest.mark.parametrize("wire, function, payload", CASES)
+def test_server_runtime_drops_malformed_request(tmp_path, generate,
+                                                framework, servers, wire,
+                                                function, payload):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire)
+    with RawClient(port, wire) as client:
+        assert client.call(str, "upcase", "before") == "BEFORE"
+        assert send_raw(port, length_framed(function, payload)) == b""
+        assert client.call(str, "upcase", "after") == "AFTER"
+    run_clients(port, wire, clients=2, calls=2)
+
+
+# The same payloads deflated for a --compress server end where their
+# original length says, not at the NUL after it
+@pytest.mark.parametrize("wire, function, payload", CASES)
+def test_server_runtime_drops_compressed_malformed_request(
+        tmp_path, generate, framework, servers, wire, function, payload):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire, "--compress", libs=["-lz"])
+    packed = struct.pack("<I", len(payload)) + zlib.compress(payload)
+    assert send_raw(port, length_framed(function, packed,
+                                        RPC_COMPRESSED)) == b""
+    with RawClient(port, wire) as client:
+        client.send("upcase", "after")
+        function_id, request_id, reply = client.receive()
+    assert reply == encode(wire, ["AFTER"])
+
+
+# Stubs served one connection at a time by rpcserver.cpp, with null
+# terminated and with length framed messages
+@pytest.mark.parametrize("framing", ["null", "length"])
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_stub_drops_malformed_request(tmp_path, framework, servers, wire,
+                                      framing):
+    stem = generate_idl(tmp_path, "lotsofstuff.idl", "--wire=" + wire,
+                        "--framing=" + framing)
+    shutil.copyfile(root_file("lotsofstuff.cpp"),
+                    str(tmp_path / "lotsofstuff.cpp"))
+    server = framework(tmp_path / "server", [
+        stem + ".stub.cpp", tmp_path / "lotsofstuff.cpp",
+        framework_file("rpcserver.cpp"), framework_file("rpcstubhelper.cpp")])
+    servers([server])
+    time.sleep(0.5)
+    for function, payload in MALFORMED[wire]:
+        if framing == "length":
+            request = length_framed(function, payload)
+        elif wire == "binary":
+            request = function.encode() + b"\0" + \
+                struct.pack("<I", len(payload)) + payload
+        else:
+            request = function.encode() + b"\0" + payload + b"\0"
+        assert send_raw(RPCSERVER_PORT, request) == b""
+    if framing == "length":
+        with RawClient(RPCSERVER_PORT, wire) as client:
+            assert client.call(str, "upcase", "hi") == "HI"
+    elif wire == "binary":
+        reply = send_raw(RPCSERVER_PORT, b"upcase\0" b"\6\0\0\0"
+                         b"\2\0\0\0hi")
+        assert reply == b"\6\0\0\0" b"\2\0\0\0HI"
+    else:
+        reply = send_raw(RPCSERVER_PORT, b"upcase\0" b"2 hi\0")
+        assert reply == b"2 HI\0"
@@ -0,0 +1,125 @@
+#
+#          Messages longer than --max-message-size, and long ones within it
+#
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+
+from conftest import generate_idl, framework_file, root_file
+from test_server_runtime import (FUNCTION_IDS, HEADER, RawClient,
+                                 run_clients, start_lotsofstuff)
+
+# Sends upcase strings of the lengths given, in turn, printing what came
+# back of each: <client> <server> <length>...
+upcase_client = \
+    """
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+using namespace std;
+#include "rpcproxyhelper.h"
+using namespace C150NETWORK;
+#include "lotsofstuff.idl"
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    for (int i = 2; i < argc; i++)
+    {
+        size_t length = strtoul(argv[i], NULL, 10);
+        string text;
+        for (size_t j = 0; j < length; j++)
+            text += "abcdefgh"[j % 8];
+        try
+        {
+            string upper = upcase(text);
+            bool same = upper.length() == length;
+            for (size_t j = 0; same && j < length; j++)
+                same = upper[j] == "ABCDEFGH"[j % 8];
+            printf("%zu %s\\n", length, same ? "ok" : "wrong");
+        }
+        catch (C150Exception &e)
+        {
+            printf("%zu rejected\\n", length);
+            return 0;
+        }
+    }
+    return 0;
+}
+"""
+
+WIRES = [[], ["--wire=binary"], ["--framing=length"],
+         ["--wire=binary", "--framing=length"]]
+
+
+# Build a lotsofstuff server and upcase_client, each generated with its
+# own flags, and run the client with the given upcase lengths
+def run_upcase_client(tmp_path, framework, servers, server_flags,
+                      client_flags, lengths):
+    binaries = []
+    for name, flags in [("server", server_flags), ("client", client_flags)]:
+        directory = tmp_path / name
+        directory.mkdir()
+        stem = generate_idl(directory, "lotsofstuff.idl", *flags)
+        if name == "server":
+            shutil.copyfile(root_file("lotsofstuff.cpp"),
+                            str(directory / "lotsofstuff.cpp"))
+            sources = [stem + ".stub.cpp", directory / "lotsofstuff.cpp",
+                       framework_file("rpcserver.cpp"),
+                       framework_file("rpcstubhelper.cpp")]
+        else:
+            (directory / "client.cpp").write_text(upcase_client)
+            sources = [directory / "client.cpp", stem + ".proxy.cpp",
+                       framework_file("rpcproxyhelper.cpp")]
+        binaries.append(framework(directory / name, sources))
+
+    servers([binaries[0]])
+    time.sleep(0.5)
+    result = subprocess.run(
+        [binaries[1], "localhost"] + [str(n) for n in lengths],
+        stdout=subprocess.PIPE, universal_newlines=True, timeout=60)
+    assert result.returncode == 0, result.stdout
+    return result.stdout.splitlines()
+
+
+# Long messages, past the 1 MB the stub once took, grow the receive
+# buffers and short ones after them shrink them back; every reply must
+# survive both
+@pytest.mark.parametrize("flags", WIRES)
+def test_long_messages_then_short(tmp_path, framework, servers, flags):
+    lengths = [10, 300000, 5, 100000, 70000, 3, 3000000]
+    lines = run_upcase_client(tmp_path, framework, servers, flags, flags,
+                              lengths)
+    assert lines == ["%d ok" % n for n in lengths]
+
+
+# A proxy refuses a reply longer than its --max-message-size rather than
+# buffering it
+@pytest.mark.parametrize("flags", WIRES + [["--framing=length", "--pool"]])
+def test_proxy_rejects_long_reply(tmp_path, framework, servers, flags):
+    lines = run_upcase_client(
+        tmp_path, framework, servers, flags,
+        flags + ["--max-message-size=4096"], [4000, 5000])
+    assert lines == ["4000 ok", "5000 rejected"]
+
+
+# The server runtime drops a client whose request is too long, even one
+# only announced by its header, and keeps serving the others
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_server_drops_long_request(tmp_path, generate, framework, servers,
+                                   wire):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire, "--max-message-size=65536")
+    with RawClient(port, wire) as client:
+        assert client.call(str, "upcase", "x" * 60000) == "X" * 60000
+    with RawClient(port, wire) as client:
+        # closed, or reset as the rest of the request was never read
+        with pytest.raises((ConnectionError, ConnectionResetError)):
+            client.call(str, "upcase", "x" * 70000)
+    with socket.create_connection(("127.0.0.1", port), 10) as sock:
+        sock.sendall(HEADER.pack(1 << 30, FUNCTION_IDS["upcase"], 1))
+        assert sock.recv(4096) == b""
+    run_clients(port, wire, clients=4, calls=5)
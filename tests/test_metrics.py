@@ -0,0 +1,138 @@
+#
+#          Per-function metrics of --metrics proxies and stubs
+#
+import json
+import os
+import subprocess
+import time
+
+import pytest
+
+from conftest import generate_idl, framework_file
+from test_message_limits import WIRES
+
+# floatarithmetic whose divide writes the stub's metrics to the file
+# named by $RPC_METRICS_FILE
+implementation = \
+    """
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+using namespace std;
+#include "floatarithmetic.idl"
+
+string rpcMetricsJson();
+
+float add(float x, float y) { return x + y; }
+float subtract(float x, float y) { return x - y; }
+float multiply(float x, float y) { return x * y; }
+
+float divide(float x, float y)
+{
+    FILE *f = fopen(getenv("RPC_METRICS_FILE"), "w");
+    fputs(rpcMetricsJson().c_str(), f);
+    fclose(f);
+    return x / y;
+}
+"""
+
+# Calls add three times and divide once, then prints the proxy's metrics
+# as JSON and as text: <client> <server>
+client = \
+    """
+#include <cstdio>
+#include <string>
+using namespace std;
+#include "rpcproxyhelper.h"
+using namespace C150NETWORK;
+#include "floatarithmetic.idl"
+
+string rpcMetricsJson();
+string rpcMetricsText();
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    for (int i = 0; i < 3; i++)
+        add(1.5, i);
+    divide(1, 2);
+    printf("%s\\n%s", rpcMetricsJson().c_str(), rpcMetricsText().c_str());
+    return 0;
+}
+"""
+
+
+@pytest.mark.parametrize("flags", WIRES)
+def test_calls_bytes_and_phases(tmp_path, framework, servers, flags):
+    binaries = []
+    for name in ["server", "client"]:
+        directory = tmp_path / name
+        directory.mkdir()
+        stem = generate_idl(directory, "floatarithmetic.idl", "--metrics",
+                            *flags)
+        if name == "server":
+            (directory / "arithmetic.cpp").write_text(implementation)
+            sources = [stem + ".stub.cpp", directory / "arithmetic.cpp",
+                       framework_file("rpcserver.cpp"),
+                       framework_file("rpcstubhelper.cpp")]
+        else:
+            (directory / "client.cpp").write_text(client)
+            sources = [directory / "client.cpp", stem + ".proxy.cpp",
+                       framework_file("rpcproxyhelper.cpp")]
+        binaries.append(framework(directory / name, sources))
+
+    metrics_file = str(tmp_path / "server.json")
+    os.environ["RPC_METRICS_FILE"] = metrics_file
+    try:
+        servers([binaries[0]])
+    finally:
+        del os.environ["RPC_METRICS_FILE"]
+    time.sleep(0.5)
+    result = subprocess.run([binaries[1], "localhost"],
+                            stdout=subprocess.PIPE, universal_newlines=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stdout
+    json_line, *text = result.stdout.splitlines()
+
+    proxy = json.loads(json_line)
+    assert sorted(proxy) == ["add", "divide", "multiply", "subtract"]
+    assert proxy["add"]["calls"] == 3
+    assert proxy["add"]["errors"] == 0
+    assert proxy["subtract"]["calls"] == 0
+    # two floats out and one back per call
+    float_size = 4 if "--wire=binary" in flags else None
+    if float_size:
+        assert proxy["add"]["bytes_out"] == 3 * 2 * float_size
+        assert proxy["add"]["bytes_in"] == 3 * float_size
+    else:
+        assert proxy["add"]["bytes_out"] > 0
+        assert proxy["add"]["bytes_in"] > 0
+    for phase in ["serialize", "network"]:
+        assert proxy["add"][phase]["count"] == 3
+        assert sum(proxy["add"][phase]["buckets"]) == 3
+    assert proxy["add"]["execute"]["count"] == 0
+    assert "add calls=3 errors=0" in text[0]
+
+    # divide dumped the stub's metrics while it was running
+    with open(metrics_file) as f:
+        stub = json.load(f)
+    assert stub["add"]["calls"] == 3
+    assert stub["add"]["bytes_in"] == proxy["add"]["bytes_out"]
+    assert stub["add"]["bytes_out"] == proxy["add"]["bytes_in"]
+    for phase in ["serialize", "network", "execute"]:
+        assert stub["add"][phase]["count"] == 3
+    assert stub["divide"]["calls"] == 1
+    assert stub["divide"]["execute"]["count"] == 0
+
+
+# Without --metrics and --grading-log nothing is recorded or logged
+def test_nothing_on_the_hot_path_by_default(generate):
+    stem = generate("lotsofstuff.idl")
+    for suffix in [".proxy.cpp", ".stub.cpp"]:
+        with open(stem + suffix) as f:
+            text = f.read()
+        assert "GRADING" not in text
+        assert "RPCCallTimer" not in text
+    stem = generate("lotsofstuff.idl", "--grading-log")
+    with open(stem + ".stub.cpp") as f:
+        assert "*GRADING << " in f.read()
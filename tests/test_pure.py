@@ -0,0 +1,212 @@
+#
+#          Cached results of the functions named by --pure
+#
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+import rpcgenerate
+from conftest import IDL_DIR, framework_file, generate_idl, root_file
+from test_message_limits import WIRES
+
+# floatarithmetic with add counted, and the other functions reporting
+# how often add ran and what its cache saw
+implementation = \
+    """
+#include <cstddef>
+#include <string>
+using namespace std;
+#include "floatarithmetic.idl"
+
+size_t rpcResultCacheHits(const char *function);
+size_t rpcResultCacheMisses(const char *function);
+
+static int calls = 0;
+
+float add(float x, float y)
+{
+    calls++;
+    return x + y;
+}
+
+float subtract(float x, float y)
+{
+    return calls;
+}
+
+float multiply(float x, float y)
+{
+    return rpcResultCacheHits("add");
+}
+
+float divide(float x, float y)
+{
+    return rpcResultCacheMisses("add");
+}
+"""
+
+# Calls add on the pairs given, printing each sum, then how often add
+# ran, hit and missed: <client> <server> <x> <y>...
+client = \
+    """
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+using namespace std;
+#include "rpcproxyhelper.h"
+using namespace C150NETWORK;
+#include "floatarithmetic.idl"
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    for (int i = 2; i + 1 < argc; i += 2)
+        printf("%g\\n", add(atof(argv[i]), atof(argv[i + 1])));
+    printf("%g %g %g\\n", subtract(0, 0), multiply(0, 0), divide(0, 0));
+    return 0;
+}
+"""
+
+
+# Calls add on the first pair given, then on all of them in one batch,
+# printing each sum, then how often add ran, hit and missed:
+# <client> <server> <x> <y>...
+batch_client = \
+    """
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+#include <vector>
+using namespace std;
+#include "rpcproxyhelper.h"
+using namespace C150NETWORK;
+#include "floatarithmetic.idl"
+
+void add_batch(const float *x, const float *y, size_t n, float *out);
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    vector<float> x, y;
+    for (int i = 2; i + 1 < argc; i += 2)
+    {
+        x.push_back(atof(argv[i]));
+        y.push_back(atof(argv[i + 1]));
+    }
+    printf("%g\\n", add(x[0], y[0]));
+    vector<float> out(x.size());
+    add_batch(&x[0], &y[0], x.size(), &out[0]);
+    for (size_t i = 0; i < out.size(); i++)
+        printf("%g\\n", out[i]);
+    printf("%g %g %g\\n", subtract(0, 0), multiply(0, 0), divide(0, 0));
+    return 0;
+}
+"""
+
+
+def run_adds(tmp_path, framework, servers, flags, pairs, source=client):
+    binaries = []
+    for name in ["server", "client"]:
+        directory = tmp_path / name
+        directory.mkdir()
+        stem = generate_idl(directory, "floatarithmetic.idl", *flags)
+        if name == "server":
+            (directory / "arithmetic.cpp").write_text(implementation)
+            sources = [stem + ".stub.cpp", directory / "arithmetic.cpp",
+                       framework_file("rpcserver.cpp"),
+                       framework_file("rpcstubhelper.cpp")]
+        else:
+            (directory / "client.cpp").write_text(source)
+            sources = [directory / "client.cpp", stem + ".proxy.cpp",
+                       framework_file("rpcproxyhelper.cpp")]
+        binaries.append(framework(directory / name, sources))
+
+    servers([binaries[0]])
+    time.sleep(0.5)
+    result = subprocess.run(
+        [binaries[1], "localhost"] + [str(v) for p in pairs for v in p],
+        stdout=subprocess.PIPE, universal_newlines=True, timeout=60)
+    assert result.returncode == 0, result.stdout
+    return result.stdout.splitlines()
+
+
+# Repeated arguments are answered from the cache without running add
+@pytest.mark.parametrize("flags", WIRES)
+def test_repeated_calls_hit(tmp_path, framework, servers, flags):
+    pairs = [(1.5, 2), (1.5, 2), (2, 2), (1.5, 2), (2, 2)]
+    lines = run_adds(tmp_path, framework, servers, flags + ["--pure=add"],
+                     pairs)
+    assert lines == ["3.5", "3.5", "4", "3.5", "4", "2 3 2"]
+
+
+# Calls in a batch share the cache with single calls
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_batched_calls_hit_single_calls(tmp_path, framework, servers, wire):
+    pairs = [(1.5, 2), (2, 2), (1.5, 2)]
+    lines = run_adds(tmp_path, framework, servers,
+                     ["--framing=length", "--batch", "--wire=" + wire,
+                      "--pure=add"], pairs, batch_client)
+    assert lines == ["3.5", "3.5", "4", "3.5", "2 2 2"]
+
+
+# A full cache evicts the least recently used result
+def test_least_recently_used_evicted(tmp_path, framework, servers):
+    pairs = [(1, 1), (2, 2), (1, 1), (3, 3), (2, 2), (1, 1)]
+    lines = run_adds(tmp_path, framework, servers,
+                     ["--pure=subtract,add", "--pure-cache-size=2"], pairs)
+    assert lines == ["2", "4", "2", "6", "4", "2", "5 1 5"]
+
+
+def test_pure_names_split_on_commas():
+    args = rpcgenerate.parse_args(["--pure", "add,multiply", "--pure=upcase",
+                                   "arithmetic.idl"])
+    assert args.pure == ["add", "multiply", "upcase"]
+
+
+def test_pure_cache_size_must_be_positive(capsys):
+    with pytest.raises(SystemExit) as e:
+        rpcgenerate.parse_args(["--pure-cache-size=0", "arithmetic.idl"])
+    assert e.value.code == 2
+    assert "--pure-cache-size must be at least 1" in capsys.readouterr().err
+
+
+# Generate every IDL under idl/, copied into directory, with the given
+# --pure names
+def generate_all(directory, pure):
+    shutil.copytree(IDL_DIR, str(directory / "idl"))
+    return subprocess.run(
+        [sys.executable, root_file("rpcgenerate.py"), "--pure=" + pure,
+         str(directory / "idl")], stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, universal_newlines=True)
+
+
+# Each stub caches the functions named that its IDL declares
+def test_pure_names_from_any_idl(tmp_path):
+    result = generate_all(tmp_path, "area,add")
+    assert result.returncode == 0, result.stdout
+    for name, cached in [("lotsofstuff", ["area"]), ("structs", ["area"]),
+                         ("arithmetic", ["add"]), ("floatarithmetic", ["add"]),
+                         ("simplefunction", [])]:
+        with open(str(tmp_path / "idl" / (name + ".stub.cpp"))) as f:
+            stub = f.read()
+        assert re.findall(r"RPCResultCache rpcResultCache_(\w+)\(",
+                          stub) == cached
+
+
+# Names no IDL declares as a function, or only as one without a result
+# to cache, fail the run before anything is written
+@pytest.mark.parametrize("pure, message", [
+    ("aera", "--pure names aera, which is not a function of any IDL"),
+    ("area,upcase,func1", "--pure names func1, which returns void"),
+])
+def test_pure_names_must_be_functions_with_results(tmp_path, pure, message):
+    result = generate_all(tmp_path, pure)
+    assert result.returncode == 1
+    assert result.stdout == message + "\n"
+    assert not [name for name in os.listdir(str(tmp_path / "idl"))
+                if name.endswith(".cpp")]
@@ -0,0 +1,197 @@
+#
+#          Python clients written by --python
+#
+#     Clients call a --server-runtime lotsofstuff server built from the
+#     stub generated with the same options, from threads sharing a pool
+#     and from asyncio, with int arrays passed as numpy arrays and as
+#     nested lists. Null terminated messages are checked against a server
+#     speaking them directly.
+#
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from conftest import generate_idl, load_module
+from test_server_runtime import start_lotsofstuff
+
+CLIENTS = 8
+CALLS = 20
+
+
+def python_client(tmp_path, *flags):
+    directory = tmp_path / "python"
+    directory.mkdir()
+    stem = generate_idl(directory, "lotsofstuff.idl", "--python", *flags)
+    return load_module(stem + "_proxy.py")
+
+
+# The calls of call_everything, each a function name, its arguments and
+# the result expected
+def calls(proxy, n):
+    if proxy.numpy is not None:
+        ones = proxy.numpy.ones(24, dtype=proxy.numpy.int32)
+        y = proxy.numpy.full((24, 15), n)
+        z = proxy.numpy.arange(360).reshape(24, 15)
+    else:
+        ones = [1] * 24
+        y = [[n] * 15 for _ in range(24)]
+        z = [list(range(15 * i, 15 * i + 15)) for i in range(24)]
+    john = proxy.Person("John", "Doe", n)
+    m3 = [[[n] * 100 for _ in range(10)] for _ in range(4)]
+    return [
+        ("area", [proxy.rectangle(n, 3)], 3 * n),
+        ("multiply", [1.5, n], 1.5 * n),
+        ("upcase", ["client %d" % n], "CLIENT %d" % n),
+        ("takesTwoArrays", [list(range(24)), [n] * 24], 45 + 10 * n),
+        ("showsArraysofArrays", [ones, y, z], 24 + 360 * n + 64620),
+        ("sum", [proxy.s(m3=m3)], 4000 * n),
+        ("findPerson", [proxy.ThreePeople(proxy.Person("Jane", "Roe", 1),
+                                          john)], john),
+        # void functions get no reply
+        ("searchRectangles", [[proxy.rectangle(1, 1)] * 200], None),
+        ("func1", [], None),
+    ]
+
+
+def call_everything(proxy, client, n):
+    for name, args, expected in calls(proxy, n):
+        assert getattr(client, name)(*args) == expected
+
+
+async def call_everything_async(proxy, client, n):
+    for name, args, expected in calls(proxy, n):
+        assert await getattr(client, name)(*args) == expected
+
+
+def run_threads(proxy, client):
+    errors = []
+
+    def run(i):
+        try:
+            for n in range(CALLS):
+                call_everything(proxy, client, i * CALLS + n)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(CLIENTS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+@pytest.mark.parametrize("flags", [
+    ["--wire=text"], ["--wire=text", "--hex-floats"], ["--wire=binary"]])
+@pytest.mark.parametrize("arrays", ["numpy", "lists"])
+def test_client_calls_stub(tmp_path, generate, framework, servers, flags,
+                           arrays):
+    if arrays == "numpy":
+        pytest.importorskip("numpy")
+    port = start_lotsofstuff(tmp_path, generate, framework, servers, *flags)
+    proxy = python_client(tmp_path, "--framing=length", *flags)
+    if arrays == "lists":
+        proxy.numpy = None
+    with proxy.Client("127.0.0.1", port, pool_size=4) as client:
+        call_everything(proxy, client, 7)
+        run_threads(proxy, client)
+        # connections are opened as concurrent calls need them
+        assert 1 <= len(client._idle) <= 4
+
+
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_async_client_calls_stub(tmp_path, generate, framework, servers,
+                                 wire):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire)
+    proxy = python_client(tmp_path, "--framing=length", "--wire=" + wire)
+
+    async def run():
+        async with proxy.AsyncClient("127.0.0.1", port,
+                                     pool_size=4) as client:
+            await asyncio.gather(*[call_everything_async(proxy, client, n)
+                                   for n in range(CLIENTS)])
+            assert 1 <= len(client._idle) <= 4
+    asyncio.run(run())
+
+
+def test_client_compresses_once_stub_accepts(tmp_path, generate, framework,
+                                             servers):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--compress", libs=["-lz"])
+    proxy = python_client(tmp_path, "--framing=length", "--compress")
+    long_text = "compressible " * 10000
+    with proxy.Client("127.0.0.1", port, pool_size=1) as client:
+        assert client.upcase(long_text) == long_text.upper()
+        conn = client._idle[0]
+        assert conn.peer_accepts_compression and conn.compressed
+        assert client.upcase(long_text) == long_text.upper()
+
+
+def test_client_refuses_bad_arguments(tmp_path):
+    proxy = python_client(tmp_path, "--framing=length")
+    with pytest.raises(ValueError):
+        proxy._args_takesTwoArrays([0] * 23, [0] * 24)
+    with pytest.raises(proxy.struct.error):
+        proxy._args_area(proxy.rectangle(2 ** 31, 1))
+
+
+@pytest.mark.parametrize("wire, reply", [
+    ("text", b""), ("text", b"x"), ("text", b"-"),
+    ("binary", b""), ("binary", b"\0\0\0"),
+])
+def test_client_refuses_missing_int(tmp_path, wire, reply):
+    proxy = python_client(tmp_path, "--wire=" + wire)
+    with pytest.raises(proxy.RPCError):
+        proxy._get_int(reply, 0)
+
+
+# Serve one connection on a listening socket, answering each request in
+# exchanges with its reply after checking that it came as expected
+def serve(listener, exchanges, errors):
+    try:
+        conn, _ = listener.accept()
+        with conn:
+            for request, reply in exchanges:
+                received = b""
+                while len(received) < len(request):
+                    chunk = conn.recv(len(request) - len(received))
+                    assert chunk, "client closed the connection"
+                    received += chunk
+                assert received == request
+                conn.sendall(reply)
+    except Exception as e:
+        errors.append(e)
+
+
+@pytest.mark.parametrize("flags, exchanges", [
+    ([], [(b"upcase\0" b"2 hi\0", b"2 HI\0"),
+          (b"multiply\0" b"1.5 -2\0", b"-3\0"),
+          (b"func1\0\0", b"")]),
+    (["--function-ids"], [(b"10\0" b"2 hi\0", b"2 HI\0"),
+                          (b"5\0" b"1.5 -2\0", b"-3\0"),
+                          (b"2\0\0", b"")]),
+    (["--wire=binary"], [
+        (b"upcase\0" b"\6\0\0\0" b"\2\0\0\0hi", b"\6\0\0\0" b"\2\0\0\0HI"),
+        (b"multiply\0" b"\x08\0\0\0" b"\0\0\xc0\x3f" b"\0\0\0\xc0",
+         b"\4\0\0\0" b"\0\0\x40\xc0"),
+        (b"func1\0" b"\0\0\0\0", b"")]),
+])
+def test_null_terminated_requests(tmp_path, flags, exchanges):
+    proxy = python_client(tmp_path, *flags)
+    errors = []
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        server = threading.Thread(target=serve,
+                                  args=(listener, exchanges, errors))
+        server.start()
+        with proxy.Client("127.0.0.1", listener.getsockname()[1]) as client:
+            assert client.upcase("hi") == "HI"
+            assert client.multiply(1.5, -2) == -3
+            assert client.func1() is None
+        server.join()
+    assert errors == []
@@ -0,0 +1,45 @@
+#
+#          rpcbench.py on IDLs of the corpus
+#
+import json
+import os
+import subprocess
+import sys
+
+from conftest import COMP117, FRAMEWORK_DIR, IDL_DIR, ROOT, root_file
+
+
+def run_rpcbench(*args):
+    return subprocess.check_output(
+        [sys.executable, root_file("rpcbench.py"), "--calls", "5",
+         "--comp117", COMP117, "--framework-sources", FRAMEWORK_DIR] +
+        list(args),
+        cwd=ROOT, universal_newlines=True)
+
+
+def test_rpcbench_reports_every_function(framework, tmp_path):
+    output = run_rpcbench("--rpcgen-flags=--wire=binary",
+                          os.path.join(IDL_DIR, "structs.idl"),
+                          os.path.join(IDL_DIR, "structwitharray.idl"))
+    results = [json.loads(line) for line in output.splitlines()]
+    # structwitharray.idl declares no functions to time
+    assert [(r["idl"], r["function"]) for r in results] == [
+        ("structs.idl", "area"), ("structs.idl", "findPerson")]
+    for r in results:
+        assert r["calls"] == 5
+        assert r["calls_per_sec"] > 0
+        assert 0 < r["p50_us"] <= r["p99_us"]
+    # a binary rectangle is two ints, and area returns one
+    assert results[0]["bytes_out_per_call"] == 8
+    assert results[0]["bytes_in_per_call"] == 4
+
+    baseline = tmp_path / "baseline.jsonl"
+    baseline.write_text(output)
+    output = run_rpcbench("--rpcgen-flags=--wire=binary",
+                          "--baseline", str(baseline),
+                          "--max-slowdown", "100",
+                          os.path.join(IDL_DIR, "structs.idl"))
+    for line in output.splitlines():
+        r = json.loads(line)
+        assert r["baseline_calls_per_sec"] > 0
+        assert r["speedup"] > 0
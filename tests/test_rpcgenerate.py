@@ -0,0 +1,53 @@
+#
+#          rpcgenerate's command line and the files it writes
+#
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import rpcgenbench
+import rpcgenerate
+from conftest import IDL_DIR, root_file
+
+
+def test_generated_files_include_idl_by_name(tmp_path):
+    os.mkdir(str(tmp_path / "idl"))
+    shutil.copyfile(os.path.join(IDL_DIR, "arithmetic.idl"),
+                    str(tmp_path / "idl" / "arithmetic.idl"))
+    shutil.copyfile(root_file("idl_to_json"), str(tmp_path / "idl_to_json"))
+    os.chmod(str(tmp_path / "idl_to_json"), 0o755)
+    # run from elsewhere with a relative path, as make -C or a build
+    # directory would
+    subprocess.run([sys.executable, root_file("rpcgenerate.py"),
+                    os.path.join("idl", "arithmetic.idl")],
+                   cwd=str(tmp_path), check=True)
+    for suffix in [".proxy.cpp", ".stub.cpp"]:
+        with open(str(tmp_path / "idl" / ("arithmetic" + suffix))) as f:
+            text = f.read()
+        assert '#include "arithmetic.idl"\n' in text
+        assert '#include "idl/' not in text
+
+
+@pytest.mark.parametrize("jobs", ["0", "-2"])
+def test_jobs_must_be_positive(jobs, capsys):
+    with pytest.raises(SystemExit) as e:
+        rpcgenerate.parse_args(["-j", jobs, "arithmetic.idl"])
+    assert e.value.code == 2
+    assert "-j/--jobs must be at least 1" in capsys.readouterr().err
+
+
+# The IDL rpcgenbench --synthetic times parses and generates
+def test_synthetic_idl_generates(tmp_path):
+    idl = str(tmp_path / "synthetic.idl")
+    with open(idl, "w") as f:
+        f.write(rpcgenbench.synthetic_idl(60))
+    decls = rpcgenerate.parse_idl(idl)
+    assert len(decls["functions"]) == 60
+    assert len(decls["types"]["t30"]["members"]) == 1003
+    error = rpcgenerate.generate(idl, rpcgenerate.parse_args([idl]))
+    assert error is None, error
+    for suffix in [".proxy.cpp", ".stub.cpp"]:
+        assert os.path.getsize(str(tmp_path / ("synthetic" + suffix))) > 0
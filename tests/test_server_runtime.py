@@ -0,0 +1,238 @@
+#
+#          Many clients at once against a --server-runtime server
+#
+#     The clients speak the length framed protocol directly: a 12 byte
+#     little-endian header holding the payload length, the function id
+#     and the request id, followed by the payload in the server's wire
+#     format.
+#
+import shutil
+import socket
+import struct
+import threading
+
+import pytest
+
+from conftest import free_port, framework_file, root_file
+
+# Serves lotsofstuff.cpp with rpcServe: <server> <port>
+server_main = \
+    """
+#include <cstddef>
+#include <cstdlib>
+
+void rpcServe(int port, size_t workers, size_t maxConnections);
+
+int main(int argc, char *argv[])
+{
+    rpcServe(atoi(argv[1]), 4, 64);
+    return 0;
+}
+"""
+
+HEADER = struct.Struct("<III")
+
+# Function ids are positions in the sorted list of IDL functions
+FUNCTION_IDS = {name: i for i, name in enumerate(sorted([
+    "area", "findPerson", "func1", "func2", "func3", "multiply",
+    "searchRectangles", "showsArraysofArrays", "sum", "takesTwoArrays",
+    "upcase"]))}
+
+CLIENTS = 16
+CALLS = 50
+
+
+# Encode ints, floats and strings in the given wire format
+def encode(wire, values):
+    if wire == "binary":
+        payload = b""
+        for v in values:
+            if isinstance(v, str):
+                data = v.encode()
+                payload += struct.pack("<I", len(data)) + data
+            elif isinstance(v, float):
+                payload += struct.pack("<f", v)
+            else:
+                payload += struct.pack("<i", v)
+        return payload
+    tokens = []
+    for v in values:
+        if isinstance(v, str):
+            tokens.append("%d %s" % (len(v.encode()), v))
+        else:
+            tokens.append(str(v))
+    return " ".join(tokens).encode()
+
+
+# Decode a reply holding one int, float or string, as result names
+def decode(wire, result, payload):
+    if wire == "binary":
+        if result is str:
+            return payload[4:].decode()
+        return struct.unpack("<f" if result is float else "<i", payload)[0]
+    if result is str:
+        return payload.split(b" ", 1)[1].decode()
+    return result(payload)
+
+
+class RawClient:
+    def __init__(self, port, wire="text"):
+        self.sock = socket.create_connection(("127.0.0.1", port), 30)
+        self.wire = wire
+        self.request_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.sock.close()
+
+    def send(self, function, *args):
+        self.request_id += 1
+        payload = encode(self.wire, args)
+        self.sock.sendall(HEADER.pack(len(payload), FUNCTION_IDS[function],
+                                      self.request_id) + payload)
+
+    def read(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            data += chunk
+        return data
+
+    # Read a reply, returning its function id, request id and payload
+    def receive(self):
+        length, function_id, request_id = HEADER.unpack(self.read(HEADER.size))
+        return function_id, request_id, self.read(length)
+
+    def call(self, result, function, *args):
+        self.send(function, *args)
+        function_id, request_id, payload = self.receive()
+        assert function_id == FUNCTION_IDS[function]
+        assert request_id == self.request_id
+        return decode(self.wire, result, payload)
+
+
+# Build the lotsofstuff server with the given options, start it and
+# return its port
+def start_lotsofstuff(tmp_path, generate, framework, servers, *flags,
+                      libs=()):
+    stem = generate("lotsofstuff.idl", "--framing=length",
+                    "--server-runtime", *flags)
+    shutil.copyfile(root_file("lotsofstuff.cpp"),
+                    str(tmp_path / "lotsofstuff.cpp"))
+    (tmp_path / "server_main.cpp").write_text(server_main)
+    server = framework(tmp_path / "server", [
+        tmp_path / "server_main.cpp", stem + ".stub.cpp",
+        tmp_path / "lotsofstuff.cpp", framework_file("rpcstubhelper.cpp")],
+        libs)
+    port = free_port()
+    servers([server, str(port)], port)
+    return port
+
+
+def call_everything(client, n):
+    assert client.call(int, "area", n, 3) == 3 * n
+    assert client.call(float, "multiply", 1.5, float(n)) == 1.5 * n
+    assert client.call(str, "upcase", "client %d" % n) == "CLIENT %d" % n
+    assert client.call(int, "takesTwoArrays",
+                       *(list(range(24)) + [n] * 24)) == 45 + 10 * n
+    # s holds m1[4], m2[4][10] and m3[4][10][100], and sum adds up m3
+    assert client.call(int, "sum", *([0] * 44 + [n] * 4000)) == 4000 * n
+    # void functions get no reply
+    client.send("searchRectangles", *([1] * 400))
+    client.send("func1")
+
+
+def run_clients(port, wire="text", clients=CLIENTS, calls=CALLS):
+    errors = []
+
+    def run(i):
+        try:
+            with RawClient(port, wire) as client:
+                for n in range(calls):
+                    call_everything(client, i * calls + n)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+# Send a request naming a function the server does not have, or holding a
+# payload it cannot parse, returning what the server answers before
+# closing the connection
+def call_bad_function(port, function_id, payload=b""):
+    with socket.create_connection(("127.0.0.1", port), 10) as sock:
+        sock.sendall(HEADER.pack(len(payload), function_id, 1) + payload)
+        received = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return received
+            received += chunk
+
+
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_concurrent_clients(tmp_path, generate, framework, servers, wire):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire)
+    run_clients(port, wire)
+
+
+def test_bad_function_drops_only_its_client(tmp_path, generate, framework,
+                                            servers):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers)
+    with RawClient(port) as client:
+        assert client.call(str, "upcase", "before") == "BEFORE"
+        assert call_bad_function(port, 12345) == b""
+        # the connection opened before the bad request still works
+        assert client.call(str, "upcase", "after") == "AFTER"
+    run_clients(port, clients=4, calls=5)
+
+
+def test_bad_requests_among_concurrent_clients(tmp_path, generate,
+                                               framework, servers):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=binary")
+    bad = [threading.Thread(target=call_bad_function, args=(port, 1000 + i))
+           for i in range(8)]
+    for t in bad:
+        t.start()
+    run_clients(port, "binary", clients=8, calls=10)
+    for t in bad:
+        t.join()
+
+
+# Requests whose values run past the end of their payload, a string
+# claiming more bytes than follow it and an area missing its height, drop
+# their own clients while the others are served
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_malformed_requests_among_concurrent_clients(tmp_path, generate,
+                                                     framework, servers,
+                                                     wire):
+    port = start_lotsofstuff(tmp_path, generate, framework, servers,
+                             "--wire=" + wire)
+    truncated = [
+        ("upcase", encode(wire, [0x7fffffff])),
+        ("upcase", encode(wire, [5]) + (b" ab" if wire == "text" else b"ab")),
+        ("area", encode(wire, [3])),
+    ]
+    bad = [threading.Thread(target=call_bad_function,
+                            args=(port, FUNCTION_IDS[function], payload))
+           for function, payload in truncated * 3]
+    for t in bad:
+        t.start()
+    with RawClient(port, wire) as client:
+        run_clients(port, wire, clients=8, calls=10)
+        # the connection opened alongside the bad requests still works
+        assert client.call(str, "upcase", "after") == "AFTER"
+    for t in bad:
+        t.join()
@@ -0,0 +1,156 @@
+#
+#          Proxies and stubs talking through shared memory rings
+#
+#     A lotsofstuff server built with --transport=shm serves clients one
+#     after the other, each mapping its own rings once it has asked for
+#     them over the socket, and clients that never ask over the socket.
+#
+import shutil
+import subprocess
+import time
+
+import pytest
+
+import rpcgenerate
+from conftest import generate_idl, framework_file, root_file
+
+# Calls functions of every kind, printing what came back, then upcases
+# strings of the lengths given: <client> <server> <n> <length>...
+client = \
+    """
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+using namespace std;
+#include "rpcproxyhelper.h"
+using namespace C150NETWORK;
+#include "lotsofstuff.idl"
+
+int main(int argc, char *argv[])
+{
+    rpcproxyinitialize(argv[1]);
+    int n = atoi(argv[2]);
+    s arrays;
+    for (int i = 0; i < 4; i++)
+        for (int j = 0; j < 10; j++)
+            for (int k = 0; k < 100; k++)
+                arrays.m3[i][j][k] = n + k;
+    printf("sum %d\\n", sum(arrays));
+    int x[24], y[24][15], z[24][15];
+    for (int i = 0; i < 24; i++)
+    {
+        x[i] = 1;
+        for (int j = 0; j < 15; j++)
+        {
+            y[i][j] = n;
+            z[i][j] = i;
+        }
+    }
+    printf("showsArraysofArrays %d\\n", showsArraysofArrays(x, y, z));
+    ThreePeople tp;
+    tp.p1.firstname = "Jane";
+    tp.p1.age = tp.p3.age = 0;
+    tp.p2.firstname = "John";
+    tp.p2.lastname = "Doe";
+    tp.p2.age = n;
+    Person p = findPerson(tp);
+    printf("findPerson %s %s %d\\n", p.firstname.c_str(),
+           p.lastname.c_str(), p.age);
+    printf("multiply %g\\n", multiply(1.5, n));
+    func1();
+    for (int i = 3; i < argc; i++)
+    {
+        size_t length = strtoul(argv[i], NULL, 10);
+        string text;
+        for (size_t j = 0; j < length; j++)
+            text += "abcdefgh"[j % 8];
+        string upper = upcase(text);
+        bool same = upper.length() == length;
+        for (size_t j = 0; same && j < length; j++)
+            same = upper[j] == "ABCDEFGH"[j % 8];
+        printf("upcase %zu %s\\n", length, same ? "ok" : "wrong");
+    }
+    return 0;
+}
+"""
+
+LENGTHS = [10, 300000, 5, 3000000, 4096, 4097]
+
+
+def expected(n, lengths):
+    return ["sum %d" % (4000 * n + 40 * 4950),
+            "showsArraysofArrays %d" % (24 + 360 * n + 15 * 276),
+            "findPerson John Doe %d" % n,
+            "multiply %g" % (1.5 * n)] + \
+        ["upcase %d ok" % length for length in lengths]
+
+
+# Build a lotsofstuff server and the client, each generated with its own
+# flags, and start the server
+def build(tmp_path, framework, servers, server_flags, client_flags):
+    binaries = []
+    for name, flags in [("server", server_flags), ("client", client_flags)]:
+        directory = tmp_path / name
+        directory.mkdir()
+        stem = generate_idl(directory, "lotsofstuff.idl", *flags)
+        if name == "server":
+            shutil.copyfile(root_file("lotsofstuff.cpp"),
+                            str(directory / "lotsofstuff.cpp"))
+            sources = [stem + ".stub.cpp", directory / "lotsofstuff.cpp",
+                       framework_file("rpcserver.cpp"),
+                       framework_file("rpcstubhelper.cpp")]
+        else:
+            (directory / "client.cpp").write_text(client)
+            sources = [directory / "client.cpp", stem + ".proxy.cpp",
+                       framework_file("rpcproxyhelper.cpp")]
+        libs = ["-lrt"] + (["-lz"] if "--compress" in flags else [])
+        binaries.append(framework(directory / name, sources, libs))
+
+    servers([binaries[0]])
+    time.sleep(0.5)
+    return binaries[1]
+
+
+def run_client(binary, n, lengths):
+    result = subprocess.run(
+        [binary, "localhost", str(n)] + [str(l) for l in lengths],
+        stdout=subprocess.PIPE, universal_newlines=True, timeout=60)
+    assert result.returncode == 0, result.stdout
+    return result.stdout.splitlines()
+
+
+SHM = ["--framing=length", "--transport=shm"]
+
+
+# Messages many times the ring size wrap around it while the peer reads,
+# and the server takes the next client's rings once the last one is done
+@pytest.mark.parametrize("flags", [
+    SHM, SHM + ["--wire=binary"], SHM + ["--shm-ring-size=4096"],
+    SHM + ["--wire=binary", "--shm-ring-size=4096", "--compress"]])
+def test_clients_served_in_turn(tmp_path, framework, servers, flags):
+    binary = build(tmp_path, framework, servers, flags, flags)
+    for n in range(3):
+        assert run_client(binary, n, LENGTHS) == expected(n, LENGTHS)
+
+
+# Clients generated for the socket transport are served over it
+@pytest.mark.parametrize("wire", ["text", "binary"])
+def test_socket_clients_served(tmp_path, framework, servers, wire):
+    binary = build(tmp_path, framework, servers, SHM + ["--wire=" + wire],
+                   ["--framing=length", "--wire=" + wire])
+    assert run_client(binary, 7, LENGTHS) == expected(7, LENGTHS)
+
+
+@pytest.mark.parametrize("flags, message", [
+    (["--transport=shm"], "--transport=shm requires --framing=length"),
+    (SHM + ["--pool"], "--transport=shm cannot be used with --pool"),
+    (SHM + ["--server-runtime"], "cannot be used with --pool or "
+     "--server-runtime"),
+    (SHM + ["--shm-ring-size=6000"], "--shm-ring-size must be a power of two"),
+    (SHM + ["--shm-ring-size=2048"], "--shm-ring-size must be a power of two"),
+])
+def test_bad_options(capsys, flags, message):
+    with pytest.raises(SystemExit) as e:
+        rpcgenerate.parse_args(flags + ["lotsofstuff.idl"])
+    assert e.value.code == 2
+    assert message in capsys.readouterr().err